@@ -1,19 +1,267 @@
+import json
+import logging
+import re
+from collections import defaultdict
+
 import requests
-from config import LIBRENMS_URL, LIBRENMS_TOKEN
+
+from config import (
+    LIBRENMS_URL, LIBRENMS_TOKEN, LIBRENMS_RATE_LIMIT, LIBRENMS_BURST,
+    HTTP_MAX_RETRIES, HTTP_POOL_SIZE, HTTP_LATENCY_TARGET,
+)
+from http_session import build_session
+from transport import TransportPolicy
+
+log = logging.getLogger(__name__)
+
+SESSION = build_session(headers={"X-Auth-Token": LIBRENMS_TOKEN})
+POLICY = TransportPolicy(
+    "LibreNMS",
+    rate=LIBRENMS_RATE_LIMIT,
+    burst=LIBRENMS_BURST,
+    max_retries=HTTP_MAX_RETRIES,
+    min_concurrency=2,
+    max_concurrency=HTTP_POOL_SIZE,
+    latency_target=HTTP_LATENCY_TARGET,
+)
+
+# Columnas de puerto que usa sync_devices; el resto no se descarga
+PORT_COLUMNS = (
+    "port_id",
+    "device_id",
+    "ifName",
+    "ifDescr",
+    "ifSpeed",
+    "ifOperStatus",
+    "ifPhysAddress",
+    "ifMtu",
+)
+
+
+# Campos de dispositivo que usa la sync (tipo, plataforma e incremental)
+DEVICE_FIELDS = (
+    "device_id",
+    "hostname",
+    "sysName",
+    "ip",
+    "vendor",
+    "os",
+    "hardware",
+    "model",
+    "type",
+    "location",
+    "last_polled",
+    "last_discovered",
+)
+
+
+# Campos de los vecinos (LLDP/CDP...) que usa la sync de cables
+LINK_FIELDS = (
+    "local_device_id",
+    "local_port_id",
+    "remote_device_id",
+    "remote_port_id",
+    "remote_port",
+    "protocol",
+)
+
+
+class _Record:
+    """
+    Registro compacto con solo los campos que usa la sync. Expone `get()` para
+    que las funciones que reciben el dict original sigan funcionando.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, data: dict):
+        for field in self.__slots__:
+            setattr(self, field, data.get(field))
+
+    def get(self, key, default=None):
+        value = getattr(self, key, None) if key in self.__slots__ else None
+        return default if value is None else value
+
+    def __repr__(self):
+        fields = ", ".join(f"{f}={getattr(self, f)!r}" for f in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+class LibreDevice(_Record):
+    __slots__ = DEVICE_FIELDS
+
+
+class LibrePort(_Record):
+    __slots__ = PORT_COLUMNS
+
+
+class LibreLink(_Record):
+    __slots__ = LINK_FIELDS
+
+
+class JsonArrayStream:
+    """
+    Parser incremental del array `key` de un cuerpo JSON: feed() recibe el
+    texto por trozos y devuelve los elementos ya completos; `done` indica
+    que se leyó el `]` de cierre. close() lanza ValueError si la clave no
+    apareció (p.ej. {"status": "error"}) o si el array quedó sin cerrar
+    (respuesta cortada, error de PHP en mitad del JSON): una lista parcial no
+    debe pasar por el inventario completo.
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self.decoder = json.JSONDecoder()
+        self.start = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+        self.buf = ""
+        self.pos = 0
+        self.found = False
+        self.done = False
+
+    def feed(self, chunk: str) -> list:
+        items = []
+        if self.done:
+            return items
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        if not self.found:
+            m = self.start.search(self.buf)
+            if not m:
+                # Conserva la cola por si la clave quedó partida entre dos bloques
+                self.buf = self.buf[-(len(self.key) + 16):]
+                return items
+            self.found = True
+            self.buf = self.buf[m.end():]
+        buf, pos = self.buf, 0
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buf) and buf[pos] == "]":
+                self.done = True
+                break
+            try:
+                obj, pos = self.decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                break  # objeto incompleto: leer más
+            items.append(obj)
+        self.pos = pos
+        return items
+
+    def close(self):
+        if not self.found:
+            raise ValueError(f"la respuesta no contiene el array '{self.key}'")
+        if not self.done:
+            detail = self.buf[self.pos:self.pos + 80].strip()
+            raise ValueError(
+                f"array '{self.key}' incompleto: "
+                + (f"no se pudo decodificar {detail!r}" if detail else "falta el ']' de cierre")
+            )
+
+
+def iter_json_array(resp, key: str, chunk_size: int = 64 * 1024):
+    """
+    Recorre los elementos del array `key` de una respuesta JSON en streaming,
+    sin cargar el cuerpo completo en memoria. ValueError si el array no
+    aparece o no llega completo (ver JsonArrayStream).
+    """
+    resp.encoding = resp.encoding or "utf-8"
+    stream = JsonArrayStream(key)
+    for chunk in resp.iter_content(chunk_size=chunk_size, decode_unicode=True):
+        yield from stream.feed(chunk)
+        if stream.done:
+            return
+    stream.close()
+
+
+def iter_librenms_devices():
+    """Genera LibreDevice a medida que llega la respuesta de LibreNMS."""
+    url = f"{LIBRENMS_URL}/api/v0/devices?limit=0"
+    with POLICY.request(SESSION, "GET", url, timeout=60, stream=True) as resp:
+        resp.raise_for_status()
+        for d in iter_json_array(resp, "devices"):
+            yield LibreDevice(d)
 
 
 def get_librenms_devices():
-    headers = {"X-Auth-Token": LIBRENMS_TOKEN}
     url = f"{LIBRENMS_URL}/api/v0/devices?limit=0"
-    resp = requests.get(url, headers=headers, timeout=60)
+    resp = POLICY.request(SESSION, "GET", url, timeout=60)
     resp.raise_for_status()
     return resp.json().get("devices", [])
 
 
 def get_librenms_device_ports(device_id):
-    headers = {"X-Auth-Token": LIBRENMS_TOKEN}
     url = f"{LIBRENMS_URL}/api/v0/devices/{device_id}/ports?limit=0"
-    resp = requests.get(url, headers=headers, timeout=60)
+    resp = POLICY.request(SESSION, "GET", url, timeout=60)
     resp.raise_for_status()
     return resp.json().get("ports", [])
 
+
+def group_ports_by_device(ports) -> dict | None:
+    by_device = defaultdict(list)
+    for p in ports:
+        if "device_id" not in p:
+            # Versión antigua que ignora `columns`: no se puede agrupar
+            return None
+        by_device[p["device_id"]].append(LibrePort(p))
+    return by_device
+
+
+def get_librenms_ports_by_device() -> dict | None:
+    """
+    Descarga todos los puertos en una sola llamada al endpoint global, con
+    proyección de columnas, y los agrupa por device_id. Devuelve None si la
+    versión de LibreNMS no lo soporta; en ese caso hay que usar
+    get_librenms_device_ports() por dispositivo.
+    """
+    url = f"{LIBRENMS_URL}/api/v0/ports"
+    params = {"columns": ",".join(PORT_COLUMNS)}
+    try:
+        with POLICY.request(SESSION, "GET", url, params=params, timeout=300, stream=True) as resp:
+            resp.raise_for_status()
+            return group_ports_by_device(iter_json_array(resp, "ports"))
+    except (requests.RequestException, ValueError) as e:
+        log.warning("descarga masiva de puertos no disponible (%s), se usa la llamada por dispositivo", e)
+        return None
+
+
+def _address(a: dict) -> str | None:
+    if a.get("ipv4_address"):
+        return f"{a['ipv4_address']}/{a.get('ipv4_prefixlen') or 32}"
+    v6 = a.get("ipv6_compressed") or a.get("ipv6_address")
+    if v6:
+        return f"{v6}/{a.get('ipv6_prefixlen') or 128}"
+    return None
+
+
+def get_librenms_ip_addresses() -> list[tuple[str, str]] | None:
+    """
+    Todas las direcciones IPv4/IPv6 de LibreNMS en una sola llamada, como
+    (port_id, "ip/prefijo"). Devuelve None si el endpoint no está disponible.
+    """
+    url = f"{LIBRENMS_URL}/api/v0/resources/ip/addresses"
+    try:
+        with POLICY.request(SESSION, "GET", url, timeout=300, stream=True) as resp:
+            resp.raise_for_status()
+            return [
+                (str(a.get("port_id")), addr)
+                for a in iter_json_array(resp, "ip_addresses")
+                if a.get("port_id") and (addr := _address(a))
+            ]
+    except (requests.RequestException, ValueError) as e:
+        log.warning("no se pudieron descargar las IPs de LibreNMS (%s)", e)
+        return None
+
+
+def get_librenms_links() -> list[LibreLink] | None:
+    """
+    Todos los vecinos descubiertos por LibreNMS (LLDP, CDP...) en una sola
+    llamada. Devuelve None si el endpoint no está disponible.
+    """
+    url = f"{LIBRENMS_URL}/api/v0/resources/links"
+    try:
+        with POLICY.request(SESSION, "GET", url, timeout=300, stream=True) as resp:
+            resp.raise_for_status()
+            return [LibreLink(link) for link in iter_json_array(resp, "links") if link.get("active", 1)]
+    except (requests.RequestException, ValueError) as e:
+        log.warning("no se pudieron descargar los enlaces de LibreNMS (%s)", e)
+        return None
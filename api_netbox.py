@@ -1,37 +1,157 @@
-import requests
-import yaml
+import ipaddress
+import logging
 import os
 import re
-import ipaddress
-from config import NETBOX_URL, NETBOX_TOKEN, DRY_RUN
-from device_utils import find_in_tree, TREE, ensure_slug
+import requests
+from config import (
+    NETBOX_URL, NETBOX_TOKEN, DRY_RUN, NETBOX_RATE_LIMIT, NETBOX_BURST,
+    HTTP_MAX_RETRIES, HTTP_POOL_SIZE, HTTP_BULK_LATENCY_TARGET, HTTP_LATENCY_TARGET, NETBOX_GRAPHQL_PAGE_SIZE,
+)
+from device_utils import find_in_tree, get_tree_blobs, ensure_slug
+from devicetype_cache import load_device_type_yaml
+from entity_resolver import EntityResolver
+from http_session import build_session
+from resolution_queue import GENERIC, choose_device_type
+from sync_locks import MANUFACTURER_LOCKS, MODEL_LOCKS, SHARED_LOCK
+from transport import TransportPolicy
+from tree_matcher import normalize_slug
+
+log = logging.getLogger(__name__)
 
 HEADERS = {"Authorization": f"Token {NETBOX_TOKEN}", "Content-Type": "application/json"}
+SESSION = build_session(headers=HEADERS)
+POLICY = TransportPolicy(
+    "NetBox",
+    rate=NETBOX_RATE_LIMIT,
+    burst=NETBOX_BURST,
+    max_retries=HTTP_MAX_RETRIES,
+    min_concurrency=2,
+    max_concurrency=HTTP_POOL_SIZE,
+    latency_target=HTTP_LATENCY_TARGET,
+    bulk_latency_target=HTTP_BULK_LATENCY_TARGET,
+)
 
 def nb_get(endpoint, **params):
     url = f"{NETBOX_URL}api/{endpoint}"
-    resp = requests.get(url, params=params, headers=HEADERS, timeout=60)
+    resp = POLICY.request(SESSION, "GET", url, params=params, timeout=60)
     resp.raise_for_status()
     return resp.json()
 
+RESOLVER = EntityResolver(nb_get)
+
+def nb_get_all(endpoint, page_size=1000, **params):
+    """Recorre todas las páginas de un listado de NetBox y devuelve cada objeto."""
+    url = f"{NETBOX_URL}api/{endpoint}"
+    params = {"limit": page_size, **params}
+    while url:
+        resp = POLICY.request(SESSION, "GET", url, params=params, timeout=60)
+        resp.raise_for_status()
+        data = resp.json()
+        yield from data.get("results", [])
+        # "next" ya incluye limit/offset y el resto de filtros
+        url = data.get("next")
+        params = None
+
+class GraphQLError(Exception):
+    """La consulta GraphQL llegó a NetBox pero devolvió errores (campo inexistente, permisos...)."""
+
+
+# Solo lo que la sync y reconcile leen de cada device e interfaz
+DEVICES_QUERY = """
+query Devices($offset: Int!, $limit: Int!) {
+  device_list(pagination: {offset: $offset, limit: $limit}) {
+    id name custom_fields
+    device_type { id } platform { id } primary_ip4 { id } primary_ip6 { id }
+    interfaces { id name description speed enabled mtu mac_address custom_fields }
+  }
+}
+"""
+
+
+def nb_graphql(query, variables=None):
+    url = f"{NETBOX_URL}graphql/"
+    # Es una lectura: se reintenta como un GET aunque vaya por POST
+    resp = POLICY.request(
+        SESSION, "POST", url, idempotent=True, json={"query": query, "variables": variables or {}}, timeout=120
+    )
+    resp.raise_for_status()
+    body = resp.json()
+    if body.get("errors"):
+        raise GraphQLError("; ".join(e.get("message", str(e)) for e in body["errors"]))
+    return body["data"]
+
+def _gql_ref(value):
+    """GraphQL devuelve los ids como texto; se dejan como en REST ({"id": int})."""
+    return {"id": int(value["id"])} if value else None
+
+def nb_graphql_devices(page_size=NETBOX_GRAPHQL_PAGE_SIZE):
+    """
+    Recorre los devices de NetBox con sus interfaces en consultas GraphQL
+    paginadas. Cada device se devuelve con la forma de REST (ids enteros,
+    referencias {"id": ...}) junto a la lista de sus interfaces.
+    """
+    offset = 0
+    while True:
+        page = nb_graphql(DEVICES_QUERY, {"offset": offset, "limit": page_size})["device_list"]
+        for dev in page:
+            device = {
+                "id": int(dev["id"]),
+                "name": dev.get("name"),
+                "custom_fields": dev.get("custom_fields") or {},
+                **{f: _gql_ref(dev.get(f)) for f in ("device_type", "platform", "primary_ip4", "primary_ip6")},
+            }
+            ref = {"id": device["id"], "name": device["name"]}
+            interfaces = [
+                {**iface, "id": int(iface["id"]), "device": ref, "custom_fields": iface.get("custom_fields") or {}}
+                for iface in dev.get("interfaces") or []
+            ]
+            yield device, interfaces
+        if len(page) < page_size:
+            return
+        offset += page_size
+
 def nb_post(endpoint, payload):
     if DRY_RUN:
-        print(f"[DRY_RUN] POST {endpoint} -> {payload}")
+        log.info("[DRY_RUN] POST %s -> %s", endpoint, payload)
         return {}
     url = f"{NETBOX_URL}api/{endpoint}"
-    resp = requests.post(url, json=payload, headers=HEADERS, timeout=60)
+    resp = POLICY.request(SESSION, "POST", url, json=payload, timeout=60)
     try:
         resp.raise_for_status()
     except requests.HTTPError:
-        print("ERROR en nb_post:")
-        print("Request:", url)
-        print("Payload:", payload)
-        print("Status:", resp.status_code)
-        print("Respuesta:", resp.text)
+        log.error(
+            "POST %s -> %s: %s (payload %s)", endpoint, resp.status_code, resp.text, payload,
+            extra={"endpoint": endpoint, "status": resp.status_code},
+        )
         raise
     return resp.json()
 
 
+def _nb_write(method, endpoint, payload):
+    if DRY_RUN:
+        log.info("[DRY_RUN] %s %s -> %s", method, endpoint, payload)
+        return []
+    url = f"{NETBOX_URL}api/{endpoint}"
+    resp = POLICY.request(SESSION, method, url, json=payload, timeout=60)
+    try:
+        resp.raise_for_status()
+    except requests.HTTPError:
+        log.error(
+            "%s %s -> %s: %s", method, endpoint, resp.status_code, resp.text,
+            extra={"endpoint": endpoint, "status": resp.status_code},
+        )
+        raise
+    return resp.json() if resp.content else []
+
+def nb_patch(endpoint, payload):
+    """PATCH de lista: cada elemento lleva su "id" y solo los campos a cambiar."""
+    return _nb_write("PATCH", endpoint, payload)
+
+def nb_delete(endpoint, payload):
+    """DELETE de lista: [{"id": ...}, ...]. NetBox responde 204 sin cuerpo."""
+    return _nb_write("DELETE", endpoint, payload)
+
+
 def get_ip_address_id(address: str | None):
     if not address:
         return None
@@ -44,79 +164,82 @@ def get_ip_address_id(address: str | None):
             return None
         suffix = "32" if ip_obj.version == 4 else "128"
         addr = f"{address}/{suffix}"
-    resp = nb_get("ipam/ip-addresses/", address=addr)
-    if resp.get("count"):
-        return resp["results"][0]["id"]
+    ip_id = RESOLVER.lookup("ip_address", addr)
+    if ip_id:
+        return ip_id
     created = nb_post("ipam/ip-addresses/", {"address": addr, "status": "active"})
+    RESOLVER.store("ip_address", addr, created.get("id"))
     return created.get("id")
 
 def get_or_create_manufacturer_id(slug: str):
     slug = (slug or "").strip().lower()
-    resp = nb_get("dcim/manufacturers/", slug=slug)
-    if resp.get("count", 0):
-        return resp["results"][0]["id"]
+    with MANUFACTURER_LOCKS.hold(slug):
+        return _get_or_create_manufacturer_id(slug)
+
+def _get_or_create_manufacturer_id(slug: str):
+    man_id = RESOLVER.lookup("manufacturer", slug)
+    if man_id:
+        return man_id
+    with SHARED_LOCK.hold() as shared:
+        # En shards, otro proceso puede haberlo creado después del snapshot
+        man_id = RESOLVER.refresh("manufacturer", slug) if shared else None
+        return man_id or _create_manufacturer(slug)
+
+def _create_manufacturer(slug: str):
     data = {"name": slug.capitalize(), "slug": slug}
     try:
         created = nb_post("dcim/manufacturers/", data)
-        return created.get("id")
+        man_id = created.get("id")
     except requests.HTTPError:
         resp = nb_get("dcim/manufacturers/", slug=slug)
-        if resp.get("count", 0):
-            return resp["results"][0]["id"]
-        raise
+        if not resp.get("count", 0):
+            raise
+        man_id = resp["results"][0]["id"]
+    RESOLVER.store("manufacturer", slug, man_id)
+    return man_id
 
 def get_device_type_id(vendor: str, fname: str):
-    vendor = vendor.lower().strip()
-    slug_key = fname.strip().lower()
-    if not vendor or not slug_key or not TREE:
+    # Misma normalización que device_type_importer: el mapeo y la cola de
+    # resolución se indexan por (vendor, modelo)
+    vendor = normalize_slug(vendor)
+    slug_key = normalize_slug(fname)
+    if not vendor or not slug_key:
+        return None
+    with MODEL_LOCKS.hold(slug_key):
+        return _get_device_type_id(vendor, slug_key)
+
+def _get_device_type_id(vendor: str, slug_key: str):
+    dt_id = RESOLVER.lookup("device_type", slug_key)
+    if dt_id:
+        return dt_id
+    # El árbol solo se carga si el tipo no existe ya en NetBox
+    if not get_tree_blobs():
         return None
-    q = nb_get("dcim/device-types/", slug=slug_key)
-    if q.get("count", 0):
-        return q["results"][0]["id"]
     relpath, suggestions = find_in_tree(vendor, slug_key)
     if not relpath:
-        if suggestions:
-            print(f"No encontró '{slug_key}'. Sugerencias:")
-            for idx, path in enumerate(suggestions, 1):
-                print(f"  {idx}) {path}")
-            gen_idx = len(suggestions) + 1
-            print(f"  {gen_idx}) [GENÉRICO] Crear tipo de dispositivo genérico")
-            choice = input(f"Elige número (1-{gen_idx}) o ENTER para saltar: ")
-            if choice.isdigit():
-                sel = int(choice) - 1
-                if 0 <= sel < len(suggestions):
-                    relpath = suggestions[sel]
-                elif sel == len(suggestions):
-                    man_id = get_or_create_manufacturer_id("generic")
-                    check = nb_get("dcim/device-types/", slug="generic")
-                    if check.get('count'):
-                        return check["results"][0]["id"]
-                    data = {
-                        "manufacturer": man_id,
-                        "model": "generic",
-                        "slug": "generic"
-                    }
-                    if DRY_RUN:
-                        print("DRY-IMPORT GENERIC", data)
-                        return 0
-                    created = nb_post("dcim/device-types/", data)
-                    return created.get("id")
+        relpath = choose_device_type(vendor, slug_key, suggestions)
+        if relpath == GENERIC:
+            man_id = get_or_create_manufacturer_id("generic")
+            generic_id = RESOLVER.lookup("device_type", "generic")
+            if generic_id:
+                return generic_id
+            data = {
+                "manufacturer": man_id,
+                "model": "generic",
+                "slug": "generic"
+            }
+            if DRY_RUN:
+                log.info("DRY-IMPORT GENERIC %s", data)
+                return 0
+            created = nb_post("dcim/device-types/", data)
+            RESOLVER.store("device_type", "generic", created.get("id"))
+            return created.get("id")
         if not relpath:
-            print(f"Descartado '{slug_key}' (sin matching)")
+            log.info("Descartado '%s' (sin matching)", slug_key)
             return None
-    url = f"https://raw.githubusercontent.com/netbox-community/devicetype-library/master/{relpath}"
-    print(f"Importando device-type → {url}")
-    raw_data = None
-    for attempt in range(5):
-        try:
-            resp = requests.get(url, timeout=20)
-            if resp.status_code == 200:
-                raw_data = yaml.safe_load(resp.text)
-                break
-        except requests.RequestException:
-            pass
+    log.info("Importando device-type → %s", relpath)
+    raw_data = load_device_type_yaml(relpath)
     if raw_data is None:
-        print(f"No se pudo descargar {url} tras 5 intentos")
         return None
     filename = os.path.basename(relpath)
     base = filename[:-5]
@@ -129,11 +252,12 @@ def get_device_type_id(vendor: str, fname: str):
         "slug": clean_slug
     }
     if DRY_RUN:
-        print("DRY-IMPORT", data)
+        log.info("DRY-IMPORT %s", data)
         return 0
     try:
         created = nb_post("dcim/device-types/", data)
-        return created.get("id")
     except Exception as e:
-        print(f"ERROR al crear device-type {clean_slug}: {e}")
-        return None
\ No newline at end of file
+        log.error("al crear device-type %s: %s", clean_slug, e)
+        return None
+    RESOLVER.store("device_type", clean_slug, created.get("id"))
+    return created.get("id")
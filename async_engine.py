@@ -0,0 +1,362 @@
+import asyncio
+import codecs
+import logging
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+
+try:
+    import aiohttp
+except ImportError:  # dependencia opcional: solo la necesita el motor asyncio
+    aiohttp = None
+
+from config import (
+    ASYNC_CONCURRENCY,
+    BULK_PORTS_MIN_DEVICES,
+    DEFAULT_ROLE_SLUG,
+    DEFAULT_SITE_SLUG,
+    DRY_RUN,
+    LIBRENMS_TOKEN,
+    LIBRENMS_URL,
+    NB_BULK_SIZE,
+    NETBOX_URL,
+    SYNC_CABLES,
+    SYNC_IP_ADDRESSES,
+)
+from api_librenms import PORT_COLUMNS, JsonArrayStream, LibreDevice, LibrePort
+from api_librenms import POLICY as LIBRENMS_POLICY
+from api_netbox import HEADERS as NB_HEADERS
+from api_netbox import POLICY as NB_POLICY
+from cable_sync import sync_cables
+from ip_sync import management_ip, sync_ip_addresses
+from metrics import METRICS, endpoint_label
+from netbox_snapshot import NetBoxSnapshot
+from resolution_queue import RESOLUTIONS
+from sync_devices import (
+    get_role_id,
+    get_site_id,
+    missing_interfaces,
+    plan_device,
+    record_created_device,
+    record_created_interface,
+)
+from transport import POST_RETRY_STATUS, RETRY_STATUS, backoff_delay, parse_retry_after
+
+log = logging.getLogger(__name__)
+
+LIBRENMS_HEADERS = {"X-Auth-Token": LIBRENMS_TOKEN}
+TIMEOUT = 60
+
+
+def _params(params: dict) -> dict:
+    # aiohttp solo acepta str/int/float en la query
+    return {k: str(v).lower() if isinstance(v, bool) else v for k, v in params.items()}
+
+
+@asynccontextmanager
+async def policy_request(policy, session, method: str, url: str, idempotent: bool | None = None, **kwargs):
+    """
+    TransportPolicy.request() para aiohttp: el mismo token bucket, límite
+    AIMD y reintentos con backoff que el motor de hilos, con el estado
+    compartido (POLICY de api_netbox / api_librenms). Entrega la respuesta
+    sin leer el cuerpo, para poder recorrerla en streaming.
+    """
+    if idempotent is None:
+        idempotent = method.upper() != "POST"
+    label = endpoint_label(url)
+    bulk = isinstance(kwargs.get("json"), list)
+    attempt = 0
+    while True:
+        await policy.bucket.acquire_async()
+        async with policy.aimd.slot_async():
+            start = time.monotonic()
+            try:
+                resp = await session.request(method, url, **kwargs)
+            except aiohttp.ClientError as e:
+                policy.record(method, label, "error", time.monotonic() - start, bulk=bulk)
+                # Un POST cuya conexión falló al establecerse no llegó al servidor
+                if not (idempotent or isinstance(e, aiohttp.ClientConnectorError)) or attempt >= policy.max_retries:
+                    raise
+                retry_after = None
+            except asyncio.TimeoutError:
+                policy.record(method, label, "timeout", time.monotonic() - start, bulk=bulk)
+                if not idempotent or attempt >= policy.max_retries:
+                    raise
+                retry_after = None
+            else:
+                policy.record(method, label, resp.status, time.monotonic() - start, resp.content_length or 0, bulk)
+                allowed = RETRY_STATUS if idempotent else POST_RETRY_STATUS
+                if resp.status not in allowed or attempt >= policy.max_retries:
+                    try:
+                        yield resp
+                    finally:
+                        resp.release()
+                    return
+                retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+                resp.release()
+        delay = backoff_delay(attempt, retry_after)
+        log.debug("%s: reintento %d de %s %s en %.1fs", policy.name, attempt + 1, method, url, delay)
+        await asyncio.sleep(delay)
+        attempt += 1
+
+
+async def iter_json_array_async(resp, key: str, chunk_size: int = 64 * 1024):
+    """iter_json_array() sobre una respuesta de aiohttp."""
+    decoder = codecs.getincrementaldecoder(resp.charset or "utf-8")()
+    stream = JsonArrayStream(key)
+    async for chunk in resp.content.iter_chunked(chunk_size):
+        for obj in stream.feed(decoder.decode(chunk)):
+            yield obj
+        if stream.done:
+            return
+    for obj in stream.feed(decoder.decode(b"", final=True)):
+        yield obj
+    stream.close()
+
+
+# --- LibreNMS ---
+
+async def iter_librenms_devices_async(session):
+    """Genera LibreDevice a medida que llega la respuesta de LibreNMS."""
+    url = f"{LIBRENMS_URL}/api/v0/devices?limit=0"
+    async with policy_request(LIBRENMS_POLICY, session, "GET", url, headers=LIBRENMS_HEADERS) as resp:
+        resp.raise_for_status()
+        async for d in iter_json_array_async(resp, "devices"):
+            yield LibreDevice(d)
+
+
+async def get_librenms_device_ports_async(session, device_id):
+    url = f"{LIBRENMS_URL}/api/v0/devices/{device_id}/ports?limit=0"
+    async with policy_request(LIBRENMS_POLICY, session, "GET", url, headers=LIBRENMS_HEADERS) as resp:
+        resp.raise_for_status()
+        return (await resp.json()).get("ports", [])
+
+
+async def get_librenms_ports_by_device_async(session):
+    """Como get_librenms_ports_by_device(): None si no se puede usar el endpoint global."""
+    url = f"{LIBRENMS_URL}/api/v0/ports"
+    params = {"columns": ",".join(PORT_COLUMNS)}
+    by_device = defaultdict(list)
+    try:
+        async with policy_request(
+            LIBRENMS_POLICY, session, "GET", url, params=params, headers=LIBRENMS_HEADERS
+        ) as resp:
+            resp.raise_for_status()
+            async for p in iter_json_array_async(resp, "ports"):
+                if "device_id" not in p:
+                    # Versión antigua que ignora `columns`: no se puede agrupar
+                    return None
+                by_device[p["device_id"]].append(LibrePort(p))
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+        log.warning("descarga masiva de puertos no disponible (%s), se usa la llamada por dispositivo", e)
+        return None
+    return by_device
+
+
+# --- NetBox ---
+
+async def nb_get_async(session, endpoint, **params):
+    url = f"{NETBOX_URL}api/{endpoint}"
+    async with policy_request(NB_POLICY, session, "GET", url, params=_params(params), headers=NB_HEADERS) as resp:
+        resp.raise_for_status()
+        return await resp.json()
+
+
+async def nb_get_all_async(session, endpoint, page_size=1000, **params):
+    url = f"{NETBOX_URL}api/{endpoint}"
+    params = _params({"limit": page_size, **params})
+    while url:
+        async with policy_request(NB_POLICY, session, "GET", url, params=params, headers=NB_HEADERS) as resp:
+            resp.raise_for_status()
+            data = await resp.json()
+        for obj in data.get("results", []):
+            yield obj
+        url = data.get("next")
+        params = None
+
+
+async def nb_post_async(session, endpoint, payload):
+    if DRY_RUN:
+        log.info("[DRY_RUN] POST %s -> %s", endpoint, payload)
+        return {}
+    url = f"{NETBOX_URL}api/{endpoint}"
+    async with policy_request(NB_POLICY, session, "POST", url, json=payload, headers=NB_HEADERS) as resp:
+        if resp.status >= 400:
+            log.error(
+                "POST %s -> %s: %s", endpoint, resp.status, await resp.text(),
+                extra={"endpoint": endpoint, "status": resp.status},
+            )
+        resp.raise_for_status()
+        return await resp.json()
+
+
+async def load_snapshot_async(session) -> NetBoxSnapshot:
+    """Equivalente a NetBoxSnapshot.load() leyendo todas las colecciones a la vez."""
+    snap = NetBoxSnapshot()
+
+    async def collect(endpoint, **params):
+        return [obj async for obj in nb_get_all_async(session, endpoint, **params)]
+
+    (manufacturers, device_types, platforms, sites, roles, devices, interfaces) = await asyncio.gather(
+        collect("dcim/manufacturers/"),
+        collect("dcim/device-types/"),
+        collect("dcim/platforms/"),
+        collect("dcim/sites/"),
+        collect("dcim/device-roles/"),
+        collect("dcim/devices/", cf_librenms_id__empty="false"),
+        collect("dcim/interfaces/"),
+    )
+    snap.manufacturers.update((o["slug"], o["id"]) for o in manufacturers)
+    snap.device_types.update((o["slug"], o["id"]) for o in device_types)
+    snap.platforms.update((o["slug"], o["id"]) for o in platforms)
+    snap.sites.update((o["slug"], o["id"]) for o in sites)
+    snap.roles.update((o["slug"], o["id"]) for o in roles)
+    for o in devices:
+        snap.add_device(o.get("custom_fields", {}).get("librenms_id"), o["id"])
+        snap.set_primary_ips(o["id"], o)
+    for o in interfaces:
+        snap.add_interface(
+            o["device"]["id"], o["name"], o["id"], (o.get("custom_fields") or {}).get("librenms_port_id")
+        )
+    snap.seed_resolver()
+    return snap
+
+
+async def bulk_post_async(session, sem, endpoint, items, on_created, chunk_size=NB_BULK_SIZE):
+    """
+    Versión asyncio de BulkWriter: envía `items` [(clave, payload)] en POSTs de
+    lista concurrentes y parte en dos los bloques que no pasan la validación
+    (400). Un 429/5xx tras los reintentos falla el bloque entero. Devuelve
+    las claves que NetBox no aceptó.
+    """
+    failed = []
+
+    async def post_chunk(chunk):
+        try:
+            async with sem:
+                created = await nb_post_async(session, endpoint, [p for _, p in chunk])
+        except aiohttp.ClientResponseError as e:
+            if e.status != 400:
+                log.error(
+                    "bulk POST %s: bloque de %d objetos fallido (HTTP %s), no se parte", endpoint, len(chunk), e.status,
+                    extra={"endpoint": endpoint, "status": e.status},
+                )
+                failed.extend(key for key, _ in chunk)
+                return
+            if len(chunk) == 1:
+                log.error("bulk %s: objeto %s rechazado", endpoint, chunk[0][0], extra={"endpoint": endpoint, "key": chunk[0][0]})
+                failed.append(chunk[0][0])
+                return
+            mid = len(chunk) // 2
+            await asyncio.gather(post_chunk(chunk[:mid]), post_chunk(chunk[mid:]))
+            return
+        for (key, _), obj in zip(chunk, created or []):
+            on_created(key, obj)
+
+    chunks = [items[i : i + chunk_size] for i in range(0, len(items), chunk_size)]
+    await asyncio.gather(*(post_chunk(c) for c in chunks))
+    return failed
+
+
+async def sync_devices_async(concurrency: int = ASYNC_CONCURRENCY):
+    """
+    Motor asyncio equivalente a sync_devices(): mismas decisiones y payloads,
+    pero las descargas de puertos y los POSTs se lanzan concurrentemente,
+    con como mucho `concurrency` peticiones en vuelo y la misma política de
+    transporte (token bucket, AIMD, reintentos) que el motor de hilos. Las
+    etapas de IPs y cables son las del motor de hilos.
+    """
+    if aiohttp is None:
+        raise RuntimeError("El motor asyncio necesita aiohttp (pip install aiohttp)")
+
+    METRICS.reset()
+    sem = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    # Sin límite total: el listado de devices se lee mientras se procesa
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=TIMEOUT, sock_read=TIMEOUT)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        with METRICS.phase("snapshot"):
+            snapshot = await load_snapshot_async(session)
+        try:
+            site_id = get_site_id(DEFAULT_SITE_SLUG)
+            role_id = get_role_id(DEFAULT_ROLE_SLUG)
+        except Exception as e:
+            log.error("%s", e)
+            return
+
+        # Fase 1: la resolución de device-types puede preguntar al usuario o ir
+        # a GitHub, así que se hace en un hilo y en orden, como en el modo síncrono.
+        # Los dispositivos se procesan a medida que llegan de LibreNMS
+        synced, new_devices, mgmt_ips = [], [], {}
+        with METRICS.phase("device_upsert"):
+            async for d in iter_librenms_devices_async(session):
+                mgmt_ips[d.get("device_id")] = management_ip(d)
+                start = time.monotonic()
+                planned = await asyncio.to_thread(plan_device, d, snapshot, site_id, role_id)
+                METRICS.observe_device(d.get("device_id"), time.monotonic() - start)
+                if not planned:
+                    continue
+                lid, nm, payload = planned
+                if payload:
+                    new_devices.append((lid, payload))
+                synced.append((lid, nm))
+            failed_devs = await bulk_post_async(
+                session, sem, "dcim/devices/", new_devices,
+                lambda lid, obj: record_created_device(snapshot, lid, obj),
+            )
+        METRICS.incr("devices_total", len(mgmt_ips))
+        log.info("LibreNMS → %d devices", len(mgmt_ips))
+
+        # Fase 2: puertos de todos los dispositivos en paralelo
+        interface_start = time.monotonic()
+        ports_by_device = None
+        if len(synced) >= BULK_PORTS_MIN_DEVICES:
+            with METRICS.phase("ports_fetch"):
+                ports_by_device = await get_librenms_ports_by_device_async(session)
+
+        async def device_interfaces(lid, nm):
+            nb_dev_id = snapshot.device_id(lid)
+            if not nb_dev_id and not DRY_RUN:
+                log.warning("SKIP interfaces de %s: el dispositivo no se pudo crear", nm)
+                return []
+            if ports_by_device is not None:
+                ports = ports_by_device.pop(lid, [])
+            else:
+                async with sem:
+                    ports = await get_librenms_device_ports_async(session, lid)
+            missing = missing_interfaces(ports, nm, nb_dev_id, snapshot)
+            log.info(
+                "%s: %d puertos, %d interfaces nuevas", nm, len(ports), len(missing),
+                extra={"librenms_id": lid, "ports": len(ports), "new_interfaces": len(missing)},
+            )
+            return missing
+
+        per_device = await asyncio.gather(*(device_interfaces(lid, nm) for lid, nm in synced))
+        new_ifs = [item for items in per_device for item in items]
+        failed_ifs = await bulk_post_async(
+            session, sem, "dcim/interfaces/", new_ifs,
+            lambda port_id, obj: record_created_interface(snapshot, obj),
+        )
+        METRICS.add_phase("interface_sync", time.monotonic() - interface_start)
+
+    # IPs y cables son unas pocas peticiones en bloque: se reutilizan las
+    # etapas del motor de hilos tal cual, fuera del bucle de eventos
+    if SYNC_IP_ADDRESSES:
+        with METRICS.phase("ip_sync"):
+            await asyncio.to_thread(sync_ip_addresses, snapshot, mgmt_ips)
+    if SYNC_CABLES:
+        with METRICS.phase("cable_sync"):
+            await asyncio.to_thread(sync_cables, snapshot)
+
+    RESOLUTIONS.save()
+
+    if failed_devs or failed_ifs:
+        log.error("Bulk con errores: %d devices, %d interfaces rechazadas", len(failed_devs), len(failed_ifs))
+    METRICS.incr("devices_failed", len(failed_devs))
+    METRICS.incr("interfaces_failed", len(failed_ifs))
+    log.info("%s", METRICS.summary())
+    METRICS.write()
+
+
+def run_async_sync(concurrency: int = ASYNC_CONCURRENCY):
+    asyncio.run(sync_devices_async(concurrency))
@@ -0,0 +1,118 @@
+"""
+Compara TreeMatcher con el ranking original de difflib: coincidencia de
+resultados y tiempo por búsqueda.
+
+    python -m benchmarks.bench_find_in_tree              # árbol sintético
+    python -m benchmarks.bench_find_in_tree --real       # árbol real (caché/GitHub)
+"""
+import argparse
+import difflib
+import random
+import string
+import time
+
+from tree_matcher import TreeMatcher, basename, normalize_slug, path_vendor, rank_difflib
+
+VENDORS = 120
+
+
+def synthetic_tree(size: int, seed: int = 1) -> list[str]:
+    rnd = random.Random(seed)
+    paths = []
+    for i in range(size):
+        # La mitad con espacios, como "Palo Alto Networks": el vendor buscado llega normalizado
+        n = rnd.randrange(VENDORS)
+        vendor = f"Vendor{n}" if n % 2 else f"Vendor {n} Networks"
+        family = rnd.choice(["ws-c", "dcs-", "ex", "ds", "ap-", "sg", "mx", "fg-", "n9k-c", "srx"])
+        model = f"{family}{rnd.randrange(100, 9999)}{rnd.choice(['', '-48p', '-24t', 'x', '+', '-poe'])}"
+        paths.append(f"device-types/{vendor}/{model}.yaml")
+    return sorted(set(paths))
+
+
+def perturb(name: str, rnd: random.Random) -> str:
+    chars = list(name.lower())
+    for _ in range(rnd.randint(1, 3)):
+        op = rnd.random()
+        pos = rnd.randrange(len(chars)) if chars else 0
+        if op < 0.4 and chars:
+            del chars[pos]
+        elif op < 0.8:
+            chars.insert(pos, rnd.choice(string.ascii_lowercase + string.digits))
+        elif chars:
+            chars[pos] = rnd.choice(string.digits)
+    return "".join(chars)
+
+
+def make_queries(paths: list[str], count: int, seed: int = 2) -> list[tuple[str, str]]:
+    rnd = random.Random(seed)
+    queries = []
+    for path in rnd.sample(paths, min(count, len(paths))):
+        # Como import_device_type_if_exists: vendor y modelo pasan por normalize_slug
+        vendor = normalize_slug(path.split("/")[1])
+        queries.append((vendor, perturb(path.rsplit("/", 1)[1][:-5], rnd)))
+    return queries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", type=int, default=6000, help="rutas del árbol sintético")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--real", action="store_true", help="usar el árbol real de devicetype-library")
+    args = parser.parse_args()
+
+    if args.real:
+        from device_utils import get_tree
+
+        paths = get_tree()
+    else:
+        paths = synthetic_tree(args.size)
+    queries = make_queries(paths, args.queries)
+
+    start = time.perf_counter()
+    matcher = TreeMatcher(paths)
+    build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    expected = [rank_difflib(paths, v, s) for v, s in queries]
+    t_difflib = time.perf_counter() - start
+
+    start = time.perf_counter()
+    got = [list(matcher._suggest(v, s)) for v, s in queries]
+    t_matcher = time.perf_counter() - start
+
+    for v, s in queries:
+        matcher.suggest(v, s)
+    start = time.perf_counter()
+    for v, s in queries:
+        matcher.suggest(v, s)
+    t_cached = time.perf_counter() - start
+
+    def scores(slug, paths_):
+        return [round(difflib.SequenceMatcher(None, slug, basename(p)).ratio(), 6) for p in paths_]
+
+    same = sum(e == g for e, g in zip(expected, got))
+    # Mismas puntuaciones: solo difiere el desempate entre rutas igual de parecidas
+    same_scores = sum(
+        scores(s, e) == scores(s, g) for (_, s), e, g in zip(queries, expected, got)
+    )
+    top1 = sum(bool(e) and bool(g) and e[0] == g[0] for e, g in zip(expected, got))
+    # Búsquedas resueltas dentro de la partición del fabricante (top-1 del mismo vendor)
+    in_vendor = sum(bool(g) and path_vendor(g[0]) == v for (v, _), g in zip(queries, got))
+    partitioned = sum(bool(matcher.by_vendor.get(v)) for v, _ in queries)
+    overlap = sum(len(set(e) & set(g)) for e, g in zip(expected, got)) / max(
+        1, sum(len(e) for e in expected)
+    )
+    n = len(queries)
+    print(f"árbol: {len(paths)} rutas, {n} búsquedas, índice construido en {build * 1000:.1f} ms")
+    print(f"difflib:     {t_difflib / n * 1000:8.3f} ms/búsqueda")
+    print(f"TreeMatcher: {t_matcher / n * 1000:8.3f} ms/búsqueda (x{t_difflib / max(t_matcher, 1e-9):.0f})")
+    print(f"TreeMatcher (repetida, caché): {t_cached / n * 1000:8.4f} ms/búsqueda")
+    print(
+        f"resultados idénticos: {same}/{n}, mismas puntuaciones: {same_scores}/{n}, "
+        f"mismo top-1: {top1}/{n}, solape: {overlap:.1%}"
+    )
+    print(f"partición por fabricante: {partitioned}/{n} búsquedas con partición, top-1 del fabricante en {in_vendor}/{n}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+"""
+Mide sync_devices() de extremo a extremo contra los servidores de
+benchmarks.standins, sin tocar producción: tiempo total, peticiones y pico
+de memoria en una ejecución en frío (NetBox vacío) y otra en caliente
+(todo sincronizado ya).
+
+    python -m benchmarks.bench_sync --devices 1000 --ports 24 --workers 8
+    python -m benchmarks.bench_sync --latency 20 --error-rate 0.02 --incremental
+    NETBOX_GRAPHQL=true python -m benchmarks.bench_sync   # foto de NetBox por GraphQL
+    python -m benchmarks.bench_sync --compare-engines     # hilos y asyncio dejan el mismo NetBox
+"""
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import requests
+
+from benchmarks.inventory import ROLE_SLUG, SITE_SLUG, generate, write_library
+from benchmarks.standins import serve
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def start_standin(kind: str, inventory: dict, **options) -> tuple[multiprocessing.Process, str]:
+    """Servidor en otro proceso, para que ni su CPU ni su memoria cuenten en la medida."""
+    parent, child = multiprocessing.Pipe()
+    proc = multiprocessing.Process(target=serve, args=(kind, inventory, child), kwargs=options, daemon=True)
+    proc.start()
+    return proc, f"http://127.0.0.1:{parent.recv()}"
+
+
+def server_stats(url: str, reset: bool = False) -> dict:
+    stats = requests.get(f"{url}/_bench/stats", timeout=30).json()
+    if reset:
+        requests.post(f"{url}/_bench/reset", timeout=30)
+    return stats
+
+
+def _ref(value):
+    return value.get("id") if isinstance(value, dict) else value
+
+
+def canonical_state(tables: dict) -> dict:
+    """
+    Estado de NetBox sin ids (dependen del orden de creación, distinto en
+    cada motor): cada objeto por su clave natural y sus referencias por la
+    clave natural del objeto apuntado.
+    """
+    def table(endpoint):
+        return tables.get(endpoint, [])
+
+    slugs = {
+        endpoint: {o["id"]: o.get("slug") for o in table(endpoint)}
+        for endpoint in ("dcim/manufacturers/", "dcim/device-types/", "dcim/platforms/")
+    }
+    device_name = {o["id"]: o.get("name") for o in table("dcim/devices/")}
+    iface_key = {o["id"]: (device_name.get(_ref(o.get("device"))), o.get("name")) for o in table("dcim/interfaces/")}
+    address = {o["id"]: o.get("address") for o in table("ipam/ip-addresses/")}
+    return {
+        "device-types": sorted(
+            (o.get("slug"), o.get("model"), slugs["dcim/manufacturers/"].get(_ref(o.get("manufacturer"))))
+            for o in table("dcim/device-types/")
+        ),
+        "devices": sorted(
+            (
+                o.get("name"),
+                slugs["dcim/device-types/"].get(_ref(o.get("device_type"))),
+                slugs["dcim/platforms/"].get(_ref(o.get("platform"))),
+                json.dumps(o.get("custom_fields"), sort_keys=True),
+                address.get(_ref(o.get("primary_ip4"))),
+                address.get(_ref(o.get("primary_ip6"))),
+            )
+            for o in table("dcim/devices/")
+        ),
+        "interfaces": sorted(
+            (*iface_key[o["id"]], o.get("description"), o.get("speed"), o.get("enabled"), o.get("mac_address"),
+             json.dumps(o.get("custom_fields"), sort_keys=True))
+            for o in table("dcim/interfaces/")
+        ),
+        "ip-addresses": sorted(
+            (o.get("address"), iface_key.get(o.get("assigned_object_id"))) for o in table("ipam/ip-addresses/")
+        ),
+        "cables": sorted(
+            sorted(iface_key.get(t.get("object_id")) for t in o.get("a_terminations", []) + o.get("b_terminations", []))
+            for o in table("dcim/cables/")
+        ),
+    }
+
+
+def compare_engines(netbox_url: str, runs: dict) -> bool:
+    """Ejecuta en frío cada motor de `runs` sobre el mismo NetBox inicial y compara el estado final."""
+    states = {}
+    for engine, run in runs.items():
+        requests.post(f"{netbox_url}/_bench/restore", timeout=30)
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            run()
+        states[engine] = canonical_state(requests.get(f"{netbox_url}/_bench/dump", timeout=300).json())
+    (first, reference), *others = states.items()
+    equal = True
+    for engine, state in others:
+        for kind, objs in reference.items():
+            if state[kind] != objs:
+                equal = False
+                diff = len({repr(x) for x in objs} ^ {repr(x) for x in state[kind]})
+                print(f"{kind}: {first} {len(objs)}, {engine} {len(state[kind])} ({diff} distintos)")
+    counts = ", ".join(f"{len(objs)} {kind}" for kind, objs in reference.items())
+    print(f"motores {' / '.join(states)}: {'mismo estado final' if equal else 'ESTADO DISTINTO'} ({counts})")
+    return equal
+
+
+def configure(workdir: str, librenms_url: str, netbox_url: str):
+    """config.py lee el entorno al importarse: hay que fijarlo antes del primer import."""
+    os.environ.update(
+        LIBRENMS_URL=librenms_url,
+        LIBRENMS_TOKEN="bench",
+        NETBOX_URL=f"{netbox_url}/",
+        NETBOX_TOKEN="bench",
+        DEFAULT_SITE_SLUG=SITE_SLUG,
+        DEFAULT_ROLE_SLUG=ROLE_SLUG,
+        DRY_RUN="false",
+        INTERACTIVE="false",
+        DEVICETYPE_LIBRARY_PATH=os.path.join(workdir, "library"),
+        # El log se formatea y escribe como en una ejecución real, pero a ningún sitio
+        LOG_FILE=os.devnull,
+    )
+    # Estado, cachés e informes en el directorio temporal
+    os.chdir(workdir)
+    if REPO not in sys.path:
+        sys.path.insert(0, REPO)
+
+
+def run_scenario(name: str, run, urls: dict, trace: bool) -> dict:
+    for url in urls.values():
+        server_stats(url, reset=True)
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        run()
+    wall = time.perf_counter() - start
+    peak = None
+    if trace:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    from metrics import METRICS
+
+    stats = {kind: server_stats(url) for kind, url in urls.items()}
+    return {
+        "scenario": name,
+        "wall": round(wall, 3),
+        "requests": {kind: s["total"] for kind, s in stats.items()},
+        "by_endpoint": {kind: s["requests"] for kind, s in stats.items()},
+        "netbox_objects": stats["netbox"]["objects"],
+        "peak_python_mb": round(peak / 2**20, 1) if peak is not None else None,
+        "maxrss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "phases": METRICS.report()["phases"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--devices", type=int, default=500)
+    parser.add_argument("--ports", type=int, default=24, help="puertos por dispositivo")
+    parser.add_argument("--models", type=int, default=50, help="modelos distintos en el inventario")
+    parser.add_argument("--hit-rate", type=float, default=0.8, help="fracción de modelos ya presentes en NetBox")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--engine", choices=["threads", "async"], default="threads")
+    parser.add_argument("--incremental", action="store_true", help="añade una ejecución en caliente con --incremental")
+    parser.add_argument("--latency", type=float, default=0.0, help="ms añadidos a cada petición")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fracción de peticiones que fallan")
+    parser.add_argument("--error-status", type=int, default=429)
+    parser.add_argument("--log-level", default="INFO", help="nivel de log de la sync (el log va a /dev/null)")
+    parser.add_argument("--no-tracemalloc", action="store_true", help="no medir memoria (tracemalloc ralentiza)")
+    parser.add_argument("--json", help="guarda los resultados en este fichero")
+    parser.add_argument(
+        "--compare-engines", action="store_true",
+        help="al final, repite la ejecución en frío con los dos motores y compara el estado de NetBox",
+    )
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_sync_")
+    inventory = generate(args.devices, args.ports, args.hit_rate, args.models)
+    write_library(os.path.join(workdir, "library"), inventory["library"])
+    options = {"latency": args.latency / 1000, "error_rate": args.error_rate, "error_status": args.error_status}
+    procs, urls = [], {}
+    for kind in ("librenms", "netbox"):
+        proc, urls[kind] = start_standin(kind, inventory, **options)
+        procs.append(proc)
+    json_path = os.path.abspath(args.json) if args.json else None
+    configure(workdir, urls["librenms"], urls["netbox"])
+    from sync_logging import setup_logging
+
+    setup_logging(args.log_level)
+
+    def run_async(incremental=False):
+        from async_engine import run_async_sync
+
+        run_async_sync(concurrency=args.workers * 4)
+
+    def run_threads(incremental=False):
+        from sync_devices import sync_devices
+
+        sync_devices(workers=args.workers, incremental=incremental)
+
+    run = run_async if args.engine == "async" else run_threads
+
+    scenarios = [("frío", lambda: run(args.incremental)), ("caliente", run)]
+    if args.incremental:
+        scenarios.append(("caliente incremental", lambda: run(True)))
+    trace = not args.no_tracemalloc
+    results = []
+    try:
+        for name, fn in scenarios:
+            results.append(run_scenario(name, fn, urls, trace))
+        equivalent = None
+        if args.compare_engines:
+            equivalent = compare_engines(urls["netbox"], {"threads": run_threads, "async": run_async})
+    finally:
+        for proc in procs:
+            proc.terminate()
+
+    print(
+        f"inventario: {args.devices} devices x {args.ports} puertos, {args.models} modelos, "
+        f"hit rate {args.hit_rate:.0%}, latencia {args.latency:g} ms, errores {args.error_rate:.1%}, "
+        f"{args.engine} x{args.workers}"
+    )
+    print(f"{'escenario':<22}{'tiempo':>9}{'LibreNMS':>10}{'NetBox':>8}{'pico Python':>13}{'maxrss':>9}")
+    for r in results:
+        peak = f"{r['peak_python_mb']:.1f} MB" if r["peak_python_mb"] is not None else "-"
+        print(
+            f"{r['scenario']:<22}{r['wall']:>8.2f}s{r['requests']['librenms']:>10}"
+            f"{r['requests']['netbox']:>8}{peak:>13}{r['maxrss_mb']:>6.0f} MB"
+        )
+    objects = results[-1]["netbox_objects"]
+    print(
+        f"NetBox: {objects.get('dcim/devices/', 0)} devices, {objects.get('dcim/interfaces/', 0)} interfaces, "
+        f"{objects.get('dcim/device-types/', 0)} device-types, {objects.get('ipam/ip-addresses/', 0)} IPs, "
+        f"{objects.get('dcim/cables/', 0)} cables"
+    )
+    if json_path:
+        with open(json_path, "w", encoding="utf-8") as fh:
+            json.dump(
+                {"args": vars(args), "results": results, "engines_equivalent": equivalent},
+                fh, indent=2, ensure_ascii=False,
+            )
+    if equivalent is False:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
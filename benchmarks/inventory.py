@@ -0,0 +1,158 @@
+"""
+Inventario sintético para los benchmarks: N dispositivos de LibreNMS con M
+puertos cada uno, el estado inicial de NetBox y un checkout mínimo de
+devicetype-library con los modelos que NetBox aún no tiene.
+"""
+import os
+import random
+import re
+
+SITE_SLUG = "bench-site"
+ROLE_SLUG = "bench-role"
+VENDORS = ("Cisco", "Juniper", "Arista", "HPE", "Fortinet", "Ubiquiti")
+PLATFORMS = ("ios", "iosxe", "junos", "eos", "procurve", "fortios")
+FAMILIES = ("ws-c", "ex", "dcs-", "aruba-", "fg-", "usw-")
+SUFFIXES = ("", "-24t", "-48p", "x", "-poe")
+
+
+def normalize_slug(text: str) -> str:
+    # Igual que device_type_importer.normalize_slug, sin importar el módulo:
+    # config se lee al importar y el benchmark aún no ha fijado el entorno
+    text = re.sub(r"[\s_]+", "-", text.lower().strip()).replace("+", "-plus")
+    return re.sub(r"-+", "-", re.sub(r"[^a-z0-9\-]", "", text)).strip("-")
+
+
+def make_models(count: int, rnd: random.Random) -> list[tuple[str, str]]:
+    """(fabricante, modelo) distintos, con los nombres que reportaría LibreNMS."""
+    models = set()
+    while len(models) < count:
+        i = rnd.randrange(len(VENDORS))
+        model = f"{FAMILIES[i]}{rnd.randrange(1000, 9999)}{rnd.choice(SUFFIXES)}".upper()
+        models.add((VENDORS[i], model))
+    return sorted(models)
+
+
+def generate(devices: int, ports: int, hit_rate: float = 0.8, models: int = 50, seed: int = 1) -> dict:
+    """
+    Devuelve {"librenms": {"devices", "ports", "addresses", "links"}, "netbox": {endpoint: [objs]},
+    "library": {ruta: yaml}}. `hit_rate` es la fracción de modelos que ya
+    existen como device-type en NetBox; el resto hay que importarlos del
+    checkout local.
+    """
+    rnd = random.Random(seed)
+    catalog = make_models(max(1, min(models, devices)), rnd)
+    hits = set(rnd.sample(range(len(catalog)), round(hit_rate * len(catalog))))
+
+    lnms_devices, lnms_ports, lnms_addresses = [], [], []
+    port_id = 0
+    for device_id in range(1, devices + 1):
+        vendor, model = catalog[rnd.randrange(len(catalog))]
+        mgmt = f"10.{device_id >> 16 & 255}.{device_id >> 8 & 255}.{device_id & 255}"
+        lnms_devices.append(
+            {
+                "device_id": device_id,
+                "hostname": f"bench-{device_id:06d}",
+                "sysName": f"bench-{device_id:06d}.example.net",
+                "ip": mgmt,
+                "vendor": vendor,
+                "os": PLATFORMS[VENDORS.index(vendor) % len(PLATFORMS)],
+                "hardware": model,
+                "type": "network",
+                "last_polled": "2024-01-01 00:00:00",
+                "last_discovered": "2024-01-01 00:00:00",
+                "status": 1,
+            }
+        )
+        for j in range(ports):
+            port_id += 1
+            lnms_ports.append(
+                {
+                    "port_id": port_id,
+                    "device_id": device_id,
+                    "ifName": f"Gi1/0/{j + 1}",
+                    "ifDescr": f"GigabitEthernet1/0/{j + 1}",
+                    "ifSpeed": 1000000000,
+                    "ifOperStatus": "up" if rnd.random() < 0.7 else "down",
+                    "ifPhysAddress": "00:00:5e:%02x:%02x:%02x" % (device_id >> 8 & 255, device_id & 255, j & 255),
+                    "ifMtu": 1500,
+                    "ifAlias": "",
+                }
+            )
+            # La IP de gestión en el primer puerto y una IPv6 en cada uno
+            if j == 0:
+                lnms_addresses.append({"ipv4_address": mgmt, "ipv4_prefixlen": 24, "port_id": port_id})
+            lnms_addresses.append(
+                {"ipv6_compressed": f"2001:db8:{device_id:x}::{j + 1:x}", "ipv6_prefixlen": 64, "port_id": port_id}
+            )
+
+    # Topología en cadena: el último puerto de cada device con el penúltimo del
+    # siguiente, visto por LLDP desde los dos lados, y un vecino que no está en
+    # LibreNMS (teléfono, AP...) cada 10 devices
+    lnms_links = []
+
+    def port_of(device_id, j):
+        return (device_id - 1) * ports + j + 1
+
+    for device_id in range(2, devices + 1 if ports >= 2 else 0):
+        a = (device_id - 1, port_of(device_id - 1, ports - 1), f"Gi1/0/{ports}")
+        b = (device_id, port_of(device_id, ports - 2), f"Gi1/0/{ports - 1}")
+        for (ld, lp, _), (rd, rp, rname) in ((a, b), (b, a)):
+            lnms_links.append(
+                {
+                    "id": len(lnms_links) + 1, "protocol": "lldp", "active": 1,
+                    "local_device_id": ld, "local_port_id": lp,
+                    "remote_device_id": rd, "remote_port_id": rp, "remote_port": rname,
+                    "remote_hostname": f"bench-{rd:06d}",
+                }
+            )
+    for device_id in range(10, devices + 1, 10):
+        lnms_links.append(
+            {
+                "id": len(lnms_links) + 1, "protocol": "cdp", "active": 1,
+                "local_device_id": device_id, "local_port_id": port_of(device_id, 0),
+                "remote_device_id": 0, "remote_port_id": 0, "remote_port": "Port 1",
+                "remote_hostname": f"phone-{device_id}",
+            }
+        )
+
+    netbox = {
+        "dcim/sites/": [{"id": 1, "name": "Bench", "slug": SITE_SLUG}],
+        "dcim/device-roles/": [{"id": 1, "name": "Bench", "slug": ROLE_SLUG}],
+        "dcim/platforms/": [{"id": i, "name": p, "slug": p} for i, p in enumerate(PLATFORMS, 1)],
+        "dcim/manufacturers/": [],
+        "dcim/device-types/": [],
+    }
+    manufacturers = {}
+    library = {}
+    for i, (vendor, model) in enumerate(catalog):
+        if i in hits:
+            slug = normalize_slug(vendor)
+            if slug not in manufacturers:
+                manufacturers[slug] = len(manufacturers) + 1
+                netbox["dcim/manufacturers/"].append({"id": manufacturers[slug], "name": vendor, "slug": slug})
+            netbox["dcim/device-types/"].append(
+                {
+                    "id": len(netbox["dcim/device-types/"]) + 1,
+                    "manufacturer": {"id": manufacturers[slug]},
+                    "model": model,
+                    "slug": normalize_slug(model),
+                }
+            )
+        else:
+            library[f"device-types/{vendor}/{model}.yaml"] = (
+                f"manufacturer: {vendor}\nmodel: {model}\nslug: {vendor.lower()}-{normalize_slug(model)}\n"
+                f"u_height: 1\n"
+            )
+    return {
+        "librenms": {"devices": lnms_devices, "ports": lnms_ports, "addresses": lnms_addresses, "links": lnms_links},
+        "netbox": netbox,
+        "library": library,
+    }
+
+
+def write_library(root: str, library: dict):
+    for relpath, text in library.items():
+        path = os.path.join(root, relpath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as fh:
+            fh.write(text)
@@ -0,0 +1,422 @@
+"""
+Servidores locales que imitan la parte de la API v0 de LibreNMS y de la API
+REST de NetBox que usa la sync: listados paginados con `next`, filtros
+simples, POST/PATCH/DELETE de objeto o de lista (atómicos, como NetBox),
+la consulta GraphQL `device_list` paginada, latencia configurable y errores
+inyectados.
+
+    python -m benchmarks.standins --devices 200 --ports 24   # hasta Ctrl+C
+
+Rutas de control (no cuentan como peticiones):
+    GET  /_bench/stats   peticiones por método/endpoint y objetos en NetBox
+    POST /_bench/reset   pone a cero los contadores
+    POST /_bench/restore vuelve NetBox a su estado inicial
+    GET  /_bench/dump    todos los objetos de NetBox por endpoint
+"""
+import argparse
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+from benchmarks.inventory import generate
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 1000
+
+# Campos obligatorios y claves únicas de lo que crea la sync
+REQUIRED = {
+    "dcim/manufacturers/": ("name", "slug"),
+    "dcim/device-types/": ("manufacturer", "model", "slug"),
+    "dcim/devices/": ("device_type", "role", "site"),
+    "dcim/interfaces/": ("device", "name", "type"),
+    "ipam/ip-addresses/": ("address",),
+    "dcim/cables/": ("a_terminations", "b_terminations"),
+}
+UNIQUE = {
+    "dcim/manufacturers/": ("slug",),
+    "dcim/device-types/": ("slug",),
+    "dcim/interfaces/": ("device", "name"),
+}
+# Claves foráneas que NetBox devuelve anidadas ({"id": ...})
+NESTED = ("manufacturer", "device_type", "role", "site", "platform", "device")
+
+_GQL_TOKEN = re.compile(r"[A-Za-z_]\w*|[{}]")
+
+
+def gql_selection(query: str, root: str) -> dict:
+    """Campos pedidos bajo `root` en una consulta GraphQL sencilla: {campo: subselección o None}."""
+    tokens = _GQL_TOKEN.findall(re.sub(r"\([^()]*\)", "", query))
+
+    def parse(pos):
+        fields, pos = {}, pos + 1
+        while tokens[pos] != "}":
+            name, pos = tokens[pos], pos + 1
+            if tokens[pos] == "{":
+                fields[name], pos = parse(pos)
+            else:
+                fields[name] = None
+        return fields, pos + 1
+
+    return parse(tokens.index(root) + 1)[0]
+
+
+def gql_project(obj: dict | None, selection: dict):
+    """Como GraphQL: solo los campos pedidos y los ids como texto."""
+    if obj is None:
+        return None
+    out = {}
+    for field, sub in selection.items():
+        value = obj.get(field)
+        if sub is None:
+            out[field] = str(value) if field == "id" and value is not None else value
+        else:
+            ref = value if isinstance(value, dict) or value is None else {"id": value}
+            out[field] = gql_project(ref, sub)
+    return out
+
+
+def _id(value):
+    return value.get("id") if isinstance(value, dict) else value
+
+
+class LibreNMSApp:
+    def __init__(self, devices: list[dict], ports: list[dict], addresses: list[dict] = (), links: list[dict] = ()):
+        self.devices = devices
+        self.ports = ports
+        self.addresses = list(addresses)
+        self.links = list(links)
+        self.ports_by_device: dict[int, list[dict]] = {}
+        for p in ports:
+            self.ports_by_device.setdefault(p["device_id"], []).append(p)
+
+    def handle(self, method, path, query, body, base_url):
+        if method != "GET":
+            return 405, {"status": "error", "message": "Method not allowed"}
+        parts = path.strip("/").split("/")
+        if parts[:3] == ["api", "v0", "devices"] and len(parts) == 3:
+            return 200, {"status": "ok", "count": len(self.devices), "devices": self.devices}
+        if parts[:3] == ["api", "v0", "devices"] and len(parts) == 5 and parts[4] == "ports":
+            ports = self.ports_by_device.get(int(parts[3]), [])
+            return 200, {"status": "ok", "count": len(ports), "ports": ports}
+        if parts == ["api", "v0", "ports"]:
+            ports = self.ports
+            if query.get("columns"):
+                columns = query["columns"].split(",")
+                ports = [{c: p.get(c) for c in columns} for p in ports]
+            return 200, {"status": "ok", "count": len(ports), "ports": ports}
+        if parts == ["api", "v0", "resources", "ip", "addresses"]:
+            return 200, {"status": "ok", "count": len(self.addresses), "ip_addresses": self.addresses}
+        if parts == ["api", "v0", "resources", "links"]:
+            return 200, {"status": "ok", "count": len(self.links), "links": self.links}
+        return 404, {"status": "error", "message": "Not found"}
+
+    def objects(self) -> dict:
+        return {
+            "devices": len(self.devices), "ports": len(self.ports),
+            "addresses": len(self.addresses), "links": len(self.links),
+        }
+
+    def restore(self):
+        pass  # solo lectura: no hay nada que deshacer
+
+    def dump(self) -> dict:
+        return {}
+
+
+class NetBoxApp:
+    def __init__(self, seed: dict[str, list[dict]]):
+        self._lock = threading.Lock()
+        self._seed = json.dumps(seed)
+        self.restore()
+
+    def restore(self):
+        """Vuelve al estado inicial (`seed`), p.ej. para repetir una ejecución en frío."""
+        with self._lock:
+            self.tables: dict[str, dict[int, dict]] = {}
+            self.ids: dict[str, itertools.count] = {}
+            for endpoint, objs in json.loads(self._seed).items():
+                table = self._table(endpoint)
+                for obj in objs:
+                    table[obj["id"]] = obj
+                self.ids[endpoint] = itertools.count(max(table, default=0) + 1)
+
+    def dump(self) -> dict:
+        with self._lock:
+            return {endpoint: list(table.values()) for endpoint, table in self.tables.items()}
+
+    def _table(self, endpoint: str) -> dict[int, dict]:
+        if endpoint not in self.tables:
+            self.tables[endpoint] = {}
+            self.ids[endpoint] = itertools.count(1)
+        return self.tables[endpoint]
+
+    @staticmethod
+    def _matches(obj: dict, query: dict) -> bool:
+        for key, value in query.items():
+            if key in ("limit", "offset", "brief"):
+                continue
+            if key.startswith("cf_") and key.endswith("__empty"):
+                empty = (obj.get("custom_fields") or {}).get(key[3:-7]) in (None, "")
+                if empty != (value == "true"):
+                    return False
+            elif key.endswith("_id") and key[:-3] in NESTED:
+                if str(_id(obj.get(key[:-3]))) != value:
+                    return False
+            elif str(obj.get(key)) != value:
+                return False
+        return True
+
+    def _list(self, endpoint, path, query, base_url):
+        limit = min(int(query.get("limit", PAGE_SIZE)) or MAX_PAGE_SIZE, MAX_PAGE_SIZE)
+        offset = int(query.get("offset", 0))
+        with self._lock:
+            found = [o for o in self._table(endpoint).values() if self._matches(o, query)]
+        nxt = None
+        if offset + limit < len(found):
+            rest = {k: v for k, v in query.items() if k not in ("limit", "offset")}
+            nxt = f"{base_url}{path}?" + urlencode({"limit": limit, "offset": offset + limit, **rest})
+        return 200, {"count": len(found), "next": nxt, "previous": None, "results": found[offset : offset + limit]}
+
+    def _validate(self, endpoint, item, seen) -> dict | None:
+        missing = [f for f in REQUIRED.get(endpoint, ()) if item.get(f) in (None, "")]
+        if missing:
+            return {f: ["This field is required."] for f in missing}
+        unique = UNIQUE.get(endpoint)
+        if unique:
+            key = tuple(_id(item.get(f)) for f in unique)
+            if key in seen:
+                return {"__all__": [f"{endpoint} with this {'/'.join(unique)} already exists."]}
+            seen.add(key)
+        if endpoint == "dcim/cables/":
+            # Como NetBox: cada extremo es una interfaz existente y sin cable
+            interfaces = self._table("dcim/interfaces/")
+            for side in ("a_terminations", "b_terminations"):
+                for term in item[side]:
+                    iface = interfaces.get(term.get("object_id"))
+                    if iface is None or iface.get("cable") or term["object_id"] in seen:
+                        return {side: [f"Interface {term.get('object_id')} is missing or already cabled."]}
+                    seen.add(term["object_id"])
+        return None
+
+    def _create(self, endpoint, body):
+        items = body if isinstance(body, list) else [body]
+        with self._lock:
+            table = self._table(endpoint)
+            unique = UNIQUE.get(endpoint)
+            seen = {tuple(_id(o.get(f)) for f in unique) for o in table.values()} if unique else set()
+            errors = [self._validate(endpoint, item, seen) for item in items]
+            if any(errors):
+                # NetBox crea las listas en una transacción: todo o nada
+                return 400, errors if isinstance(body, list) else errors[0]
+            created = []
+            for item in items:
+                obj = dict(item)
+                obj["id"] = next(self.ids[endpoint])
+                for field in NESTED:
+                    if field in obj and not isinstance(obj[field], dict):
+                        obj[field] = {"id": obj[field]}
+                if endpoint == "dcim/interfaces/":
+                    device = self.tables.get("dcim/devices/", {}).get(obj["device"]["id"], {})
+                    obj["device"]["name"] = device.get("name")
+                if endpoint == "dcim/cables/":
+                    interfaces = self._table("dcim/interfaces/")
+                    for term in obj["a_terminations"] + obj["b_terminations"]:
+                        interfaces[term["object_id"]]["cable"] = {"id": obj["id"]}
+                table[obj["id"]] = obj
+                created.append(obj)
+        return 201, created if isinstance(body, list) else created[0]
+
+    def _update(self, endpoint, body):
+        items = body if isinstance(body, list) else [body]
+        with self._lock:
+            table = self._table(endpoint)
+            if any(item.get("id") not in table for item in items):
+                return 400, {"detail": "Object not found."}
+            updated = []
+            for item in items:
+                obj = table[item["id"]]
+                for field, value in item.items():
+                    if field == "custom_fields":
+                        obj.setdefault("custom_fields", {}).update(value)
+                    elif field in NESTED and not isinstance(value, dict):
+                        obj[field] = {"id": value}
+                    else:
+                        obj[field] = value
+                updated.append(obj)
+        return 200, updated if isinstance(body, list) else updated[0]
+
+    def _delete(self, endpoint, body):
+        items = body if isinstance(body, list) else [body]
+        with self._lock:
+            table = self._table(endpoint)
+            if any(item.get("id") not in table for item in items):
+                return 404, {"detail": "Not found."}
+            for item in items:
+                del table[item["id"]]
+                if endpoint == "dcim/devices/":
+                    # Como en NetBox: las interfaces se borran con su dispositivo
+                    interfaces = self.tables.get("dcim/interfaces/", {})
+                    for iid in [i for i, o in interfaces.items() if _id(o.get("device")) == item["id"]]:
+                        del interfaces[iid]
+        return 204, None
+
+    def _graphql(self, body):
+        text = (body or {}).get("query", "")
+        if "device_list" not in text:
+            return 200, {"data": None, "errors": [{"message": "Only device_list is supported by the stand-in"}]}
+        selection = gql_selection(text, "device_list")
+        variables = body.get("variables") or {}
+        offset, limit = int(variables.get("offset", 0)), int(variables.get("limit", PAGE_SIZE))
+        iface_selection = selection.pop("interfaces", None)
+        with self._lock:
+            devices = list(self._table("dcim/devices/").values())[offset : offset + limit]
+            by_device = {}
+            if iface_selection is not None:
+                wanted = {d["id"] for d in devices}
+                for iface in self._table("dcim/interfaces/").values():
+                    if _id(iface.get("device")) in wanted:
+                        by_device.setdefault(_id(iface.get("device")), []).append(iface)
+            page = []
+            for dev in devices:
+                out = gql_project(dev, selection)
+                if iface_selection is not None:
+                    out["interfaces"] = [gql_project(i, iface_selection) for i in by_device.get(dev["id"], [])]
+                page.append(out)
+        return 200, {"data": {"device_list": page}}
+
+    def handle(self, method, path, query, body, base_url):
+        if path == "/graphql/" and method == "POST":
+            return self._graphql(body)
+        if not path.startswith("/api/"):
+            return 404, {"detail": "Not found."}
+        endpoint = path[len("/api/") :]
+        if method == "GET":
+            return self._list(endpoint, path, query, base_url)
+        if method == "POST":
+            return self._create(endpoint, body)
+        if method == "PATCH":
+            return self._update(endpoint, body)
+        if method == "DELETE":
+            return self._delete(endpoint, body)
+        return 405, {"detail": f'Method "{method}" not allowed.'}
+
+    def objects(self) -> dict:
+        with self._lock:
+            return {endpoint: len(table) for endpoint, table in self.tables.items()}
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, como un servidor real
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status: int, obj=None, headers: dict | None = None):
+        body = json.dumps(obj).encode() if obj is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _dispatch(self, method: str):
+        srv = self.server
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+
+        if url.path == "/_bench/stats":
+            return self._send(200, {"requests": dict(srv.stats), "total": sum(srv.stats.values()), "objects": srv.app.objects()})
+        if url.path == "/_bench/reset":
+            srv.stats.clear()
+            return self._send(200, {})
+        if url.path == "/_bench/restore":
+            srv.app.restore()
+            return self._send(200, {})
+        if url.path == "/_bench/dump":
+            return self._send(200, srv.app.dump())
+
+        label = "/".join(":id" if part.isdigit() else part for part in url.path.split("/"))
+        with srv.stats_lock:
+            srv.stats[f"{method} {label}"] += 1
+        if srv.latency:
+            time.sleep(srv.latency)
+        if srv.error_rate and random.random() < srv.error_rate:
+            return self._send(srv.error_status, {"detail": "injected error"}, {"Retry-After": "0"})
+        status, obj = srv.app.handle(method, url.path, query, body, srv.base_url)
+        self._send(status, obj)
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_PATCH(self):
+        self._dispatch("PATCH")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, app, latency: float = 0.0, error_rate: float = 0.0, error_status: int = 429, port: int = 0):
+        super().__init__(("127.0.0.1", port), StandInHandler)
+        self.app = app
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.stats: Counter = Counter()
+        self.stats_lock = threading.Lock()
+        self.base_url = f"http://127.0.0.1:{self.server_port}"
+
+
+def serve(kind: str, inventory: dict, conn=None, port: int = 0, **options):
+    """Arranca el servidor `kind` ("librenms" o "netbox"); envía el puerto por `conn` si se da."""
+    if kind == "librenms":
+        lnms = inventory["librenms"]
+        app = LibreNMSApp(lnms["devices"], lnms["ports"], lnms.get("addresses", ()), lnms.get("links", ()))
+    else:
+        app = NetBoxApp(inventory["netbox"])
+    server = StandInServer(app, port=port, **options)
+    if conn is not None:
+        conn.send(server.server_port)
+        conn.close()
+    server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--devices", type=int, default=100)
+    parser.add_argument("--ports", type=int, default=24)
+    parser.add_argument("--hit-rate", type=float, default=0.8)
+    parser.add_argument("--librenms-port", type=int, default=8001)
+    parser.add_argument("--netbox-port", type=int, default=8002)
+    parser.add_argument("--latency", type=float, default=0.0, help="ms por petición")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    inventory = generate(args.devices, args.ports, args.hit_rate)
+    options = {"latency": args.latency / 1000, "error_rate": args.error_rate}
+    threading.Thread(
+        target=serve, args=("librenms", inventory), kwargs={"port": args.librenms_port, **options}, daemon=True
+    ).start()
+    print(f"LIBRENMS_URL=http://127.0.0.1:{args.librenms_port}")
+    print(f"NETBOX_URL=http://127.0.0.1:{args.netbox_port}/")
+    serve("netbox", inventory, port=args.netbox_port, **options)
+
+
+if __name__ == "__main__":
+    main()
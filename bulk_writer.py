@@ -0,0 +1,99 @@
+import logging
+import threading
+
+import requests
+
+from api_netbox import nb_delete, nb_patch, nb_post
+from config import NB_BULK_SIZE
+
+log = logging.getLogger(__name__)
+
+
+SENDERS = {"POST": nb_post, "PATCH": nb_patch, "DELETE": nb_delete}
+
+
+class BulkWriter:
+    """
+    Acumula payloads para un endpoint de NetBox y los envía como un POST de
+    lista por cada bloque de `chunk_size` objetos (o PATCH/DELETE de lista
+    según `method`; en esos casos cada payload lleva el "id" del objeto).
+
+    Cada payload va acompañado de una clave de origen (p.ej. el `device_id` o
+    el `port_id` de LibreNMS). Tras cada envío, `ids` mapea esa clave al id
+    devuelto por NetBox. Si un bloque falla la validación (400) se parte en
+    dos y se reintenta cada mitad hasta aislar el objeto problemático, que se
+    guarda en `failed` sin bloquear al resto. Cualquier otro error (429 o 5xx
+    tras los reintentos de la política de transporte, permisos...) no es
+    culpa de un objeto: el bloque entero va a `failed` de una vez.
+
+    Es seguro compartirlo entre workers: el bloque lleno se separa bajo lock y
+    se envía fuera de él, de modo que los demás pueden seguir encolando.
+    """
+
+    def __init__(self, endpoint: str, chunk_size: int = NB_BULK_SIZE, on_created=None, method: str = "POST"):
+        self.endpoint = endpoint
+        self.method = method
+        self._send = SENDERS[method]
+        self.chunk_size = max(1, chunk_size)
+        self.on_created = on_created
+        self.pending: list[tuple] = []
+        self.ids: dict = {}
+        self.failed: list[tuple] = []
+        self._lock = threading.Lock()
+
+    def add(self, key, payload: dict):
+        with self._lock:
+            self.pending.append((key, payload))
+            if len(self.pending) < self.chunk_size:
+                return
+            chunk = self._take_chunk()
+        self._post_chunk(chunk)
+
+    def flush(self):
+        while True:
+            with self._lock:
+                if not self.pending:
+                    return
+                chunk = self._take_chunk()
+            self._post_chunk(chunk)
+
+    def _take_chunk(self) -> list[tuple]:
+        chunk = self.pending[: self.chunk_size]
+        self.pending = self.pending[self.chunk_size :]
+        return chunk
+
+    def _post_chunk(self, chunk: list[tuple]):
+        try:
+            created = self._send(self.endpoint, [payload for _, payload in chunk])
+        except requests.HTTPError as e:
+            status = getattr(e.response, "status_code", None)
+            if status != 400:
+                log.error(
+                    "bulk %s %s: bloque de %d objetos fallido (HTTP %s), no se parte",
+                    self.method, self.endpoint, len(chunk), status,
+                    extra={"endpoint": self.endpoint, "status": status},
+                )
+                with self._lock:
+                    self.failed.extend((key, payload, e) for key, payload in chunk)
+                return
+            if len(chunk) == 1:
+                key, payload = chunk[0]
+                log.error(
+                    "bulk %s %s: objeto %s rechazado: %s",
+                    self.method, self.endpoint, key, getattr(e.response, "text", e),
+                    extra={"endpoint": self.endpoint, "key": key},
+                )
+                with self._lock:
+                    self.failed.append((key, payload, e))
+                return
+            # Bisección para aislar el objeto inválido
+            mid = len(chunk) // 2
+            self._post_chunk(chunk[:mid])
+            self._post_chunk(chunk[mid:])
+            return
+        # NetBox devuelve los objetos en el mismo orden que la lista enviada
+        for (key, _), obj in zip(chunk, created or []):
+            with self._lock:
+                self.ids[key] = obj.get("id")
+            if self.on_created:
+                self.on_created(key, obj)
@@ -0,0 +1,155 @@
+import logging
+from collections import defaultdict
+
+from api_librenms import get_librenms_links
+from api_netbox import nb_get_all
+from bulk_writer import BulkWriter
+from metrics import METRICS
+
+log = logging.getLogger(__name__)
+
+CABLE_ENDPOINT = "dcim/cables/"
+INTERFACE_TYPE = "dcim.interface"
+
+
+def pair_key(a: int, b: int) -> tuple[int, int]:
+    """Clave canónica de un enlace entre dos interfaces: la misma en los dos sentidos."""
+    return (a, b) if a <= b else (b, a)
+
+
+def port_index(snapshot) -> dict[tuple[str, str], int]:
+    """
+    (librenms device_id, port_id) -> id de la interfaz en NetBox, a partir
+    de la foto. Un puerto solo entra si su interfaz cuelga del device de
+    NetBox que corresponde a ese device_id.
+    """
+    librenms_id = {dev: lid for lid, dev in snapshot.devices_by_librenms_id.items()}
+    index = {}
+    for port_id, iface in snapshot.interfaces_by_port.items():
+        lid = librenms_id.get(snapshot.interface_device.get(iface))
+        if lid is not None:
+            index[(lid, port_id)] = iface
+    return index
+
+
+class CableIndex:
+    """
+    dcim/cables de NetBox leídos una sola vez: interfaz -> interfaces del
+    otro extremo de su cable. Los cables creados en la ejecución se anotan
+    aquí.
+    """
+
+    def __init__(self):
+        self.peers: dict[int, set[int]] = {}
+
+    @classmethod
+    def load(cls):
+        index = cls()
+        for obj in nb_get_all(CABLE_ENDPOINT):
+            index.add(obj)
+        log.debug("Índice de cables NetBox: %d interfaces cableadas", len(index.peers))
+        return index
+
+    @staticmethod
+    def _interfaces(terminations) -> set[int]:
+        return {
+            t.get("object_id") for t in terminations or []
+            if t.get("object_type") == INTERFACE_TYPE and t.get("object_id")
+        }
+
+    def add(self, obj: dict):
+        a = self._interfaces(obj.get("a_terminations"))
+        b = self._interfaces(obj.get("b_terminations"))
+        for iface in a:
+            self.peers.setdefault(iface, set()).update(b)
+        for iface in b:
+            self.peers.setdefault(iface, set()).update(a)
+
+    def cabled(self, iface: int) -> bool:
+        return iface in self.peers
+
+    def connects(self, a: int, b: int) -> bool:
+        return b in self.peers.get(a, ())
+
+
+def resolve_remote(snapshot, index: dict, link) -> int | None:
+    """
+    Interfaz de NetBox del vecino: por su port_id si LibreNMS lo tiene
+    descubierto y, si no, por el nombre de puerto que anuncia el vecino.
+    """
+    remote_lid = link.get("remote_device_id")
+    if not remote_lid:
+        return None
+    iface = index.get((str(remote_lid), str(link.get("remote_port_id"))))
+    if iface is None and link.get("remote_port"):
+        iface = snapshot.interface_id(snapshot.device_id(remote_lid), link.get("remote_port"))
+    return iface
+
+
+def sync_cables(snapshot, only_devices: set | None = None):
+    """
+    Crea en bloque los dcim/cables que faltan entre interfaces que LibreNMS
+    ve como vecinas (LLDP, CDP...). Ambos extremos se resuelven en memoria
+    con port_index(), así que el coste crece con el número de enlaces y no
+    hay una consulta a NetBox por vecino. El mismo enlace visto desde los
+    dos lados cuenta una vez (pair_key). No se toca una interfaz ya
+    cableada ni una con varios vecinos (hub, enlace que cambió y LibreNMS
+    aún no ha olvidado).
+
+    Con `only_devices` (ids de NetBox, p.ej. los de un shard) cada cable lo
+    crea solo el shard dueño del device del primer extremo de su clave. Un
+    cable hacia un device que otro shard está creando en la misma pasada
+    queda para la siguiente ejecución.
+    """
+    links = get_librenms_links()
+    if links is None:
+        return
+    index = port_index(snapshot)
+    cables = CableIndex.load()
+
+    pairs = set()
+    neighbours = defaultdict(set)
+    unresolved = 0
+    for link in links:
+        local = index.get((str(link.get("local_device_id")), str(link.get("local_port_id"))))
+        remote = resolve_remote(snapshot, index, link)
+        if not local or not remote or local == remote:
+            # Con shards cada enlace sin resolver lo cuenta el dueño del extremo local
+            if only_devices is None or snapshot.device_id(link.get("local_device_id")) in only_devices:
+                unresolved += 1
+            continue
+        pairs.add(pair_key(local, remote))
+        neighbours[local].add(remote)
+        neighbours[remote].add(local)
+
+    writer = BulkWriter(CABLE_ENDPOINT, on_created=lambda key, obj: cables.add(obj))
+    existing = conflicts = 0
+    for a, b in pairs:
+        if only_devices is not None and snapshot.interface_device.get(a) not in only_devices:
+            continue
+        if cables.connects(a, b):
+            existing += 1
+            continue
+        if len(neighbours[a]) > 1 or len(neighbours[b]) > 1 or cables.cabled(a) or cables.cabled(b):
+            conflicts += 1
+            log.debug("Cable %s-%s: alguna interfaz ya está cableada o tiene varios vecinos", a, b)
+            continue
+        writer.add(
+            (a, b),
+            {
+                "a_terminations": [{"object_type": INTERFACE_TYPE, "object_id": a}],
+                "b_terminations": [{"object_type": INTERFACE_TYPE, "object_id": b}],
+                "status": "connected",
+            },
+        )
+    writer.flush()
+
+    METRICS.incr("cables_created", len(writer.ids))
+    METRICS.incr("cables_existing", existing)
+    METRICS.incr("cables_conflicts", conflicts)
+    METRICS.incr("links_unresolved", unresolved)
+    log.info(
+        "Cables → %d enlaces en LibreNMS, %d pares, %d creados, %d ya existían, %d en conflicto, "
+        "%d sin resolver, %d rechazados",
+        len(links), len(pairs), len(writer.ids), existing, conflicts, unresolved, len(writer.failed),
+    )
@@ -9,4 +9,67 @@ NETBOX_URL = os.getenv("NETBOX_URL")
 NETBOX_TOKEN = os.getenv("NETBOX_TOKEN")
 DEFAULT_SITE_SLUG = os.getenv("DEFAULT_SITE_SLUG")
 DEFAULT_ROLE_SLUG = os.getenv("DEFAULT_ROLE_SLUG")
-DRY_RUN = os.getenv("DRY_RUN", "false").lower() == "true"
\ No newline at end of file
+DRY_RUN = os.getenv("DRY_RUN", "false").lower() == "true"
+NB_BULK_SIZE = int(os.getenv("NB_BULK_SIZE", "500"))
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "20"))
+ASYNC_CONCURRENCY = int(os.getenv("ASYNC_CONCURRENCY", "200"))
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", "sync_state.sqlite3")
+BULK_PORTS_MIN_DEVICES = int(os.getenv("BULK_PORTS_MIN_DEVICES", "20"))
+TREE_CACHE_PATH = os.getenv("TREE_CACHE_PATH", ".devicetype_tree.json")
+TREE_CACHE_TTL = int(os.getenv("TREE_CACHE_TTL", "86400"))
+# Checkout local de devicetype-library: si se define, no se usa la red
+DEVICETYPE_LIBRARY_PATH = os.getenv("DEVICETYPE_LIBRARY_PATH")
+YAML_CACHE_DIR = os.getenv("YAML_CACHE_DIR", ".devicetype_yaml")
+# Carga en paralelo los YAML de los modelos nuevos antes del bucle, para que
+# no espere a GitHub; cuesta una lectura más (en streaming) del inventario de
+# LibreNMS, sin retenerlo en memoria
+PREFETCH_DEVICE_TYPES = os.getenv("PREFETCH_DEVICE_TYPES", "true").lower() == "true"
+PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", "8"))
+# "auto": interactivo solo si hay terminal; "false" para cron
+INTERACTIVE = os.getenv("INTERACTIVE", "auto").lower()
+DEVICE_TYPE_MAP_PATH = os.getenv("DEVICE_TYPE_MAP_PATH", "device_type_map.json")
+RESOLUTION_QUEUE_PATH = os.getenv("RESOLUTION_QUEUE_PATH", "resolution_queue.json")
+# Límite de peticiones/s por backend (0 = sin límite) y ráfaga permitida
+NETBOX_RATE_LIMIT = float(os.getenv("NETBOX_RATE_LIMIT", "0"))
+NETBOX_BURST = int(os.getenv("NETBOX_BURST", "20"))
+LIBRENMS_RATE_LIMIT = float(os.getenv("LIBRENMS_RATE_LIMIT", "0"))
+LIBRENMS_BURST = int(os.getenv("LIBRENMS_BURST", "20"))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "5"))
+# Latencia (s) por encima de la cual el control AIMD deja de subir concurrencia
+HTTP_LATENCY_TARGET = float(os.getenv("HTTP_LATENCY_TARGET", "2.0"))
+# Lo mismo para POST/PATCH/DELETE de lista (hasta NB_BULK_SIZE objetos)
+HTTP_BULK_LATENCY_TARGET = float(os.getenv("HTTP_BULK_LATENCY_TARGET", "15.0"))
+# Informe de cada ejecución (vacío = no escribir); el .prom es para el
+# textfile collector de node_exporter
+METRICS_JSON_PATH = os.getenv("METRICS_JSON_PATH", "sync_report.json")
+METRICS_PROM_PATH = os.getenv("METRICS_PROM_PATH", "sync_metrics.prom")
+# reconcile: plan de cambios (JSON) y si se borran los devices que ya no están en LibreNMS
+RECONCILE_PLAN_PATH = os.getenv("RECONCILE_PLAN_PATH", "reconcile_plan.json")
+RECONCILE_DELETE_DEVICES = os.getenv("RECONCILE_DELETE_DEVICES", "false").lower() == "true"
+# Fracción máxima de devices (o de interfaces de los devices reconciliados)
+# que se borra en una pasada; por encima no se borra nada (1 = sin límite)
+RECONCILE_MAX_DELETE_RATIO = float(os.getenv("RECONCILE_MAX_DELETE_RATIO", "0.5"))
+# Sincroniza IPs de interfaces e IP primaria de cada device (ipam/ip-addresses)
+SYNC_IP_ADDRESSES = os.getenv("SYNC_IP_ADDRESSES", "true").lower() == "true"
+# Crea los cables (dcim/cables) entre interfaces vecinas según LibreNMS (LLDP, CDP...)
+SYNC_CABLES = os.getenv("SYNC_CABLES", "true").lower() == "true"
+# Lee devices e interfaces de NetBox por GraphQL (solo los campos que compara
+# la sync) en lugar de REST; si falla se vuelve a REST. Devices por página
+NETBOX_GRAPHQL = os.getenv("NETBOX_GRAPHQL", "false").lower() == "true"
+NETBOX_GRAPHQL_PAGE_SIZE = int(os.getenv("NETBOX_GRAPHQL_PAGE_SIZE", "250"))
+# Logging: nivel (DEBUG, INFO, WARNING...), formato (text o json, una línea
+# JSON por evento) y fichero (vacío = stdout)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_FILE = os.getenv("LOG_FILE", "")
+# Ejecuciones por shards (--shard i/N): lock compartido para crear fabricantes
+# y device-types una sola vez entre procesos del mismo host
+SHARD_LOCK_PATH = os.getenv("SHARD_LOCK_PATH", "sync_shared.lock")
+# Modo daemon: cada cuánto (s) se consulta LibreNMS, cada cuánto se hace un
+# reconcile completo, retardo aleatorio máximo al encolar, dispositivos por
+# ciclo y tiempo mínimo entre syncs de un device que solo ha sido sondeado
+DAEMON_POLL_INTERVAL = float(os.getenv("DAEMON_POLL_INTERVAL", "60"))
+DAEMON_FULL_INTERVAL = float(os.getenv("DAEMON_FULL_INTERVAL", "21600"))
+DAEMON_JITTER = float(os.getenv("DAEMON_JITTER", "30"))
+DAEMON_BATCH_SIZE = int(os.getenv("DAEMON_BATCH_SIZE", "500"))
+DAEMON_POLLED_RESYNC = float(os.getenv("DAEMON_POLLED_RESYNC", "3600"))
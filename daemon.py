@@ -0,0 +1,263 @@
+import heapq
+import itertools
+import logging
+import random
+import signal
+import threading
+import time
+
+from api_librenms import iter_librenms_devices
+from api_netbox import RESOLVER
+from config import (
+    DAEMON_BATCH_SIZE,
+    DAEMON_FULL_INTERVAL,
+    DAEMON_JITTER,
+    DAEMON_POLL_INTERVAL,
+    DAEMON_POLLED_RESYNC,
+    DEFAULT_ROLE_SLUG,
+    DEFAULT_SITE_SLUG,
+    RECONCILE_DELETE_DEVICES,
+    RECONCILE_PLAN_PATH,
+)
+from metrics import METRICS
+from netbox_snapshot import NetBoxSnapshot
+from reconcile import DEVICES, finish_reconcile, reconcile, reconcile_devices
+from resolution_queue import RESOLUTIONS
+from state_store import DEVICE_FIELDS, fingerprint
+from sync_devices import get_role_id, get_site_id
+
+log = logging.getLogger(__name__)
+
+# Prioridad al encolar (menor = antes)
+NEW, CHANGED, DISCOVERED, POLLED = range(4)
+REASONS = ("nuevos", "cambiados", "redescubiertos", "sondeados")
+
+
+class ChangeQueue:
+    """
+    Dispositivos pendientes de sincronizar, cada uno una sola vez y con la
+    mejor prioridad recibida. Al encolar se les asigna un instante aleatorio
+    dentro de `jitter` segundos, para repartir la carga cuando llegan muchos
+    cambios juntos (p.ej. tras un ciclo de discovery de LibreNMS); de los ya
+    vencidos salen primero los de más prioridad.
+    """
+
+    def __init__(self, jitter: float = DAEMON_JITTER):
+        self.jitter = jitter
+        self._heap: list[tuple] = []  # (vence, prioridad, seq, device_id)
+        self._pending: dict = {}  # device_id -> (prioridad, vence, seq, device)
+        self._seq = itertools.count()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def push(self, device, priority: int, now: float | None = None):
+        now = time.monotonic() if now is None else now
+        key = device.get("device_id")
+        current = self._pending.get(key)
+        if current is not None and current[0] <= priority:
+            # Conserva el turno, pero con el registro más reciente
+            self._pending[key] = (*current[:3], device)
+            return
+        due = now + random.uniform(0, self.jitter)
+        seq = next(self._seq)
+        self._pending[key] = (priority, due, seq, device)
+        heapq.heappush(self._heap, (due, priority, seq, key))
+
+    def pop_due(self, limit: int, now: float | None = None) -> list:
+        """Hasta `limit` dispositivos ya vencidos, por prioridad y antigüedad."""
+        now = time.monotonic() if now is None else now
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            _, _, seq, key = heapq.heappop(self._heap)
+            entry = self._pending.get(key)
+            if entry is not None and entry[2] == seq:  # si no, es una entrada sustituida
+                due.append((key, entry))
+        due.sort(key=lambda item: item[1][:2])
+        for key, (priority, when, seq, _) in due[limit:]:
+            heapq.heappush(self._heap, (when, priority, seq, key))
+        batch = due[:limit]
+        for key, _ in batch:
+            del self._pending[key]
+        return [entry[3] for _, entry in batch]
+
+    def next_due(self) -> float | None:
+        return self._heap[0][0] if self._heap else None
+
+    def clear(self):
+        self._heap.clear()
+        self._pending.clear()
+
+
+class SyncDaemon:
+    """
+    Sincronización continua. Mantiene en memoria entre ciclos la foto de
+    NetBox, el resolver y el árbol de devicetype-library, y:
+
+    - cada `poll_interval` lee el listado compacto de dispositivos de
+      LibreNMS y encola los nuevos, los que han cambiado, los redescubiertos
+      (last_discovered) y los sondeados (last_polled) que llevan más de
+      `polled_resync` sin sincronizarse;
+    - reconcilia los encolados ya vencidos, como mucho `batch_size` por ciclo;
+    - cada `full_interval` hace un reconcile completo con una foto nueva,
+      que también recoge bajas, cambios hechos a mano en NetBox e IPs.
+    """
+
+    def __init__(
+        self,
+        workers: int = 1,
+        shard=None,
+        delete_devices: bool = RECONCILE_DELETE_DEVICES,
+        poll_interval: float = DAEMON_POLL_INTERVAL,
+        full_interval: float = DAEMON_FULL_INTERVAL,
+        batch_size: int = DAEMON_BATCH_SIZE,
+        polled_resync: float = DAEMON_POLLED_RESYNC,
+    ):
+        self.workers = workers
+        self.shard = shard
+        self.delete_devices = delete_devices
+        self.poll_interval = poll_interval
+        self.full_interval = full_interval
+        self.batch_size = max(1, batch_size)
+        self.polled_resync = polled_resync
+        self.queue = ChangeQueue()
+        self.snapshot = None
+        # device_id -> (huella, last_discovered, last_polled) de la última vez que se encoló
+        self.seen: dict = {}
+        self.synced_at: dict = {}
+        self.next_poll = 0.0
+        self.next_full = 0.0
+        self._stop = threading.Event()
+
+    def stop(self, *_):
+        log.info("Daemon: parada solicitada, se termina el ciclo en curso")
+        self._stop.set()
+
+    # --- Detección de cambios ---
+
+    def poll(self, baseline: bool = False) -> int:
+        """
+        Compara el listado de LibreNMS con lo visto y encola los cambios.
+        Con `baseline` solo registra el estado (justo antes de un reconcile
+        completo). Devuelve cuántos dispositivos se han encolado.
+        """
+        now = time.monotonic()
+        state_now, queued = {}, [0] * len(REASONS)
+        for d in iter_librenms_devices():
+            if self.shard is not None and not self.shard.owns(d):
+                continue
+            key = d.get("device_id")
+            state = (fingerprint(d, DEVICE_FIELDS), d.get("last_discovered"), d.get("last_polled"))
+            old = self.seen.get(key)
+            state_now[key] = state
+            if baseline or old == state:
+                continue
+            if old is None:
+                priority = NEW
+            elif old[0] != state[0]:
+                priority = CHANGED
+            elif old[1] != state[1]:
+                priority = DISCOVERED
+            elif now - self.synced_at.get(key, 0.0) >= self.polled_resync:
+                priority = POLLED
+            else:
+                # Solo un sondeo más: se mantiene el estado anterior para verlo de nuevo luego
+                state_now[key] = old
+                continue
+            self.queue.push(d, priority, now)
+            queued[priority] += 1
+        if not state_now:
+            # Un listado vacío casi siempre es un fallo de LibreNMS: no se olvida nada
+            log.warning("LibreNMS no devolvió dispositivos; se mantiene el estado anterior")
+            return 0
+        for key in self.seen.keys() - state_now.keys():
+            # Las bajas las aplica el reconcile completo
+            self.synced_at.pop(key, None)
+        self.seen = state_now
+        if baseline:
+            self.synced_at = dict.fromkeys(state_now, now)
+        elif any(queued):
+            detail = ", ".join(f"{n} {reason}" for n, reason in zip(queued, REASONS) if n)
+            log.info("Daemon: encolados %s (%d pendientes)", detail, len(self.queue))
+        return sum(queued)
+
+    def forget(self, devices):
+        """Olvida `devices` para que el siguiente sondeo los vuelva a encolar."""
+        for d in devices:
+            self.seen.pop(d.get("device_id"), None)
+
+    # --- Ciclos ---
+
+    def full_cycle(self):
+        log.info("Daemon: reconcile completo")
+        # Recoge las decisiones tomadas con `main.py resolve` mientras corría
+        RESOLUTIONS.refresh()
+        snapshot = NetBoxSnapshot.load(keep_objects=True)
+        # Lo que cambie desde aquí se volverá a ver en el siguiente sondeo
+        self.poll(baseline=True)
+        self.queue.clear()
+        reconcile(self.workers, self.delete_devices, RECONCILE_PLAN_PATH, self.shard, snapshot=snapshot)
+        self.snapshot = snapshot
+
+    def change_cycle(self):
+        devices = self.queue.pop_due(self.batch_size)
+        if not devices:
+            return
+        RESOLVER.reset_stats()
+        METRICS.reset()
+        RESOLUTIONS.refresh()
+        try:
+            site_id = get_site_id(DEFAULT_SITE_SLUG)
+            role_id = get_role_id(DEFAULT_ROLE_SLUG)
+        except Exception as e:
+            log.error("%s", e)
+            self.forget(devices)
+            return
+        log.info("Daemon: sincronizando %d devices (%d siguen en cola)", len(devices), len(self.queue))
+        try:
+            plan, failed = reconcile_devices(self.snapshot, devices, site_id, role_id, self.workers)
+        except Exception:
+            # Ya salieron de la cola y poll() los dio por vistos: sin esto
+            # esperarían al siguiente reconcile completo
+            self.forget(devices)
+            raise
+        now = time.monotonic()
+        rejected = {key for endpoint, method, key, _ in failed if endpoint == DEVICES and method != "DELETE"}
+        for d in devices:
+            self.synced_at[d.get("device_id")] = now
+        self.forget(d for d in devices if str(d.get("device_id")) in rejected)
+        METRICS.incr("daemon_devices_synced", len(devices))
+        METRICS.incr("daemon_queue_pending", len(self.queue))
+        finish_reconcile(plan, failed, None, self.shard)
+
+    def run(self):
+        log.info(
+            "Daemon: sondeo cada %gs, reconcile completo cada %gs%s",
+            self.poll_interval, self.full_interval, f", shard {self.shard}" if self.shard else "",
+        )
+        while not self._stop.is_set():
+            now = time.monotonic()
+            try:
+                if now >= self.next_full:
+                    # Si falla, se reintenta en el siguiente sondeo
+                    self.next_full = now + self.poll_interval
+                    self.full_cycle()
+                    self.next_full = time.monotonic() + self.full_interval
+                    self.next_poll = time.monotonic() + self.poll_interval
+                elif self.snapshot is not None:
+                    if now >= self.next_poll:
+                        self.next_poll = now + self.poll_interval
+                        self.poll()
+                    self.change_cycle()
+            except Exception as e:
+                log.exception("en el ciclo del daemon: %s", e)
+            wake = min(t for t in (self.next_poll, self.next_full, self.queue.next_due()) if t is not None)
+            self._stop.wait(max(0.0, wake - time.monotonic()))
+        log.info("Daemon detenido")
+
+
+def run_daemon(workers: int = 1, shard=None, delete_devices: bool = RECONCILE_DELETE_DEVICES):
+    daemon = SyncDaemon(workers, shard, delete_devices)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    signal.signal(signal.SIGINT, daemon.stop)
+    daemon.run()
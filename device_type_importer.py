@@ -1,136 +1,97 @@
-import re
+import logging
 import os
-import yaml
-import requests
+import re
+from concurrent.futures import ThreadPoolExecutor
 
-from api_netbox import nb_get, nb_post, get_or_create_manufacturer_id
-from device_utils import find_in_tree, TREE
+from api_netbox import RESOLVER, nb_post, get_or_create_manufacturer_id
+from device_utils import find_in_tree, get_tree_blobs, resolve_device_type
+from devicetype_cache import load_device_type_yaml
 from config import DRY_RUN
+from resolution_queue import GENERIC, RESOLUTIONS, SKIP, choose_device_type
+from sync_locks import DEVICE_TYPE_LOCKS, MODEL_LOCKS, SHARED_LOCK
+from tree_matcher import normalize_slug
+
+log = logging.getLogger(__name__)
 
 DRY = DRY_RUN
 
 def create_generic_device_type():
     """Crea un device-type genérico si no existe"""
+    with DEVICE_TYPE_LOCKS.hold("generic"):
+        return _create_generic_device_type()
+
+def _create_generic_device_type():
     man_id = get_or_create_manufacturer_id("generic")
     
     # Verificar si ya existe
-    check = nb_get(
-        "dcim/device-types/",
-        manufacturer_id=man_id,
-        slug="generic",
-    )
-    if check.get("count", 0):
-        print(f"[DEBUG] Device-type genérico ya existe: id={check['results'][0]['id']}")
-        return check["results"][0]["id"]
-    
+    generic_id = RESOLVER.lookup("device_type", "generic")
+    if generic_id:
+        return generic_id
+    with SHARED_LOCK.hold() as shared:
+        generic_id = RESOLVER.refresh("device_type", "generic") if shared else None
+        return generic_id or _post_generic_device_type(man_id)
+
+def _post_generic_device_type(man_id):
+
     # Crear nuevo device-type genérico
     data = {"manufacturer": man_id, "model": "Generic Device", "slug": "generic"}
     if DRY:
-        print("[DEBUG] DRY-IMPORT GENERIC", data)
+        log.info("DRY-IMPORT GENERIC %s", data)
         return 1  # Retornar un ID ficticio pero válido
     
     try:
         created = nb_post("dcim/device-types/", data)
-        print(f"[DEBUG] Device-type genérico creado: {created}")
-        return created.get("id")
+        log.info("Device-type genérico creado: %s", created.get("id"))
     except Exception as e:
-        print(f"ERROR al crear device-type genérico: {e}")
+        log.error("al crear device-type genérico: %s", e)
         return None
+    RESOLVER.store("device_type", "generic", created.get("id"))
+    return created.get("id")
 
-def normalize_slug(text: str) -> str:
-    """Normaliza un texto para crear un slug válido"""
-    if not text:
-        return ""
-    # Convertir a minúsculas y reemplazar espacios/guiones bajos con guiones
-    text = text.lower().strip()
-    text = re.sub(r'[\s_]+', '-', text)
-    # Reemplazar caracteres especiales
-    text = text.replace('+', '-plus')
-    # Eliminar caracteres que no sean alfanuméricos o guiones
-    text = re.sub(r'[^a-z0-9\-]', '', text)
-    # Eliminar guiones múltiples y guiones al inicio/final
-    text = re.sub(r'-+', '-', text).strip('-')
-    return text
 
 def import_device_type_if_exists(vendor: str, fname: str):
     vendor = normalize_slug(vendor)
     slug_key = normalize_slug(fname)
-    print(f"[DEBUG] import_device_type_if_exists: vendor='{vendor}', slug_key='{slug_key}'")
+    log.debug("import_device_type_if_exists: vendor='%s', slug_key='%s'", vendor, slug_key)
     
     if not vendor or not slug_key:
-        print(f"[DEBUG] Vendor o modelo vacío ({vendor}, {slug_key})")
+        log.debug("Vendor o modelo vacío (%s, %s)", vendor, slug_key)
         return None
-    
-    if not TREE:
-        print(f"[DEBUG] Árbol vacío, creando device-type genérico")
+
+    # Un único worker resuelve cada modelo; el resto espera y reutiliza el id
+    with MODEL_LOCKS.hold(slug_key):
+        return _import_device_type(vendor, slug_key)
+
+def _import_device_type(vendor: str, slug_key: str):
+    # Comprueba en NetBox (memorizado por el resolver)
+    dt_id = RESOLVER.lookup("device_type", slug_key)
+    if dt_id:
+        return dt_id
+
+    # El árbol solo se carga (y descarga) si el tipo no existe ya en NetBox
+    if not get_tree_blobs():
+        log.warning("Árbol vacío, creando device-type genérico")
         # Si no hay árbol, crear directamente un tipo genérico
         return create_generic_device_type()
 
-    # Comprueba en NetBox
-    q = nb_get("dcim/device-types/", slug=slug_key)
-    if q.get("count", 0):
-        print(f"[DEBUG] Device-type {slug_key} ya existe en NetBox id={q['results'][0]['id']}")
-        return q["results"][0]["id"]
-
     # Busca ruta exacta o sugiere alternativas
     relpath, suggestions = find_in_tree(vendor, slug_key)
     # Nos quedamos con un máximo de 4 sugerencias
     suggestions = suggestions[:4]
-    print(
-        f"[DEBUG] find_in_tree -> relpath={relpath}, suggestions={suggestions} (total {len(suggestions)})"
-    )
+    log.debug("find_in_tree -> relpath=%s, suggestions=%s (total %d)", relpath, suggestions, len(suggestions))
 
     if not relpath:
-        if suggestions:
-            print(f"No encontró '{slug_key}'. Sugerencias:")
-            for idx, path in enumerate(suggestions, 1):
-                print(f"  {idx}) {path}")
-            gen_idx = len(suggestions) + 1
-            print(f"  {gen_idx}) [GENÉRICO] Crear tipo de dispositivo genérico")
-            choice = input(f"Elige número (1-{gen_idx}) o ENTER para saltar: ")
-            
-            if choice.isdigit():
-                sel = int(choice) - 1
-                if 0 <= sel < len(suggestions):
-                    relpath = suggestions[sel]
-                    print(f"[DEBUG] Sugerencia seleccionada: {relpath}")
-                elif sel == len(suggestions):
-                    print("[DEBUG] Opción genérica seleccionada.")
-                    relpath = None
-                else:
-                    print("[DEBUG] Selección fuera de rango, saltando.")
-                    return None
-            else:
-                print("[DEBUG] No se seleccionó ninguna opción. Saltando.")
-                return None
-        else:
-            print(f"[DEBUG] Sin sugerencias para '{slug_key}'. Dispositivo saltado.")
+        # Mapeo persistente, pregunta interactiva o cola de resolución
+        relpath = choose_device_type(vendor, slug_key, suggestions)
+        if relpath is None:
             return None
+        if relpath == GENERIC:
+            return create_generic_device_type()
 
-    # Si relpath es None tras confirmar genérico, creamos genérico
-    if not relpath:
-        return create_generic_device_type()
-
-    # Importar device-type real
-    url = f"https://raw.githubusercontent.com/netbox-community/devicetype-library/master/{relpath}"
-    print(f"[DEBUG] Intentando descargar device-type desde: {url}")
-    
-    raw_data = None
-    for attempt in range(5):
-        try:
-            print(f"[DEBUG] Descarga intento {attempt+1}")
-            resp = requests.get(url, timeout=20)
-            if resp.status_code == 200:
-                print(f"[DEBUG] Descarga OK")
-                raw_data = yaml.safe_load(resp.text)
-                break
-            else:
-                print(f"[DEBUG] HTTP {resp.status_code}")
-        except requests.RequestException as e:
-            print(f"[DEBUG] Error conexión GitHub: {e}")
-    
+    # Importar device-type real (caché local o GitHub)
+    log.debug("Cargando device-type %s", relpath)
+    raw_data = load_device_type_yaml(relpath)
     if raw_data is None:
-        print(f"[DEBUG] No se pudo descargar {url} tras 5 intentos")
         return None
 
     # Preparar datos para crear device-type
@@ -144,16 +105,63 @@ def import_device_type_if_exists(vendor: str, fname: str):
     model = raw_data.get("model") or base
     
     data = {"manufacturer": man_id, "model": model, "slug": clean_slug}
-    print(f"[DEBUG] Crear device-type con: {data}")
+    log.debug("Crear device-type con: %s", data)
     
     if DRY:
-        print("[DEBUG] DRY-IMPORT", data)
+        log.info("DRY-IMPORT %s", data)
         return 0
-    
+
+    with DEVICE_TYPE_LOCKS.hold(clean_slug):
+        return _create_device_type(data, slug_key)
+
+def _create_device_type(data: dict, slug_key: str):
+    clean_slug = data["slug"]
+    existing = RESOLVER.lookup("device_type", clean_slug)
+    if not existing:
+        with SHARED_LOCK.hold() as shared:
+            existing = RESOLVER.refresh("device_type", clean_slug) if shared else None
+            if not existing:
+                return _post_device_type(data, slug_key)
+    # Otra sugerencia (u otro shard) ya importó este mismo fichero
+    RESOLVER.store("device_type", slug_key, existing)
+    return existing
+
+def _post_device_type(data: dict, slug_key: str):
+    clean_slug = data["slug"]
+
     try:
         created = nb_post("dcim/device-types/", data)
-        print(f"[DEBUG] Device-type creado en NetBox: {created}")
-        return created.get("id")
+        log.info("Device-type %s creado en NetBox (id %s)", clean_slug, created.get("id"))
     except Exception as e:
-        print(f"ERROR al crear device-type {clean_slug}: {e}")
+        log.error("al crear device-type %s: %s", clean_slug, e)
         return None
+    RESOLVER.store("device_type", clean_slug, created.get("id"))
+    # Alias por el modelo de LibreNMS para no repetir el find_in_tree
+    RESOLVER.store("device_type", slug_key, created.get("id"))
+    return created.get("id")
+
+
+def prefetch_device_types(devices, workers: int = 8):
+    """
+    Antes del bucle de dispositivos: reúne los (vendor, modelo) distintos del
+    inventario que aún no existen en NetBox, localiza su YAML en el árbol y
+    lo descarga en paralelo para que el bucle no espere a GitHub.
+    """
+    pairs = set()
+    for d in devices:  # puede ser un generador: se recorre una sola vez
+        vendor, model = resolve_device_type(d)
+        slug_key = normalize_slug(model)
+        if slug_key:
+            pairs.add((normalize_slug(vendor), slug_key))
+    pairs = {(v, m) for v, m in pairs if not RESOLVER.lookup("device_type", m)}
+    if not pairs:
+        return
+    relpaths = set()
+    for vendor, slug_key in pairs:
+        relpath, _ = find_in_tree(vendor, slug_key)
+        relpath = relpath or RESOLUTIONS.lookup(vendor, slug_key)
+        if relpath and relpath not in (GENERIC, SKIP):
+            relpaths.add(relpath)
+    log.info("Prefetch: %d modelos nuevos, %d YAML a cargar", len(pairs), len(relpaths))
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        list(pool.map(load_device_type_yaml, relpaths))
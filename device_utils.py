@@ -1,15 +1,27 @@
+import json
+import logging
 import os
 import re
 import requests
-import difflib
+import threading
+import time
 from urllib.parse import quote
 
+from config import DEVICETYPE_LIBRARY_PATH, TREE_CACHE_PATH, TREE_CACHE_TTL
+from metrics import METRICS
+from tree_matcher import TreeMatcher
+
+log = logging.getLogger(__name__)
+
 # Suposición: nb_get y nb_post ya definidas, restituyen JSON/dict
 API_TREE_URL = (
     "https://api.github.com/repos/netbox-community/devicetype-library"
     "/git/trees/master?recursive=1"
 )
 DRY = False  # DRY-run global
+# Solo interesan los device-types; module-types, rack-types... tienen rutas
+# con la misma forma y no deben casar como device-type
+DEVICE_TYPES_DIR = "device-types"
 
 def ensure_slug(endpoint, slug):
     return slug
@@ -21,69 +33,145 @@ def resolve_device_type(device: dict) -> tuple[str, str]:
     slug = re.sub(r"[^a-z0-9\-]", "", slug)
     return vendor, slug
 
-def fetch_tree() -> list[str]:
+# El árbol de devicetype-library se carga al primer uso (no al importar) y se
+# guarda en TREE_CACHE_PATH como {"sha", "etag", "fetched_at", "blobs": {path: sha}}
+_tree_lock = threading.RLock()
+_tree: dict[str, str] | None = None
+
+def _read_tree_cache() -> dict | None:
+    try:
+        with open(TREE_CACHE_PATH, encoding="utf-8") as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+def _write_tree_cache(cache: dict):
+    tmp = f"{TREE_CACHE_PATH}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(cache, fh)
+        os.replace(tmp, TREE_CACHE_PATH)
+    except OSError as e:
+        log.warning("no se pudo guardar la caché del árbol en %s: %s", TREE_CACHE_PATH, e)
+
+def _is_device_type(path: str) -> bool:
+    return path.startswith(f"{DEVICE_TYPES_DIR}/") and path.endswith(".yaml")
+
+def _local_tree(root: str) -> dict[str, str]:
+    """Árbol a partir de un checkout local de devicetype-library (sin red)."""
+    blobs = {}
+    for dirpath, _, files in os.walk(os.path.join(root, DEVICE_TYPES_DIR)):
+        for name in files:
+            if name.endswith(".yaml"):
+                full = os.path.join(dirpath, name)
+                blobs[os.path.relpath(full, root).replace(os.sep, "/")] = ""
+    return blobs
+
+def fetch_tree(cache: dict | None = None) -> dict | None:
+    """
+    Descarga el árbol de GitHub. Si hay caché con ETag hace una petición
+    condicional: un 304 no consume cuota y mantiene la caché vigente.
+    Devuelve la nueva caché o None si no se pudo obtener.
+    """
+    headers = {}
+    if cache and cache.get("etag"):
+        headers["If-None-Match"] = cache["etag"]
+    start = time.monotonic()
     try:
-        resp = requests.get(API_TREE_URL, timeout=20)
+        resp = requests.get(API_TREE_URL, headers=headers, timeout=20)
+        METRICS.observe_request(
+            "github", "GET", "devicetype-library/tree", resp.status_code,
+            time.monotonic() - start, len(resp.content),
+        )
+        if resp.status_code == 304:
+            return {**cache, "fetched_at": time.time()}
+        if resp.status_code == 403 and resp.headers.get("X-RateLimit-Remaining") == "0":
+            reset = int(resp.headers.get("X-RateLimit-Reset", "0"))
+            log.error(
+                "obteniendo árbol de device-types: límite de la API de GitHub agotado hasta %s",
+                time.strftime("%H:%M:%S", time.localtime(reset)),
+            )
+            return None
         resp.raise_for_status()
         data = resp.json()
-        return [item["path"] for item in data.get("tree", []) if item.get("path","").endswith(".yaml")]
     except Exception as e:
-        print(f"ERROR obteniendo árbol de device-types: {e}")
-        return []
+        log.error("obteniendo árbol de device-types: %s", e)
+        return None
+    return {
+        "sha": data.get("sha"),
+        "etag": resp.headers.get("ETag"),
+        "fetched_at": time.time(),
+        "blobs": {
+            item["path"]: item.get("sha", "")
+            for item in data.get("tree", [])
+            if _is_device_type(item.get("path", ""))
+        },
+    }
 
-TREE = fetch_tree()
-print(f"[DEBUG] TREE cargado: {len(TREE)} paths")   # <-- Añade esto temporalmente
+def _load_tree() -> dict[str, str]:
+    if DEVICETYPE_LIBRARY_PATH:
+        blobs = _local_tree(DEVICETYPE_LIBRARY_PATH)
+        log.info("Árbol de device-types cargado de %s: %d paths", DEVICETYPE_LIBRARY_PATH, len(blobs))
+        return blobs
+    cache = _read_tree_cache()
+    if cache:
+        # Una caché escrita por una versión anterior puede incluir module-types
+        cache["blobs"] = {p: sha for p, sha in cache.get("blobs", {}).items() if _is_device_type(p)}
+    if cache and time.time() - cache.get("fetched_at", 0) < TREE_CACHE_TTL:
+        return cache["blobs"]
+    fresh = fetch_tree(cache)
+    if fresh is not None:
+        _write_tree_cache(fresh)
+        log.info("Árbol de device-types cargado: %d paths (sha %s)", len(fresh["blobs"]), fresh.get("sha"))
+        return fresh["blobs"]
+    if cache:
+        log.warning("usando caché caducada del árbol (%s)", TREE_CACHE_PATH)
+        return cache["blobs"]
+    return {}
+
+def get_tree_blobs() -> dict[str, str]:
+    """Rutas .yaml del árbol con el sha de cada blob ("" si viene de un checkout local)."""
+    global _tree
+    if _tree is None:
+        with _tree_lock:
+            if _tree is None:
+                _tree = _load_tree()
+    return _tree
+
+def get_tree() -> list[str]:
+    return list(get_tree_blobs())
+
+_matcher: TreeMatcher | None = None
+
+def get_matcher() -> TreeMatcher:
+    """Índice de sugerencias sobre el árbol, construido una vez al primer fallo."""
+    global _matcher
+    if _matcher is None:
+        with _tree_lock:
+            if _matcher is None:
+                _matcher = TreeMatcher(get_tree_blobs())
+    return _matcher
 
 def find_in_tree(vendor: str, slug: str) -> tuple[str | None, list[str]]:
     """
-    Busca la ruta exacta en el árbol. Si no hay exact match, devuelve sugerencias.
+    Busca la ruta device-types/<Fabricante>/<modelo>.yaml del modelo (ver
+    TreeMatcher.lookup). Si no hay exact match, devuelve sugerencias.
     Retorna (ruta, lista_sugerencias).
     """
-    exact = f"{vendor}/{slug}.yaml"
-    if exact in TREE:
-        return exact, []
-
-    # Buscar coincidencias dentro del vendor y complementarlas con coincidencias globales
-    prefix = f"{vendor}/"
-    vendor_paths = [p for p in TREE if p.startswith(prefix)]
-
-    def score(path: str) -> float:
-        name = os.path.basename(path)[:-5]
-        return difflib.SequenceMatcher(None, slug, name).ratio()
-
-    # Ordenar las coincidencias del vendor por score
-    ranked_vendor = sorted(vendor_paths, key=score, reverse=True)
-    suggestions: list[str] = [p for p in ranked_vendor if score(p) >= 0.3][:4]
-
-    # Si faltan sugerencias, completar con coincidencias globales
-    if len(suggestions) < 4:
-        remaining = [p for p in TREE if p not in suggestions]
-        ranked_global = sorted(remaining, key=score, reverse=True)
-        for p in ranked_global:
-            if p not in suggestions:
-                suggestions.append(p)
-            if len(suggestions) == 4:
-                break
-
-    return None, suggestions
+    matched = get_matcher().lookup(vendor, slug)
+    if matched:
+        return matched, []
+
+    # Sugerencias del vendor, completadas con coincidencias globales
+    return None, list(get_matcher().suggest(vendor, slug))
 
 def validate_device(d: dict) -> bool:
     return bool(d.get("device_id") and (d.get("hostname") or d.get("sysName")))
 
 def get_or_create_manufacturer_id(slug: str) -> int:
-    slug = ensure_slug("dcim/manufacturers/", slug).lower()
-    resp = nb_get("dcim/manufacturers/", slug=slug)
-    if resp.get("count", 0) > 0:
-        return resp["results"][0]["id"]
-    data = {"name": slug.capitalize(), "slug": slug}
-    try:
-        created = nb_post("dcim/manufacturers/", data)
-        return created.get("id")
-    except requests.HTTPError:
-        resp = nb_get("dcim/manufacturers/", slug=slug)
-        if resp.get("count", 0) > 0:
-            return resp["results"][0]["id"]
-        raise
+    # Una sola implementación (memorizada por el resolver) en api_netbox
+    from api_netbox import get_or_create_manufacturer_id as _get_or_create
+    return _get_or_create(ensure_slug("dcim/manufacturers/", slug))
 
 def get_or_create_generic_device_type():
     from api_netbox import get_or_create_manufacturer_id
@@ -94,13 +182,13 @@ def get_or_create_generic_device_type():
         "slug": "generic"
     }
     if DRY:
-        print("DRY-IMPORT GENERIC", data)
+        log.info("DRY-IMPORT GENERIC %s", data)
         return 0
     try:
         created = nb_post("dcim/device-types/", data)
         return created.get("id")
     except Exception as e:
-        print(f"ERROR al crear device-type generico: {e}")
+        log.error("al crear device-type generico: %s", e)
         return None
 
 if __name__ == "__main__":
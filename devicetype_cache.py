@@ -0,0 +1,113 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+import requests
+import yaml
+
+from config import DEVICETYPE_LIBRARY_PATH, YAML_CACHE_DIR
+from device_utils import get_tree_blobs
+from metrics import METRICS
+from transport import backoff_delay, parse_retry_after
+
+log = logging.getLogger(__name__)
+
+RAW_URL = "https://raw.githubusercontent.com/netbox-community/devicetype-library/master/{}"
+ATTEMPTS = 5
+
+_memo: dict[str, dict] = {}
+_memo_lock = threading.Lock()
+
+
+def _cache_file(sha: str) -> str:
+    return os.path.join(YAML_CACHE_DIR, sha[:2], f"{sha}.json")
+
+
+def _read_cached(sha: str) -> dict | None:
+    try:
+        with open(_cache_file(sha), encoding="utf-8") as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_cached(sha: str, data: dict):
+    path = _cache_file(sha)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(data, fh, default=str)
+        os.replace(tmp, path)
+    except OSError as e:
+        log.warning("no se pudo guardar %s: %s", path, e)
+
+
+def git_blob_sha(body: bytes) -> str:
+    """sha con el que git (y el árbol de GitHub) identifica un fichero con este contenido."""
+    return hashlib.sha1(b"blob %d\0" % len(body) + body).hexdigest()
+
+
+def _download(relpath: str) -> tuple[dict | None, str | None]:
+    """YAML parseado de `master` y el sha de blob de lo descargado."""
+    url = RAW_URL.format(relpath)
+    for attempt in range(ATTEMPTS):
+        start = time.monotonic()
+        try:
+            resp = requests.get(url, timeout=20)
+            METRICS.observe_request(
+                "github", "GET", "devicetype-library/yaml", resp.status_code,
+                time.monotonic() - start, len(resp.content),
+            )
+            if resp.status_code == 200:
+                return yaml.safe_load(resp.text), git_blob_sha(resp.content)
+            log.debug("HTTP %s descargando %s", resp.status_code, url)
+            if resp.status_code == 404:
+                return None, None
+            retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+        except requests.RequestException as e:
+            METRICS.observe_request("github", "GET", "devicetype-library/yaml", "error", time.monotonic() - start)
+            log.debug("Error conexión GitHub: %s", e)
+            retry_after = None
+        if attempt < ATTEMPTS - 1:
+            time.sleep(backoff_delay(attempt, retry_after))
+    log.warning("No se pudo descargar %s tras %d intentos", url, ATTEMPTS)
+    return None, None
+
+
+def load_device_type_yaml(relpath: str) -> dict | None:
+    """
+    YAML parseado de un device-type. Orden de búsqueda: memoria, checkout
+    local (DEVICETYPE_LIBRARY_PATH), caché en disco direccionada por el sha
+    del blob en el árbol, y por último descarga de GitHub.
+    """
+    with _memo_lock:
+        if relpath in _memo:
+            return _memo[relpath]
+
+    if DEVICETYPE_LIBRARY_PATH:
+        try:
+            with open(os.path.join(DEVICETYPE_LIBRARY_PATH, relpath), encoding="utf-8") as fh:
+                data = yaml.safe_load(fh)
+        except (OSError, yaml.YAMLError) as e:
+            log.error("leyendo %s del checkout local: %s", relpath, e)
+            return None
+    else:
+        sha = get_tree_blobs().get(relpath)
+        data = _read_cached(sha) if sha else None
+        if data is None:
+            data, body_sha = _download(relpath)
+            # Se guarda con el sha de lo descargado: si el árbol está
+            # desfasado (TTL, caché caducada) su sha es de otra versión
+            if data is not None:
+                if sha and body_sha != sha:
+                    log.debug("%s cambió en master desde el árbol en caché (%s -> %s)", relpath, sha, body_sha)
+                _write_cached(body_sha, data)
+
+    if data is not None:
+        with _memo_lock:
+            _memo[relpath] = data
+    return data
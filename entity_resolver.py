@@ -0,0 +1,94 @@
+import threading
+from collections import Counter
+
+# Tipo de entidad -> (endpoint, filtro por el que se busca)
+ENTITIES = {
+    "manufacturer": ("dcim/manufacturers/", "slug"),
+    "device_type": ("dcim/device-types/", "slug"),
+    "platform": ("dcim/platforms/", "slug"),
+    "site": ("dcim/sites/", "slug"),
+    "role": ("dcim/device-roles/", "slug"),
+    "ip_address": ("ipam/ip-addresses/", "address"),
+}
+
+
+class EntityResolver:
+    """
+    Resolución clave -> id de NetBox memorizada durante la ejecución, por tipo
+    de entidad. También guarda los "no existe" (None), de modo que una
+    plataforma ausente se consulta una vez y no una por dispositivo.
+
+    Si una colección se cargó entera (snapshot), se marca como completa y un
+    fallo de caché es un "no existe" definitivo, sin ninguna consulta.
+    """
+
+    def __init__(self, fetch):
+        # fetch(endpoint, **filtros) -> respuesta de listado de NetBox (nb_get)
+        self._fetch = fetch
+        self._lock = threading.Lock()
+        self._cache: dict[str, dict] = {kind: {} for kind in ENTITIES}
+        self._complete: set[str] = set()
+        self.hits: Counter = Counter()
+        self.misses: Counter = Counter()
+
+    def seed(self, kind: str, values: dict, complete: bool = True):
+        """Usa `values` (p.ej. un índice del snapshot) como caché de `kind`."""
+        with self._lock:
+            self._cache[kind] = values
+            if complete:
+                self._complete.add(kind)
+            else:
+                self._complete.discard(kind)
+
+    def lookup(self, kind: str, key):
+        cache = self._cache[kind]
+        with self._lock:
+            if key in cache or kind in self._complete:
+                self.hits[kind] += 1
+                return cache.get(key)
+            self.misses[kind] += 1
+        endpoint, field = ENTITIES[kind]
+        resp = self._fetch(endpoint, **{field: key})
+        found = resp["results"][0]["id"] if resp.get("count") else None
+        with self._lock:
+            cache.setdefault(key, found)
+            return cache[key]
+
+    def refresh(self, kind: str, key):
+        """Consulta NetBox aunque la clave esté en caché (p.ej. otro proceso pudo crearla)."""
+        endpoint, field = ENTITIES[kind]
+        resp = self._fetch(endpoint, **{field: key})
+        found = resp["results"][0]["id"] if resp.get("count") else None
+        with self._lock:
+            self.misses[kind] += 1
+            self._cache[kind][key] = found
+        return found
+
+    def store(self, kind: str, key, obj_id):
+        """Registra un objeto recién creado (o sustituye un "no existe")."""
+        if obj_id is None:
+            return
+        with self._lock:
+            self._cache[kind][key] = obj_id
+
+    def invalidate(self, kind: str, key):
+        with self._lock:
+            self._cache[kind].pop(key, None)
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits.clear()
+            self.misses.clear()
+
+    def stats(self) -> dict:
+        return {
+            kind: {"hits": self.hits[kind], "misses": self.misses[kind]}
+            for kind in ENTITIES
+            if self.hits[kind] or self.misses[kind]
+        }
+
+    def summary(self) -> str:
+        hits, misses = sum(self.hits.values()), sum(self.misses.values())
+        detail = ", ".join(f"{k} {v['hits']}/{v['misses']}" for k, v in self.stats().items())
+        return f"Resolver: {hits} aciertos, {misses} consultas a NetBox ({detail})"
+
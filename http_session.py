@@ -0,0 +1,20 @@
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import HTTP_POOL_SIZE
+
+
+def build_session(headers: dict | None = None, pool_size: int = HTTP_POOL_SIZE) -> requests.Session:
+    """
+    Sesión HTTP compartida con pool de conexiones keep-alive, para no repetir
+    el handshake TCP/TLS en cada petición. `pool_size` debe ser al menos el
+    número de workers que la usan a la vez.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({"Connection": "keep-alive"})
+    if headers:
+        session.headers.update(headers)
+    return session
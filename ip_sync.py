@@ -0,0 +1,131 @@
+import ipaddress
+import logging
+
+from api_librenms import get_librenms_ip_addresses
+from api_netbox import nb_get_all
+from bulk_writer import BulkWriter
+from metrics import METRICS
+
+log = logging.getLogger(__name__)
+
+IP_ENDPOINT = "ipam/ip-addresses/"
+INTERFACE_TYPE = "dcim.interface"
+
+
+def host_key(address: str | None) -> str | None:
+    """IP sin prefijo en forma canónica ("10.0.0.1", "2001:db8::1"); None si no es una IP."""
+    if not address:
+        return None
+    try:
+        return ipaddress.ip_interface(address.strip()).ip.compressed
+    except ValueError:
+        return None
+
+
+def management_ip(d) -> str | None:
+    """IP de gestión de un dispositivo de LibreNMS: `ip`, o el hostname si es una IP."""
+    return host_key(d.get("ip")) or host_key(d.get("hostname"))
+
+
+class AddressIndex:
+    """
+    ipam/ip-addresses de NetBox leídas una sola vez e indexadas por IP sin
+    prefijo: host -> (id, interfaz asignada o None). Las altas y
+    asignaciones de la ejecución se anotan aquí para no volver a leer.
+    """
+
+    def __init__(self):
+        self.by_host: dict[str, tuple[int, int | None]] = {}
+
+    @classmethod
+    def load(cls):
+        index = cls()
+        for obj in nb_get_all(IP_ENDPOINT):
+            index.add(obj)
+        log.debug("Índice de IPs NetBox: %d direcciones", len(index.by_host))
+        return index
+
+    def add(self, obj: dict):
+        host = host_key(obj.get("address"))
+        if host is None or host in self.by_host or not obj.get("id"):
+            return
+        iface = obj.get("assigned_object_id") if obj.get("assigned_object_type") == INTERFACE_TYPE else None
+        self.by_host[host] = (obj["id"], iface)
+
+    def get(self, host: str):
+        return self.by_host.get(host)
+
+    def assign(self, host: str, iface: int):
+        ip_id, _ = self.by_host[host]
+        self.by_host[host] = (ip_id, iface)
+
+
+def sync_ip_addresses(snapshot, mgmt_ips: dict, only_devices: set | None = None):
+    """
+    Sincroniza las direcciones de las interfaces de LibreNMS con NetBox:
+    crea en bloque las que faltan ya asignadas a su interfaz, asigna las
+    que existen sin asignar y fija primary_ip4/primary_ip6 de cada
+    dispositivo (`mgmt_ips`: librenms device_id -> IP de gestión) con PATCH
+    de lista. Una IP ya asignada a otra interfaz no se mueve.
+
+    Con `only_devices` (ids de NetBox, p.ej. los de un shard) solo se tocan
+    las IPs de las interfaces de esos dispositivos.
+    """
+    addresses = get_librenms_ip_addresses()
+    if addresses is None:
+        return
+    index = AddressIndex.load()
+
+    creator = BulkWriter(IP_ENDPOINT, on_created=lambda host, obj: index.add(obj))
+    assigner = BulkWriter(IP_ENDPOINT, method="PATCH")
+    seen = set()
+    for port_id, address in addresses:
+        iface = snapshot.interface_for_port(port_id)
+        host = host_key(address)
+        if not iface or host is None or host in seen:
+            continue
+        if only_devices is not None and snapshot.interface_device.get(iface) not in only_devices:
+            continue
+        # Misma IP en varias interfaces (VRRP, anycast...): gana la primera
+        seen.add(host)
+        current = index.get(host)
+        if current is None:
+            creator.add(
+                host,
+                {
+                    "address": address,
+                    "status": "active",
+                    "assigned_object_type": INTERFACE_TYPE,
+                    "assigned_object_id": iface,
+                },
+            )
+        elif current[1] is None:
+            assigner.add(host, {"id": current[0], "assigned_object_type": INTERFACE_TYPE, "assigned_object_id": iface})
+            index.assign(host, iface)
+    creator.flush()
+    assigner.flush()
+
+    # NetBox solo acepta como IP primaria una asignada a una interfaz del propio dispositivo
+    primaries = BulkWriter(
+        "dcim/devices/", method="PATCH", on_created=lambda lid, obj: snapshot.set_primary_ips(obj["id"], obj)
+    )
+    n_primaries = 0
+    for lid, host in mgmt_ips.items():
+        dev_id = snapshot.device_id(lid)
+        current = index.get(host) if host else None
+        if not dev_id or current is None or snapshot.interface_device.get(current[1]) != dev_id:
+            continue
+        field = "primary_ip4" if ipaddress.ip_address(host).version == 4 else "primary_ip6"
+        if snapshot.primary_ips.get(dev_id, {}).get(field) != current[0]:
+            primaries.add(lid, {"id": dev_id, field: current[0]})
+            n_primaries += 1
+    primaries.flush()
+
+    failed = len(creator.failed) + len(assigner.failed) + len(primaries.failed)
+    METRICS.incr("ip_addresses_created", len(creator.ids))
+    METRICS.incr("ip_addresses_assigned", len(assigner.ids))
+    METRICS.incr("primary_ips_set", n_primaries - len(primaries.failed))
+    log.info(
+        "IPs → %d en LibreNMS, %d creadas, %d asignadas, %d IPs primarias, %d rechazadas",
+        len(addresses), len(creator.ids), len(assigner.ids), n_primaries - len(primaries.failed), failed,
+    )
@@ -1,4 +1,189 @@
+import argparse
+import logging
+
+from config import (
+    ASYNC_CONCURRENCY,
+    HTTP_POOL_SIZE,
+    LOG_FILE,
+    LOG_FORMAT,
+    LOG_LEVEL,
+    RECONCILE_DELETE_DEVICES,
+    RECONCILE_PLAN_PATH,
+    SHARD_LOCK_PATH,
+)
+from resolution_queue import set_interactive
 from sync_devices import sync_devices
+from sync_locks import set_shared_lock
+from sync_logging import setup_logging
+
+log = logging.getLogger("main")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Sincroniza dispositivos de LibreNMS a NetBox")
+    parser.add_argument(
+        "command",
+        nargs="?",
+        choices=["sync", "resolve", "reconcile", "daemon", "prepare", "merge-reports"],
+        default="sync",
+        help=(
+            "sync (por defecto), resolve: procesa la cola de modelos sin device-type, "
+            "reconcile: crea, actualiza y borra hasta igualar NetBox con LibreNMS, "
+            "daemon: reconcilia de forma continua los dispositivos que cambian en LibreNMS, "
+            "prepare: crea los device-types de todo el inventario antes de lanzar shards, "
+            "o merge-reports: une los informes de los shards"
+        ),
+    )
+    parser.add_argument(
+        "files",
+        nargs="*",
+        help="merge-reports: informes a unir (por defecto los sync_report.shard-*.json)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Dispositivos procesados en paralelo (por defecto 1)",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=["threads", "async"],
+        default="threads",
+        help="Motor de sincronización: hilos (requests) o asyncio (aiohttp)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=ASYNC_CONCURRENCY,
+        help="Peticiones en vuelo con --engine async",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Salta los dispositivos sin cambios desde la última ejecución (STATE_DB_PATH)",
+    )
+    parser.add_argument(
+        "--non-interactive",
+        action="store_true",
+        help="No preguntar: los modelos sin match se encolan para `resolve`",
+    )
+    parser.add_argument(
+        "--delete-devices",
+        action="store_true",
+        default=RECONCILE_DELETE_DEVICES,
+        help="reconcile: borra los devices que ya no están en LibreNMS",
+    )
+    parser.add_argument(
+        "--plan",
+        default=RECONCILE_PLAN_PATH,
+        help="reconcile: fichero donde se guarda el plan de cambios (con DRY_RUN no se aplica)",
+    )
+    parser.add_argument(
+        "--shard",
+        help="Procesa solo la parte i/N del inventario (p.ej. 2/4), para repartir entre hosts o procesos",
+    )
+    parser.add_argument(
+        "--shard-by",
+        choices=["device_id", "location"],
+        default="device_id",
+        help="Clave de reparto entre shards (por defecto device_id)",
+    )
+    parser.add_argument(
+        "--local-shards",
+        type=int,
+        default=0,
+        help="Lanza N procesos con --shard i/N en este host y une sus informes",
+    )
+    parser.add_argument(
+        "--log-level",
+        default=LOG_LEVEL,
+        choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+        type=str.upper,
+        help="Nivel de log (DEBUG incluye el detalle por interfaz)",
+    )
+    parser.add_argument(
+        "--log-format",
+        choices=["text", "json"],
+        default=LOG_FORMAT,
+        help="text o json (una línea JSON por evento)",
+    )
+    parser.add_argument(
+        "--log-file",
+        default=LOG_FILE,
+        help="Fichero de log (por defecto la salida estándar)",
+    )
+    return parser.parse_args()
+
+
+def local_shard_options(args) -> list[str]:
+    """Opciones que se pasan tal cual a cada proceso de --local-shards."""
+    options = ["--workers", str(args.workers), "--log-level", args.log_level, "--log-format", args.log_format]
+    if args.incremental:
+        options.append("--incremental")
+    if args.command == "reconcile":
+        options += ["--plan", args.plan]
+        if args.delete_devices:
+            options.append("--delete-devices")
+    return options
+
 
 if __name__ == "__main__":
-    sync_devices()
\ No newline at end of file
+    args = parse_args()
+    setup_logging(args.log_level, args.log_format, args.log_file)
+    if args.command == "resolve":
+        from resolution_queue import resolve_queue
+
+        resolve_queue()
+        raise SystemExit(0)
+    if args.command == "merge-reports":
+        from sharding import merge_shard_reports
+
+        raise SystemExit(0 if merge_shard_reports(args.files) else 1)
+    if args.non_interactive:
+        set_interactive(False)
+    if args.command == "prepare":
+        from sharding import prepare_shared_objects
+
+        prepare_shared_objects(workers=args.workers)
+        raise SystemExit(0)
+    if args.local_shards:
+        if args.engine == "async":
+            raise SystemExit("--local-shards solo está disponible con --engine threads")
+        from sharding import run_local_shards
+
+        failed = run_local_shards(
+            args.local_shards, args.command, local_shard_options(args), args.shard_by, args.workers
+        )
+        raise SystemExit(1 if failed else 0)
+    shard = None
+    if args.shard:
+        from sharding import Shard
+
+        try:
+            shard = Shard.parse(args.shard, args.shard_by)
+        except ValueError as e:
+            raise SystemExit(str(e))
+        # Varios shards en el mismo host: fabricantes y device-types se crean bajo flock
+        set_shared_lock(SHARD_LOCK_PATH)
+    if args.command == "daemon":
+        from daemon import run_daemon
+
+        run_daemon(workers=args.workers, shard=shard, delete_devices=args.delete_devices)
+        raise SystemExit(0)
+    if args.command == "reconcile":
+        from reconcile import reconcile
+
+        reconcile(workers=args.workers, delete_devices=args.delete_devices, plan_path=args.plan, shard=shard)
+        raise SystemExit(0)
+    if args.engine == "async":
+        if args.incremental:
+            raise SystemExit("--incremental solo está disponible con --engine threads")
+        if shard is not None:
+            raise SystemExit("--shard solo está disponible con --engine threads")
+        from async_engine import run_async_sync
+
+        run_async_sync(concurrency=args.concurrency)
+    else:
+        if args.workers > HTTP_POOL_SIZE:
+            log.warning("--workers %d supera HTTP_POOL_SIZE=%d", args.workers, HTTP_POOL_SIZE)
+        sync_devices(workers=args.workers, incremental=args.incremental, shard=shard)
@@ -0,0 +1,360 @@
+import heapq
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+from config import METRICS_JSON_PATH, METRICS_PROM_PATH
+
+log = logging.getLogger(__name__)
+
+# Límites (s) de los buckets de latencia, como los de prometheus_client
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SLOWEST_DEVICES = 20
+PREFIX = "syncnetbox"
+
+_ID_SEGMENT = re.compile(r"/\d+(?=/|$)")
+
+
+def endpoint_label(url: str) -> str:
+    """Ruta sin query ni ids numéricos: /api/v0/devices/12/ports -> /api/v0/devices/:id/ports"""
+    return _ID_SEGMENT.sub("/:id", urlparse(url).path) or "/"
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        for i, limit in enumerate(self.buckets):
+            if value <= limit:
+                self.counts[i] += 1
+                break
+
+    def cumulative(self) -> list[tuple[str, int]]:
+        out, acc = [], 0
+        for limit, n in zip(self.buckets, self.counts):
+            acc += n
+            out.append((f"{limit:g}", acc))
+        out.append(("+Inf", self.count))
+        return out
+
+    def quantile(self, q: float) -> float | None:
+        return _bucket_quantile(self.cumulative(), q)
+
+
+def _bucket_quantile(cumulative, q: float) -> float | None:
+    """Aproximación por bucket (límite superior), suficiente para comparar ejecuciones."""
+    cumulative = list(cumulative)
+    if not cumulative or not cumulative[-1][1]:
+        return None
+    target = q * cumulative[-1][1]
+    for limit, acc in cumulative:
+        if acc >= target:
+            return float("inf") if limit == "+Inf" else float(limit)
+    return None
+
+
+def _percentile(values: list[float], q: float) -> float | None:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def _labels(**labels) -> str:
+    def esc(v):
+        return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in labels.items()) + "}"
+
+
+def _write_atomic(path: str, text: str):
+    # El textfile collector de node_exporter no debe ver ficheros a medias
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        fh.write(text)
+    os.replace(tmp, path)
+
+
+class Metrics:
+    """
+    Métricas de una ejecución: peticiones HTTP por backend/método/endpoint
+    (número, bytes recibidos e histograma de latencia), duración de cada fase,
+    tiempo por dispositivo y contadores sueltos. Es seguro entre hilos.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.requests: Counter = Counter()
+            self.bytes: Counter = Counter()
+            self.latency: dict[tuple, Histogram] = {}
+            self.phases: Counter = Counter()
+            self.devices: Counter = Counter()
+            self.counters: Counter = Counter()
+            # Datos descriptivos de la ejecución (p.ej. el shard)
+            self.info: dict = {}
+
+    # --- Registro ---
+
+    def observe_request(self, backend: str, method: str, endpoint: str, status, seconds: float, nbytes: int = 0):
+        key = (backend, method.upper(), endpoint)
+        with self._lock:
+            self.requests[key + (str(status),)] += 1
+            self.bytes[key] += nbytes
+            hist = self.latency.get(key)
+            if hist is None:
+                hist = self.latency[key] = Histogram()
+            hist.observe(seconds)
+
+    def add_phase(self, name: str, seconds: float):
+        with self._lock:
+            self.phases[name] += seconds
+
+    @contextmanager
+    def phase(self, name: str):
+        """Suma al tiempo de la fase; si se usa desde varios hilos es tiempo acumulado."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.monotonic() - start)
+
+    def timed_iter(self, name: str, iterable):
+        """Recorre `iterable` sumando a la fase `name` solo el tiempo de espera de cada elemento."""
+        it = iter(iterable)
+        while True:
+            start = time.monotonic()
+            try:
+                item = next(it)
+            except StopIteration:
+                self.add_phase(name, time.monotonic() - start)
+                return
+            self.add_phase(name, time.monotonic() - start)
+            yield item
+
+    def observe_device(self, device_id, seconds: float):
+        with self._lock:
+            self.devices[str(device_id)] += seconds
+
+    def incr(self, name: str, n: int = 1):
+        with self._lock:
+            self.counters[name] += n
+
+    # --- Informe ---
+
+    def report(self) -> dict:
+        with self._lock:
+            endpoints = []
+            for key, hist in sorted(self.latency.items(), key=lambda kv: -kv[1].sum):
+                backend, method, endpoint = key
+                endpoints.append(
+                    {
+                        "backend": backend,
+                        "method": method,
+                        "endpoint": endpoint,
+                        "requests": hist.count,
+                        "status": {s: n for (*k, s), n in self.requests.items() if tuple(k) == key},
+                        "bytes": self.bytes[key],
+                        "seconds": round(hist.sum, 3),
+                        "p50": hist.quantile(0.5),
+                        "p95": hist.quantile(0.95),
+                        "buckets": dict(hist.cumulative()),
+                    }
+                )
+            durations = list(self.devices.values())
+            slowest = heapq.nlargest(SLOWEST_DEVICES, self.devices.items(), key=lambda kv: kv[1])
+            return {
+                "started": self.started,
+                "finished": time.time(),
+                "duration": round(time.time() - self.started, 3),
+                "requests_total": sum(self.requests.values()),
+                "bytes_total": sum(self.bytes.values()),
+                "endpoints": endpoints,
+                "phases": {k: round(v, 3) for k, v in self.phases.items()},
+                "devices": {
+                    "count": len(durations),
+                    "seconds": round(sum(durations), 3),
+                    "p50": _percentile(durations, 0.5),
+                    "p95": _percentile(durations, 0.95),
+                    "max": max(durations, default=None),
+                    "slowest": [{"device_id": k, "seconds": round(v, 3)} for k, v in slowest],
+                },
+                "counters": dict(self.counters),
+                "info": dict(self.info),
+            }
+
+    def prometheus(self) -> str:
+        return render_prometheus(self.report())
+
+    def summary(self, top: int = 5) -> str:
+        return render_summary(self.report(), top)
+
+    def write(self, json_path: str | None = METRICS_JSON_PATH, prom_path: str | None = METRICS_PROM_PATH):
+        """Escribe el informe JSON y el fichero para el textfile collector (ruta vacía = no escribir)."""
+        write_report(self.report(), json_path, prom_path)
+
+
+def render_prometheus(rep: dict) -> str:
+    lines = []
+
+    def metric(name, kind, help_text):
+        lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+
+    metric("http_requests_total", "counter", "Peticiones HTTP por backend, método, endpoint y estado")
+    for ep in rep["endpoints"]:
+        for status, n in sorted(ep["status"].items()):
+            lbl = _labels(backend=ep["backend"], method=ep["method"], endpoint=ep["endpoint"], status=status)
+            lines.append(f"{PREFIX}_http_requests_total{lbl} {n}")
+    metric("http_response_bytes_total", "counter", "Bytes recibidos por endpoint")
+    for ep in rep["endpoints"]:
+        lbl = _labels(backend=ep["backend"], method=ep["method"], endpoint=ep["endpoint"])
+        lines.append(f"{PREFIX}_http_response_bytes_total{lbl} {ep['bytes']}")
+    metric("http_request_duration_seconds", "histogram", "Latencia de las peticiones HTTP")
+    for ep in rep["endpoints"]:
+        base = dict(backend=ep["backend"], method=ep["method"], endpoint=ep["endpoint"])
+        for le, n in ep["buckets"].items():
+            lines.append(f"{PREFIX}_http_request_duration_seconds_bucket{_labels(**base, le=le)} {n}")
+        lines.append(f"{PREFIX}_http_request_duration_seconds_sum{_labels(**base)} {ep['seconds']}")
+        lines.append(f"{PREFIX}_http_request_duration_seconds_count{_labels(**base)} {ep['requests']}")
+    metric("phase_duration_seconds", "gauge", "Duración de cada fase de la última ejecución")
+    for name, seconds in sorted(rep["phases"].items()):
+        lines.append(f"{PREFIX}_phase_duration_seconds{_labels(phase=name)} {seconds}")
+    metric("device_duration_seconds", "summary", "Tiempo de sincronización por dispositivo")
+    devs = rep["devices"]
+    for q in ("p50", "p95"):
+        if devs[q] is not None:
+            lines.append(f"{PREFIX}_device_duration_seconds{_labels(quantile=f'0.{q[1:]}')} {devs[q]}")
+    lines.append(f"{PREFIX}_device_duration_seconds_sum {devs['seconds']}")
+    lines.append(f"{PREFIX}_device_duration_seconds_count {devs['count']}")
+    metric("sync_objects_last_run", "gauge", "Contadores de la última ejecución")
+    for name, n in sorted(rep["counters"].items()):
+        lines.append(f"{PREFIX}_sync_objects_last_run{_labels(name=name)} {n}")
+    metric("run_duration_seconds", "gauge", "Duración de la última ejecución")
+    lines.append(f"{PREFIX}_run_duration_seconds {rep['duration']}")
+    metric("run_finished_timestamp_seconds", "gauge", "Fin de la última ejecución (epoch)")
+    lines.append(f"{PREFIX}_run_finished_timestamp_seconds {rep['finished']:.0f}")
+    return "\n".join(lines) + "\n"
+
+
+def render_summary(rep: dict, top: int = 5) -> str:
+    head = (
+        f"Métricas: {rep['requests_total']} peticiones, {rep['bytes_total'] / 1e6:.1f} MB, "
+        f"{rep['duration']:.1f}s"
+    )
+    phases = ", ".join(f"{k} {v:.1f}s" for k, v in rep["phases"].items())
+    slow = "; ".join(
+        f"{ep['method']} {ep['endpoint']} {ep['requests']}x {ep['seconds']:.1f}s"
+        for ep in rep["endpoints"][:top]
+    )
+    counters = ", ".join(f"{k} {v}" for k, v in sorted(rep.get("counters", {}).items()) if v)
+    return f"{head}\n  fases: {phases}\n  contadores: {counters}\n  endpoints más lentos: {slow}"
+
+
+def write_report(rep: dict, json_path: str | None, prom_path: str | None):
+    try:
+        if json_path:
+            _write_atomic(json_path, json.dumps(rep, indent=2, ensure_ascii=False))
+        if prom_path:
+            _write_atomic(prom_path, render_prometheus(rep))
+    except OSError as e:
+        log.warning("no se pudo escribir el informe de métricas: %s", e)
+
+
+def merge_reports(reports: list[dict]) -> dict:
+    """
+    Combina los informes de varios shards en uno con el mismo formato:
+    peticiones, bytes, buckets y contadores se suman; los percentiles por
+    endpoint se recalculan de los buckets; cada fase dura lo que el shard más
+    lento (corren en paralelo) y p50/p95 por dispositivo son los peores.
+    """
+    endpoints: dict[tuple, dict] = {}
+    phases, counters, devices = Counter(), Counter(), {}
+    shards, slowest, dev_count, dev_seconds = [], [], 0, 0.0
+    for rep in reports:
+        for ep in rep["endpoints"]:
+            key = (ep["backend"], ep["method"], ep["endpoint"])
+            acc = endpoints.get(key)
+            if acc is None:
+                acc = endpoints[key] = {
+                    "backend": ep["backend"],
+                    "method": ep["method"],
+                    "endpoint": ep["endpoint"],
+                    "requests": 0,
+                    "status": Counter(),
+                    "bytes": 0,
+                    "seconds": 0.0,
+                    "buckets": Counter(),
+                }
+            acc["requests"] += ep["requests"]
+            acc["status"].update(ep["status"])
+            acc["bytes"] += ep["bytes"]
+            acc["seconds"] += ep["seconds"]
+            acc["buckets"].update(ep["buckets"])
+        for name, seconds in rep["phases"].items():
+            phases[name] = max(phases[name], seconds)
+        counters.update(rep["counters"])
+        devs = rep["devices"]
+        dev_count += devs["count"]
+        dev_seconds += devs["seconds"]
+        for q in ("p50", "p95", "max"):
+            if devs[q] is not None:
+                devices[q] = max(devices.get(q, devs[q]), devs[q])
+        slowest.extend(devs["slowest"])
+        shards.append({"shard": rep.get("info", {}).get("shard"), "duration": rep["duration"]})
+
+    order = [f"{limit:g}" for limit in LATENCY_BUCKETS] + ["+Inf"]
+    merged = []
+    for acc in endpoints.values():
+        cumulative = [(le, acc["buckets"][le]) for le in order]
+        merged.append(
+            {
+                **acc,
+                "status": dict(acc["status"]),
+                "seconds": round(acc["seconds"], 3),
+                "p50": _bucket_quantile(cumulative, 0.5),
+                "p95": _bucket_quantile(cumulative, 0.95),
+                "buckets": dict(cumulative),
+            }
+        )
+    merged.sort(key=lambda ep: -ep["seconds"])
+    started = min((r["started"] for r in reports), default=time.time())
+    finished = max((r["finished"] for r in reports), default=started)
+    return {
+        "started": started,
+        "finished": finished,
+        "duration": round(finished - started, 3),
+        "requests_total": sum(ep["requests"] for ep in merged),
+        "bytes_total": sum(ep["bytes"] for ep in merged),
+        "endpoints": merged,
+        "phases": {k: round(v, 3) for k, v in phases.items()},
+        "devices": {
+            "count": dev_count,
+            "seconds": round(dev_seconds, 3),
+            "p50": devices.get("p50"),
+            "p95": devices.get("p95"),
+            "max": devices.get("max"),
+            "slowest": heapq.nlargest(SLOWEST_DEVICES, slowest, key=lambda d: d["seconds"]),
+        },
+        "counters": dict(counters),
+        "info": {"shards": shards},
+    }
+
+
+METRICS = Metrics()
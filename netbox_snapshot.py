@@ -0,0 +1,186 @@
+import logging
+
+import requests
+
+from api_netbox import RESOLVER, GraphQLError, nb_get_all, nb_graphql_devices
+from config import NETBOX_GRAPHQL
+
+log = logging.getLogger(__name__)
+
+
+def _ref_id(value):
+    """Id de una referencia que NetBox devuelve anidada ({"id": ...}) o plana."""
+    return value.get("id") if isinstance(value, dict) else value
+
+
+def _librenms_key(value):
+    """Normaliza el custom field (int o str) para usarlo como clave."""
+    if value in (None, ""):
+        return None
+    return str(value)
+
+
+class NetBoxSnapshot:
+    """
+    Foto del estado de NetBox cargada una sola vez al inicio de la ejecución.
+    Cada colección se lee completa (paginada) y se indexa en memoria para que
+    las comprobaciones de existencia sean búsquedas O(1) en lugar de un GET
+    por objeto. Los índices se actualizan a medida que la sync crea objetos;
+    los de slug se comparten con el EntityResolver (seed_resolver).
+    """
+
+    def __init__(self):
+        self.devices_by_librenms_id: dict[str, int] = {}
+        self.interfaces: dict[tuple[int, str], int] = {}
+        self.interfaces_by_port: dict[str, int] = {}
+        self.interface_device: dict[int, int] = {}
+        self.interface_port: dict[int, str] = {}
+        # device id -> {"primary_ip4": id, "primary_ip6": id}
+        self.primary_ips: dict[int, dict] = {}
+        self.device_types: dict[str, int] = {}
+        self.manufacturers: dict[str, int] = {}
+        self.platforms: dict[str, int] = {}
+        self.sites: dict[str, int] = {}
+        self.roles: dict[str, int] = {}
+        # Solo con load(keep_objects=True): objetos completos para reconcile
+        self.keep_objects = False
+        self.device_objects: dict[str, dict] = {}
+        self.interface_objects: dict[str, dict] = {}
+
+    @classmethod
+    def load(cls, keep_objects: bool = False, slugs_only: bool = False):
+        """
+        Con `slugs_only` solo se leen los objetos compartidos (fabricantes,
+        device-types, plataformas, sites y roles), sin devices ni interfaces.
+        """
+        snap = cls()
+        snap.keep_objects = keep_objects
+        for obj in nb_get_all("dcim/manufacturers/"):
+            snap.manufacturers[obj["slug"]] = obj["id"]
+        for obj in nb_get_all("dcim/device-types/"):
+            snap.device_types[obj["slug"]] = obj["id"]
+        for obj in nb_get_all("dcim/platforms/"):
+            snap.platforms[obj["slug"]] = obj["id"]
+        for obj in nb_get_all("dcim/sites/"):
+            snap.sites[obj["slug"]] = obj["id"]
+        for obj in nb_get_all("dcim/device-roles/"):
+            snap.roles[obj["slug"]] = obj["id"]
+        if slugs_only:
+            log.info("Snapshot NetBox: %d device-types (solo slugs)", len(snap.device_types))
+            snap.seed_resolver()
+            return snap
+        if not (NETBOX_GRAPHQL and snap._load_graphql()):
+            for obj in nb_get_all("dcim/devices/", cf_librenms_id__empty="false"):
+                snap.store_device(obj)
+            for obj in nb_get_all("dcim/interfaces/"):
+                snap.store_interface(obj)
+        log.info(
+            "Snapshot NetBox: %d devices, %d interfaces, %d device-types",
+            len(snap.devices_by_librenms_id), len(snap.interfaces), len(snap.device_types),
+        )
+        snap.seed_resolver()
+        return snap
+
+    def _load_graphql(self) -> bool:
+        """
+        Devices e interfaces en consultas GraphQL que solo traen los campos
+        comparados. Si NetBox no lo permite (versión, permisos, esquema) se
+        descarta lo leído y devuelve False para cargar por REST.
+        """
+        try:
+            for device, interfaces in nb_graphql_devices():
+                if _librenms_key(device["custom_fields"].get("librenms_id")) is not None:
+                    self.store_device(device)
+                for obj in interfaces:
+                    self.store_interface(obj)
+        except (requests.RequestException, GraphQLError, KeyError, TypeError, ValueError) as e:
+            log.warning("lectura GraphQL no disponible (%s), se usa REST", e)
+            for index in (
+                self.devices_by_librenms_id, self.interfaces, self.interfaces_by_port, self.interface_device,
+                self.interface_port, self.primary_ips, self.device_objects, self.interface_objects,
+            ):
+                index.clear()
+            return False
+        return True
+
+    def seed_resolver(self, resolver=RESOLVER):
+        """Los índices por slug pasan a ser la caché (completa) del resolver."""
+        resolver.seed("manufacturer", self.manufacturers)
+        resolver.seed("device_type", self.device_types)
+        resolver.seed("platform", self.platforms)
+        resolver.seed("site", self.sites)
+        resolver.seed("role", self.roles)
+
+    # --- Consultas ---
+
+    def device_id(self, librenms_id):
+        return self.devices_by_librenms_id.get(_librenms_key(librenms_id))
+
+    def interface_id(self, device_id, name):
+        return self.interfaces.get((device_id, name))
+
+    def has_interface(self, device_id, name) -> bool:
+        return (device_id, name) in self.interfaces
+
+    def interface_for_port(self, port_id):
+        return self.interfaces_by_port.get(_librenms_key(port_id))
+
+    # --- Altas ---
+
+    def add_device(self, librenms_id, device_id):
+        key = _librenms_key(librenms_id)
+        if key is not None and device_id:
+            self.devices_by_librenms_id[key] = device_id
+
+    def add_interface(self, device_id, name, interface_id, port_id=None):
+        if device_id and name and interface_id:
+            self.interfaces[(device_id, name)] = interface_id
+            self.interface_device[interface_id] = device_id
+            key = _librenms_key(port_id)
+            if key is not None:
+                self.interfaces_by_port[key] = interface_id
+                self.interface_port[interface_id] = key
+
+    def set_primary_ips(self, device_id, obj: dict):
+        self.primary_ips[device_id] = {
+            field: _ref_id(obj.get(field)) for field in ("primary_ip4", "primary_ip6")
+        }
+
+    # --- Cambios aplicados por reconcile (para reutilizar la foto en modo daemon) ---
+
+    def store_device(self, obj: dict):
+        """Objeto de NetBox recién creado o actualizado (respuesta de POST/PATCH)."""
+        key = _librenms_key((obj.get("custom_fields") or {}).get("librenms_id"))
+        self.add_device(key, obj.get("id"))
+        self.set_primary_ips(obj.get("id"), obj)
+        if self.keep_objects and key is not None:
+            self.device_objects[key] = obj
+
+    def remove_device(self, obj: dict):
+        key = _librenms_key((obj.get("custom_fields") or {}).get("librenms_id"))
+        self.devices_by_librenms_id.pop(key, None)
+        self.device_objects.pop(key, None)
+        self.primary_ips.pop(obj.get("id"), None)
+        for iface in [i for i, dev in self.interface_device.items() if dev == obj.get("id")]:
+            self._drop_interface(iface)
+
+    def store_interface(self, obj: dict):
+        """Como store_device; una interfaz renombrada o adoptada pierde sus claves antiguas."""
+        self._drop_interface(obj.get("id"))
+        port_id = _librenms_key((obj.get("custom_fields") or {}).get("librenms_port_id"))
+        self.add_interface(_ref_id(obj.get("device")), obj.get("name"), obj.get("id"), port_id)
+        if self.keep_objects and port_id is not None:
+            self.interface_objects[port_id] = obj
+
+    def remove_interface(self, obj: dict):
+        self._drop_interface(obj.get("id"))
+
+    def _drop_interface(self, interface_id):
+        device_id = self.interface_device.pop(interface_id, None)
+        port_id = self.interface_port.pop(interface_id, None)
+        old = self.interface_objects.pop(port_id, None) if port_id is not None else None
+        if port_id is not None:
+            self.interfaces_by_port.pop(port_id, None)
+        # El nombre anterior solo se conoce con keep_objects (el único modo que usa estas altas/bajas)
+        if old is not None and self.interfaces.get((device_id, old.get("name"))) == interface_id:
+            del self.interfaces[(device_id, old.get("name"))]
@@ -0,0 +1,431 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from api_librenms import get_librenms_device_ports, get_librenms_ports_by_device, iter_librenms_devices
+from api_netbox import RESOLVER
+from bulk_writer import BulkWriter
+from cable_sync import sync_cables
+from config import (
+    BULK_PORTS_MIN_DEVICES,
+    DEFAULT_ROLE_SLUG,
+    DEFAULT_SITE_SLUG,
+    DRY_RUN,
+    PREFETCH_DEVICE_TYPES,
+    PREFETCH_WORKERS,
+    RECONCILE_DELETE_DEVICES,
+    RECONCILE_MAX_DELETE_RATIO,
+    RECONCILE_PLAN_PATH,
+    SYNC_CABLES,
+    SYNC_IP_ADDRESSES,
+)
+from device_type_importer import prefetch_device_types
+from ip_sync import management_ip, sync_ip_addresses
+from metrics import METRICS
+from netbox_snapshot import NetBoxSnapshot
+from resolution_queue import RESOLUTIONS
+from sync_devices import (
+    build_interface_payload,
+    desired_device,
+    get_role_id,
+    get_site_id,
+    record_created_device,
+    record_created_interface,
+    write_metrics,
+)
+
+log = logging.getLogger(__name__)
+
+DEVICES = "dcim/devices/"
+INTERFACES = "dcim/interfaces/"
+
+# Campos que reconcile mantiene alineados con LibreNMS; el resto (site, role,
+# type de interfaz...) solo se fija al crear y se respeta si alguien lo cambia
+DEVICE_DIFF_FIELDS = ("name", "device_type", "platform")
+INTERFACE_DIFF_FIELDS = ("device", "name", "description", "speed", "enabled", "mtu", "mac_address")
+
+
+def _norm(field: str, value):
+    """Valor comparable: ids en lugar de objetos anidados, MAC en mayúsculas y vacíos como None."""
+    if isinstance(value, dict):
+        value = value.get("id")
+    if isinstance(value, bool):
+        return value
+    if value in ("", 0):
+        return None
+    if field == "mac_address" and isinstance(value, str):
+        return value.upper()
+    return value
+
+
+def diff_fields(current: dict, desired: dict, fields: tuple) -> dict:
+    """{campo: [actual, deseado]} de los campos de `fields` presentes en `desired` que difieren."""
+    changes = {}
+    for field in fields:
+        if field not in desired:
+            continue
+        old, new = _norm(field, current.get(field)), _norm(field, desired[field])
+        if old != new:
+            changes[field] = [old, new]
+    return changes
+
+
+def classify(desired: dict, current: dict, fields: tuple, deletable=lambda key, obj: True):
+    """
+    Compara el estado deseado (clave -> payload) con el actual (clave ->
+    objeto de NetBox) en una pasada por cada lado. Devuelve
+    (creates [(clave, payload)], updates [(clave, id, cambios)],
+    deletes [(clave, objeto)], sin_cambios).
+    """
+    creates, updates, unchanged = [], [], 0
+    for key, payload in desired.items():
+        obj = current.get(key)
+        if obj is None:
+            creates.append((key, payload))
+            continue
+        changes = diff_fields(obj, payload, fields)
+        if changes:
+            updates.append((key, obj["id"], changes))
+        else:
+            unchanged += 1
+    deletes = [(key, obj) for key, obj in current.items() if key not in desired and deletable(key, obj)]
+    return creates, updates, deletes, unchanged
+
+
+class Plan:
+    """
+    Cambios calculados por reconcile, por endpoint y acción. Se guarda como
+    JSON (to_dict/save) para revisarlo antes de aplicarlo con DRY_RUN=false.
+    """
+
+    ACTIONS = ("create", "update", "delete")
+
+    def __init__(self):
+        self.changes: dict[str, dict[str, list]] = {}
+        self.unchanged: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def add(self, endpoint: str, action: str, entry: dict):
+        with self._lock:
+            actions = self.changes.setdefault(endpoint, {a: [] for a in self.ACTIONS})
+            actions[action].append(entry)
+
+    def entries(self, endpoint: str, action: str) -> list[dict]:
+        return self.changes.get(endpoint, {}).get(action, [])
+
+    def counts(self) -> dict:
+        endpoints = set(self.changes) | set(self.unchanged)
+        return {
+            ep: {**{a: len(self.entries(ep, a)) for a in self.ACTIONS}, "unchanged": self.unchanged[ep]}
+            for ep in sorted(endpoints)
+        }
+
+    def to_dict(self) -> dict:
+        return {
+            "generated": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "dry_run": DRY_RUN,
+            "summary": self.counts(),
+            "changes": self.changes,
+        }
+
+    def save(self, path: str):
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(self.to_dict(), fh, indent=1, ensure_ascii=False, default=str)
+        os.replace(tmp, path)
+
+    def summary(self) -> str:
+        lines = ["Plan de reconciliación:"]
+        for ep, c in self.counts().items():
+            lines.append(
+                f"  {ep:<20} +{c['create']} crear, ~{c['update']} actualizar, "
+                f"-{c['delete']} borrar, ={c['unchanged']} sin cambios"
+            )
+        return "\n".join(lines)
+
+
+def apply_changes(endpoint: str, creates, updates, deletes, on_created=None, on_updated=None) -> list:
+    """Aplica el plan de un endpoint con POST/PATCH/DELETE de lista. Devuelve los rechazados."""
+    writers = []
+    if deletes:
+        # Primero los borrados: liberan nombres que una alta o un cambio puede reutilizar
+        writer = BulkWriter(endpoint, method="DELETE")
+        for key, obj_id in deletes:
+            writer.add(key, {"id": obj_id})
+        writers.append(writer)
+        writer.flush()
+    if updates:
+        writer = BulkWriter(endpoint, method="PATCH", on_created=on_updated)
+        for key, payload in updates:
+            writer.add(key, payload)
+        writers.append(writer)
+        writer.flush()
+    if creates:
+        writer = BulkWriter(endpoint, on_created=on_created)
+        for key, payload in creates:
+            writer.add(key, payload)
+        writers.append(writer)
+        writer.flush()
+    return [(w.method, key, err) for w in writers for key, _, err in w.failed]
+
+
+def guard_deletes(endpoint: str, deletes: list, total: int) -> list:
+    """
+    Deja los borrados solo si no superan RECONCILE_MAX_DELETE_RATIO de los
+    `total` objetos en juego: un borrado masivo casi siempre viene de un
+    inventario incompleto, no de bajas reales.
+    """
+    if deletes and total and len(deletes) / total > RECONCILE_MAX_DELETE_RATIO:
+        log.error(
+            "%s: %d de %d objetos a borrar supera RECONCILE_MAX_DELETE_RATIO=%.2f; no se borra nada",
+            endpoint, len(deletes), total, RECONCILE_MAX_DELETE_RATIO,
+        )
+        METRICS.incr("deletes_blocked", len(deletes))
+        return []
+    return deletes
+
+
+def _record_plan(plan, endpoint, creates, updates, deletes, unchanged):
+    for key, payload in creates:
+        plan.add(endpoint, "create", {"key": key, "payload": payload})
+    for key, obj_id, changes in updates:
+        plan.add(endpoint, "update", {"key": key, "id": obj_id, "changes": changes})
+    for key, obj in deletes:
+        plan.add(endpoint, "delete", {"key": key, "id": obj["id"], "name": obj.get("name")})
+    plan.unchanged[endpoint] += unchanged
+
+
+def _apply(endpoint, creates, updates, deletes, on_created=None, on_updated=None, on_deleted=None) -> list:
+    failed = apply_changes(
+        endpoint,
+        creates,
+        [(key, {"id": obj_id, **{f: new for f, (_, new) in changes.items()}}) for key, obj_id, changes in updates],
+        [(key, obj["id"]) for key, obj in deletes],
+        on_created,
+        on_updated,
+    )
+    if on_deleted:
+        rejected = {key for method, key, _ in failed if method == "DELETE"}
+        for key, obj in deletes:
+            if key not in rejected:
+                on_deleted(obj)
+    return [(endpoint, method, key, err) for method, key, err in failed]
+
+
+def reconcile(
+    workers: int = 1,
+    delete_devices: bool = RECONCILE_DELETE_DEVICES,
+    plan_path: str = RECONCILE_PLAN_PATH,
+    shard=None,
+    snapshot=None,
+):
+    """
+    Lleva NetBox al estado que indica LibreNMS: crea lo que falta, corrige
+    los campos que han cambiado (nombre, device-type, velocidad, MTU, MAC...)
+    y borra las interfaces cuyo puerto ya no existe. Los dispositivos que
+    desaparecen de LibreNMS solo se borran con `delete_devices`.
+
+    Con DRY_RUN no se escribe nada: el plan se guarda en `plan_path`.
+    Con `shard` solo se reconcilian sus dispositivos (y los huérfanos que le
+    tocan); el plan va a un fichero por shard. `snapshot` permite pasar una
+    foto recién cargada con keep_objects=True, que queda al día al terminar.
+    """
+    RESOLVER.reset_stats()
+    METRICS.reset()
+    if snapshot is None:
+        with METRICS.phase("snapshot"):
+            snapshot = NetBoxSnapshot.load(keep_objects=True)
+    try:
+        site_id = get_site_id(DEFAULT_SITE_SLUG)
+        role_id = get_role_id(DEFAULT_ROLE_SLUG)
+    except Exception as e:
+        log.error("%s", e)
+        return None
+
+    try:
+        with METRICS.phase("inventory"):
+            devices = list(iter_librenms_devices())
+    except (requests.RequestException, ValueError) as e:
+        # Con un listado parcial los devices que faltan parecerían bajas
+        log.error("inventario de LibreNMS incompleto (%s); no se reconcilia nada", e)
+        return None
+    log.info("LibreNMS → %d devices", len(devices))
+    if not devices:
+        # Un inventario vacío casi siempre es un fallo de LibreNMS, no una baja masiva
+        log.warning("LibreNMS no devolvió dispositivos; no se reconcilia nada")
+        return None
+    in_librenms = {str(d.get("device_id")) for d in devices}
+    if shard is not None:
+        # Los borrados miran el inventario completo: un device de otro shard no es huérfano
+        devices = [d for d in devices if shard.owns(d)]
+        log.info("Shard %s → %d devices", shard, len(devices))
+        if plan_path:
+            plan_path = shard.path(plan_path)
+
+    plan, failed = reconcile_devices(
+        snapshot,
+        devices,
+        site_id,
+        role_id,
+        workers,
+        deletable=lambda key, obj: (
+            delete_devices and key not in in_librenms and (shard is None or shard.owns_orphan(key))
+        ),
+    )
+
+    owned = {snapshot.device_id(d.get("device_id")) for d in devices} if shard else None
+    if SYNC_IP_ADDRESSES and not DRY_RUN:
+        with METRICS.phase("ip_sync"):
+            mgmt_ips = {d.get("device_id"): management_ip(d) for d in devices}
+            sync_ip_addresses(snapshot, mgmt_ips, only_devices=owned)
+    if SYNC_CABLES and not DRY_RUN:
+        with METRICS.phase("cable_sync"):
+            sync_cables(snapshot, only_devices=owned)
+
+    finish_reconcile(plan, failed, plan_path, shard)
+    return plan
+
+
+def reconcile_devices(snapshot, devices, site_id, role_id, workers: int = 1, deletable=lambda key, obj: False):
+    """
+    Planifica y aplica (salvo DRY_RUN) los cambios de `devices` y de sus
+    interfaces contra `snapshot` (cargada con keep_objects=True), que se
+    actualiza con lo aplicado. `deletable(clave, objeto)` decide qué devices
+    de NetBox sin dispositivo en `devices` se borran. Devuelve (plan,
+    rechazados [(endpoint, método, clave, error)]).
+    """
+    if PREFETCH_DEVICE_TYPES:
+        with METRICS.phase("device_type_prefetch"):
+            prefetch_device_types(devices, PREFETCH_WORKERS)
+
+    plan = Plan()
+    failed = []
+
+    def device_created(lid, obj):
+        record_created_device(snapshot, lid, obj)
+        snapshot.store_device(obj)
+
+    def interface_created(key, obj):
+        record_created_interface(snapshot, obj)
+        snapshot.store_interface(obj)
+
+    # Dispositivos
+    with METRICS.phase("plan_devices"):
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            planned = [p for p in pool.map(lambda d: desired_device(d, site_id, role_id), devices) if p]
+        desired = {str(lid): payload for lid, _, payload in planned}
+        creates, updates, deletes, unchanged = classify(desired, snapshot.device_objects, DEVICE_DIFF_FIELDS, deletable)
+        deletes = guard_deletes(DEVICES, deletes, len(snapshot.device_objects))
+        _record_plan(plan, DEVICES, creates, updates, deletes, unchanged)
+    if not DRY_RUN:
+        with METRICS.phase("apply_devices"):
+            failed += _apply(
+                DEVICES,
+                creates,
+                updates,
+                deletes,
+                device_created,
+                lambda lid, obj: snapshot.store_device(obj),
+                snapshot.remove_device,
+            )
+
+    # Interfaces de los dispositivos que siguen en LibreNMS y tienen id en NetBox
+    with METRICS.phase("plan_interfaces"):
+        managed = {}
+        for lid in desired:
+            nb_dev_id = snapshot.device_id(lid)
+            if nb_dev_id or DRY_RUN:
+                managed[lid] = nb_dev_id
+        ports_by_device = None
+        if len(managed) >= BULK_PORTS_MIN_DEVICES:
+            ports_by_device = get_librenms_ports_by_device()
+        if ports_by_device is None:
+            with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+                fetched = pool.map(get_librenms_device_ports, managed)
+                ports_by_device = {lid: ports for lid, ports in zip(managed, fetched)}
+        else:
+            ports_by_device = {str(k): v for k, v in ports_by_device.items()}
+        if managed and not any(ports_by_device.values()):
+            # Ningún puerto para ningún device: fallo de LibreNMS, no una baja masiva
+            log.warning("LibreNMS no devolvió puertos; no se reconcilian interfaces")
+            return plan, failed
+
+        # Solo se tocan (y borran) interfaces de devices cuyos puertos han llegado
+        confirmed = {lid: nb_dev_id for lid, nb_dev_id in managed.items() if lid in ports_by_device}
+        desired_ifs = {}
+        for lid, nb_dev_id in confirmed.items():
+            for p in ports_by_device[lid]:
+                if p.get("ifName") or p.get("ifDescr"):
+                    desired_ifs[str(p.get("port_id"))] = build_interface_payload(nb_dev_id, p)
+        confirmed_ids = {nb_dev_id for nb_dev_id in confirmed.values() if nb_dev_id}
+
+        def on_confirmed(obj):
+            return (obj.get("device") or {}).get("id") in confirmed_ids
+
+        creates, updates, deletes, unchanged = classify(
+            desired_ifs,
+            snapshot.interface_objects,
+            INTERFACE_DIFF_FIELDS,
+            deletable=lambda key, obj: on_confirmed(obj),
+        )
+        creates, updates, deletes = _adopt_interfaces(snapshot, creates, updates, deletes)
+        in_scope = sum(1 for obj in snapshot.interface_objects.values() if on_confirmed(obj))
+        deletes = guard_deletes(INTERFACES, deletes, in_scope)
+        _record_plan(plan, INTERFACES, creates, updates, deletes, unchanged)
+    if not DRY_RUN:
+        with METRICS.phase("apply_interfaces"):
+            failed += _apply(
+                INTERFACES,
+                creates,
+                updates,
+                deletes,
+                interface_created,
+                lambda key, obj: snapshot.store_interface(obj),
+                snapshot.remove_interface,
+            )
+    return plan, failed
+
+
+def finish_reconcile(plan, failed, plan_path: str | None = None, shard=None):
+    """Resumen, plan en disco y métricas de una reconciliación."""
+    RESOLUTIONS.save()
+    log.info("%s", plan.summary())
+    log.info("%s", RESOLVER.summary())
+    if plan_path:
+        try:
+            plan.save(plan_path)
+            log.info("Plan guardado en %s", plan_path)
+        except OSError as e:
+            log.warning("no se pudo guardar el plan en %s: %s", plan_path, e)
+    if failed:
+        log.error("Reconciliación con errores: %d objetos rechazados", len(failed))
+    for ep, c in plan.counts().items():
+        for action in Plan.ACTIONS:
+            METRICS.incr(f"{ep.split('/')[1]}_{action}_planned", c[action])
+    log.info("%s", METRICS.summary())
+    write_metrics(shard)
+
+
+def _adopt_interfaces(snapshot, creates, updates, deletes):
+    """
+    Una interfaz a crear cuyo (device, nombre) ya existe en NetBox (creada a
+    mano, o con otro port_id tras un rediscovery) se actualiza en lugar de
+    chocar con la restricción de unicidad, y se retira de los borrados.
+    """
+    pending_delete = {obj["id"]: (key, obj) for key, obj in deletes}
+    keep = []
+    for key, payload in creates:
+        existing = snapshot.interface_id(payload.get("device"), payload.get("name"))
+        if not existing:
+            keep.append((key, payload))
+            continue
+        pending_delete.pop(existing, None)
+        changes = {f: [None, v] for f, v in payload.items() if f != "device"}
+        updates.append((key, existing, changes))
+    return keep, updates, list(pending_delete.values())
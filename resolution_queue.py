@@ -0,0 +1,200 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+from config import DEVICE_TYPE_MAP_PATH, INTERACTIVE, RESOLUTION_QUEUE_PATH
+from sync_locks import PROMPT_LOCK, SHARED_LOCK
+
+log = logging.getLogger(__name__)
+
+# Valores especiales del fichero de mapeo además de una ruta del árbol
+GENERIC = "generic"
+SKIP = "skip"
+
+
+def _key(vendor: str, slug: str) -> str:
+    return f"{vendor}/{slug}"
+
+
+def _read_json(path: str) -> dict:
+    try:
+        with open(path, encoding="utf-8") as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        log.warning("no se pudo leer %s: %s", path, e)
+        return {}
+
+
+def _mtime(path: str) -> float | None:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _write_json(path: str, data: dict):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump(data, fh, indent=2, sort_keys=True, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+class Resolutions:
+    """
+    Decisiones sobre modelos sin match exacto en devicetype-library:
+
+    - mapeo persistente (DEVICE_TYPE_MAP_PATH): "vendor/modelo" -> ruta del
+      árbol, "generic" o "skip"; se aplica automáticamente en cada ejecución.
+    - cola (RESOLUTION_QUEUE_PATH): modelos pendientes con sus sugerencias,
+      que `main.py resolve` procesa en lote.
+    """
+
+    def __init__(self, map_path: str = DEVICE_TYPE_MAP_PATH, queue_path: str = RESOLUTION_QUEUE_PATH):
+        self.map_path = map_path
+        self.queue_path = queue_path
+        self.mapping = _read_json(map_path)
+        self.queue = _read_json(queue_path)
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._resolved: set[str] = set()
+        self._map_mtime = _mtime(map_path)
+
+    def lookup(self, vendor: str, slug: str) -> str | None:
+        return self.mapping.get(_key(vendor, slug))
+
+    def set_choice(self, vendor: str, slug: str, choice: str):
+        with self._lock:
+            self.mapping[_key(vendor, slug)] = choice
+            self.queue.pop(_key(vendor, slug), None)
+            self._resolved.add(_key(vendor, slug))
+            self._dirty = True
+
+    def defer(self, vendor: str, slug: str, suggestions: list[str]):
+        with self._lock:
+            entry = self.queue.setdefault(
+                _key(vendor, slug),
+                {"vendor": vendor, "model": slug, "first_seen": time.strftime("%Y-%m-%d %H:%M:%S")},
+            )
+            entry["suggestions"] = list(suggestions)
+            entry["hits"] = entry.get("hits", 0) + 1
+            self._dirty = True
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            with SHARED_LOCK.hold():
+                self._merge_from_disk()
+                _write_json(self.map_path, self.mapping)
+                _write_json(self.queue_path, self.queue)
+                self._map_mtime = _mtime(self.map_path)
+            self._dirty = False
+            # Ya están en disco: a partir de aquí manda lo que haya en el fichero
+            self._resolved.clear()
+
+    def refresh(self) -> bool:
+        """
+        Relee el mapeo si cambió en disco desde la última lectura o escritura
+        (p.ej. un `main.py resolve` con el daemon en marcha). Devuelve True si
+        había cambios.
+        """
+        if _mtime(self.map_path) == self._map_mtime:
+            return False
+        with self._lock, SHARED_LOCK.hold():
+            self._merge_from_disk()
+            self._map_mtime = _mtime(self.map_path)
+        log.info("Mapeo de device-types releído de %s", self.map_path)
+        return True
+
+    def _merge_from_disk(self):
+        """
+        Otros procesos (shards, `main.py resolve`) escriben los mismos
+        ficheros: se combinan en vez de pisarlos. En el mapeo gana lo que hay
+        en disco salvo las decisiones de este proceso aún sin guardar, y de la
+        cola se quita lo que ya está resuelto.
+        """
+        for key, choice in _read_json(self.map_path).items():
+            if key not in self._resolved:
+                self.mapping[key] = choice
+        for key in [k for k in self.queue if k in self.mapping]:
+            del self.queue[key]
+        for key, entry in _read_json(self.queue_path).items():
+            if key not in self.mapping:
+                self.queue.setdefault(key, entry)
+
+
+RESOLUTIONS = Resolutions()
+_interactive = sys.stdin.isatty() if INTERACTIVE == "auto" else INTERACTIVE == "true"
+
+
+def set_interactive(enabled: bool):
+    global _interactive
+    _interactive = enabled
+
+
+def ask_choice(slug_key: str, suggestions: list[str]) -> str | None:
+    """Pregunta al usuario. Devuelve una ruta, GENERIC o None para saltar."""
+    with PROMPT_LOCK:
+        print(f"No encontró '{slug_key}'. Sugerencias:")
+        for idx, path in enumerate(suggestions, 1):
+            print(f"  {idx}) {path}")
+        gen_idx = len(suggestions) + 1
+        print(f"  {gen_idx}) [GENÉRICO] Crear tipo de dispositivo genérico")
+        choice = input(f"Elige número (1-{gen_idx}) o ENTER para saltar: ")
+    if not choice.isdigit():
+        log.debug("No se seleccionó ninguna opción. Saltando.")
+        return None
+    sel = int(choice) - 1
+    if 0 <= sel < len(suggestions):
+        log.debug("Sugerencia seleccionada: %s", suggestions[sel])
+        return suggestions[sel]
+    if sel == len(suggestions):
+        log.debug("Opción genérica seleccionada.")
+        return GENERIC
+    log.debug("Selección fuera de rango, saltando.")
+    return None
+
+
+def choose_device_type(vendor: str, slug_key: str, suggestions: list[str]) -> str | None:
+    """
+    Decide qué hacer con un modelo sin match exacto: primero el mapeo
+    persistente; si no, pregunta (modo interactivo) o lo encola y difiere el
+    dispositivo sin bloquear al resto (modo no interactivo).
+    """
+    mapped = RESOLUTIONS.lookup(vendor, slug_key)
+    if mapped:
+        return None if mapped == SKIP else mapped
+    if not _interactive:
+        RESOLUTIONS.defer(vendor, slug_key, suggestions)
+        log.info("DEFERIDO '%s/%s': pendiente de `main.py resolve`", vendor, slug_key)
+        return None
+    if not suggestions:
+        log.info("Sin sugerencias para '%s'. Dispositivo saltado.", slug_key)
+        return None
+    choice = ask_choice(slug_key, suggestions)
+    if choice:
+        RESOLUTIONS.set_choice(vendor, slug_key, choice)
+    return choice
+
+
+def resolve_queue():
+    """Procesa en lote la cola de modelos pendientes (comando `resolve`)."""
+    pending = sorted(RESOLUTIONS.queue.values(), key=lambda e: -e.get("hits", 0))
+    if not pending:
+        print("No hay modelos pendientes de resolver.")
+        return
+    print(f"{len(pending)} modelos pendientes")
+    for entry in pending:
+        vendor, model = entry["vendor"], entry["model"]
+        print(f"\n== {vendor}/{model} ({entry.get('hits', 0)} apariciones)")
+        choice = ask_choice(model, entry.get("suggestions", []))
+        if choice:
+            RESOLUTIONS.set_choice(vendor, model, choice)
+        elif input("¿Ignorar este modelo en adelante? (s/N): ").strip().lower() == "s":
+            RESOLUTIONS.set_choice(vendor, model, SKIP)
+        RESOLUTIONS.save()
@@ -0,0 +1,155 @@
+import glob
+import json
+import logging
+import os
+import subprocess
+import sys
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from api_librenms import iter_librenms_devices
+from config import METRICS_JSON_PATH, METRICS_PROM_PATH, PREFETCH_DEVICE_TYPES, PREFETCH_WORKERS
+from device_type_importer import import_device_type_if_exists, prefetch_device_types
+from device_utils import resolve_device_type, validate_device
+from metrics import merge_reports, render_summary, write_report
+from netbox_snapshot import NetBoxSnapshot
+from resolution_queue import RESOLUTIONS
+
+log = logging.getLogger(__name__)
+
+SHARD_KEYS = ("device_id", "location")
+
+
+class Shard:
+    """
+    Parte `index` (1..count) del inventario de LibreNMS. El reparto es
+    determinista (crc32 de la clave), así que cada host o proceso puede
+    calcular su parte sin coordinarse con los demás.
+
+    - device_id: reparto uniforme.
+    - location: todos los dispositivos de una ubicación caen en el mismo
+      shard (útil si cada host tiene cerca sus sitios).
+    """
+
+    def __init__(self, index: int, count: int, by: str = "device_id"):
+        if count < 1 or not 1 <= index <= count:
+            raise ValueError(f"shard fuera de rango: {index}/{count}")
+        if by not in SHARD_KEYS:
+            raise ValueError(f"clave de reparto desconocida: {by}")
+        self.index = index
+        self.count = count
+        self.by = by
+
+    @classmethod
+    def parse(cls, spec: str, by: str = "device_id"):
+        """"2/4" -> Shard(2, 4)."""
+        try:
+            index, count = (int(part) for part in spec.split("/"))
+        except ValueError:
+            raise ValueError(f"--shard espera i/N (p.ej. 1/4), no '{spec}'") from None
+        return cls(index, count, by)
+
+    def _bucket(self, key) -> int:
+        return zlib.crc32(str(key).encode("utf-8")) % self.count + 1
+
+    def owns(self, d) -> bool:
+        key = d.get("device_id") if self.by == "device_id" else (d.get("location") or "")
+        return self._bucket(key) == self.index
+
+    def owns_orphan(self, librenms_id) -> bool:
+        """Devices de NetBox que ya no están en LibreNMS: sin ubicación conocida, los borra el shard 1."""
+        if self.by == "device_id":
+            return self._bucket(librenms_id) == self.index
+        return self.index == 1
+
+    def suffix(self) -> str:
+        return f"shard-{self.index}-of-{self.count}"
+
+    def path(self, path: str) -> str:
+        """sync_report.json -> sync_report.shard-1-of-4.json"""
+        root, ext = os.path.splitext(path)
+        return f"{root}.{self.suffix()}{ext}"
+
+    def __str__(self):
+        return f"{self.index}/{self.count}"
+
+
+def shard_files(path: str) -> list[str]:
+    """Informes por shard de `path`; si hay de varios repartos (1-of-2, 1-of-4...), los del más reciente."""
+    root, ext = os.path.splitext(path)
+    groups = {}
+    for name in glob.glob(f"{root}.shard-*-of-*{ext}"):
+        count = name[: -len(ext) or None].rsplit("-of-", 1)[1]
+        groups.setdefault(count, []).append(name)
+    if not groups:
+        return []
+    return sorted(max(groups.values(), key=lambda names: max(os.path.getmtime(n) for n in names)))
+
+
+def prepare_shared_objects(workers: int = 1):
+    """
+    Pasada previa a los shards: resuelve e importa una sola vez todos los
+    device-types (y sus fabricantes) del inventario completo, y guarda las
+    decisiones de modelos sin match. Así los shards solo encuentran objetos
+    compartidos ya creados, estén en el mismo host o no.
+    """
+    NetBoxSnapshot.load(slugs_only=True)
+    devices = [d for d in iter_librenms_devices() if validate_device(d)]
+    log.info("LibreNMS → %d devices", len(devices))
+    if PREFETCH_DEVICE_TYPES:
+        prefetch_device_types(devices, PREFETCH_WORKERS)
+    models = {resolve_device_type(d) for d in devices}
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        resolved = list(pool.map(lambda vm: import_device_type_if_exists(*vm), models))
+    RESOLUTIONS.save()
+    missing = resolved.count(None)
+    log.info("Preparación → %d modelos, %d con device-type, %d sin resolver", len(models), len(models) - missing, missing)
+
+
+def merge_shard_reports(
+    files: list[str] | None = None, json_path: str = METRICS_JSON_PATH, prom_path: str = METRICS_PROM_PATH
+):
+    """Une los informes de los shards (por defecto, los sync_report.shard-*.json) en el informe normal."""
+    files = files or shard_files(json_path)
+    reports = []
+    for path in files:
+        try:
+            with open(path, encoding="utf-8") as fh:
+                reports.append(json.load(fh))
+        except (OSError, ValueError) as e:
+            log.warning("no se pudo leer %s: %s", path, e)
+    if not reports:
+        log.warning("No hay informes de shards que unir.")
+        return None
+    merged = merge_reports(reports)
+    write_report(merged, json_path, prom_path)
+    log.info("%d informes unidos en %s", len(reports), json_path)
+    log.info("%s", render_summary(merged))
+    return merged
+
+
+def run_local_shards(count: int, command: str, options: list[str], shard_by: str = "device_id", workers: int = 1) -> int:
+    """
+    Lanza `count` procesos `main.py <command> --shard i/count` en este host,
+    tras la pasada de preparación, y une sus informes. La salida de cada
+    shard va a sync.shard-i-of-N.log. Devuelve el número de shards fallidos.
+    """
+    prepare_shared_objects(workers)
+    main = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+    procs = []
+    for index in range(1, count + 1):
+        shard = Shard(index, count, shard_by)
+        out = open(shard.path("sync.log"), "w", encoding="utf-8")
+        cmd = [sys.executable, main, command, "--shard", str(shard), "--shard-by", shard_by, "--non-interactive"]
+        cmd += options
+        procs.append((shard, out, subprocess.Popen(cmd, stdout=out, stderr=subprocess.STDOUT)))
+        log.info("Shard %s lanzado (pid %d, log %s)", shard, procs[-1][2].pid, out.name)
+    failed = 0
+    for shard, out, proc in procs:
+        code = proc.wait()
+        out.close()
+        if code:
+            failed += 1
+            log.error("shard %s: terminó con código %d (ver %s)", shard, code, out.name)
+    merge_shard_reports([s.path(METRICS_JSON_PATH) for s, _, _ in procs])
+    return failed
@@ -0,0 +1,113 @@
+import hashlib
+import json
+import sqlite3
+import threading
+
+from config import STATE_DB_PATH
+
+# Campos que sync_devices traslada a NetBox; cualquier otro cambio se ignora
+DEVICE_FIELDS = ("hostname", "sysName", "hardware", "os")
+PORT_FIELDS = ("ifName", "ifDescr", "ifSpeed", "ifMtu", "ifPhysAddress", "ifOperStatus")
+
+
+def fingerprint(obj: dict, fields: tuple) -> str:
+    values = [obj.get(f) for f in fields]
+    return hashlib.sha1(json.dumps(values, default=str).encode()).hexdigest()
+
+
+class StateStore:
+    """
+    Huellas (hash de contenido) de los dispositivos y puertos ya sincronizados,
+    persistidas en SQLite entre ejecuciones para el modo --incremental.
+    """
+
+    def __init__(self, path: str = STATE_DB_PATH):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS devices (
+                device_id INTEGER PRIMARY KEY,
+                hash TEXT NOT NULL,
+                last_polled TEXT,
+                last_discovered TEXT
+            );
+            CREATE TABLE IF NOT EXISTS ports (
+                port_id INTEGER PRIMARY KEY,
+                device_id INTEGER NOT NULL,
+                hash TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS ports_device ON ports (device_id);
+            """
+        )
+        self._devices = {
+            row[0]: row[1:]
+            for row in self._conn.execute(
+                "SELECT device_id, hash, last_polled, last_discovered FROM devices"
+            )
+        }
+
+    def device_unchanged(self, d: dict) -> bool:
+        """True si ni el contenido ni last_polled/last_discovered han cambiado."""
+        stored = self._devices.get(d.get("device_id"))
+        if stored is None:
+            return False
+        return stored == (
+            fingerprint(d, DEVICE_FIELDS),
+            d.get("last_polled"),
+            d.get("last_discovered"),
+        )
+
+    def changed_ports(self, device_id, ports: list) -> list:
+        """Filtra los puertos cuya huella difiere de la guardada."""
+        with self._lock:
+            stored = dict(
+                self._conn.execute(
+                    "SELECT port_id, hash FROM ports WHERE device_id = ?", (device_id,)
+                )
+            )
+        return [p for p in ports if stored.get(p.get("port_id")) != fingerprint(p, PORT_FIELDS)]
+
+    def record_device(self, d: dict, ports: list):
+        row = (
+            d.get("device_id"),
+            fingerprint(d, DEVICE_FIELDS),
+            d.get("last_polled"),
+            d.get("last_discovered"),
+        )
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO devices VALUES (?, ?, ?, ?)", row)
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO ports VALUES (?, ?, ?)",
+                [(p.get("port_id"), row[0], fingerprint(p, PORT_FIELDS)) for p in ports],
+            )
+            self._devices[row[0]] = row[1:]
+
+    def forget_devices(self, device_ids):
+        """Descarta huellas de objetos que no llegaron a NetBox, para reintentarlos."""
+        ids = [(i,) for i in device_ids]
+        with self._lock:
+            self._conn.executemany("DELETE FROM devices WHERE device_id = ?", ids)
+            for (i,) in ids:
+                self._devices.pop(i, None)
+
+    def forget_ports(self, port_ids):
+        # El dispositivo también se olvida: si no, se saltaría y el puerto
+        # no volvería a intentarse mientras LibreNMS no lo sondee de nuevo
+        ids = [(i,) for i in port_ids]
+        with self._lock:
+            device_ids = {
+                row[0]
+                for i in ids
+                for row in self._conn.execute("SELECT device_id FROM ports WHERE port_id = ?", i)
+            }
+            self._conn.executemany("DELETE FROM ports WHERE port_id = ?", ids)
+        self.forget_devices(device_ids)
+
+    def commit(self):
+        with self._lock:
+            self._conn.commit()
+
+    def close(self):
+        self.commit()
+        self._conn.close()
@@ -1,102 +1,322 @@
-from api_librenms import get_librenms_devices, get_librenms_device_ports
-from api_netbox import nb_get, nb_post
-from device_type_importer import import_device_type_if_exists
+import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from api_librenms import (
+    iter_librenms_devices,
+    get_librenms_device_ports,
+    get_librenms_ports_by_device,
+)
+from api_netbox import RESOLVER
+from bulk_writer import BulkWriter
+from cable_sync import sync_cables
+from metrics import METRICS
+from device_type_importer import import_device_type_if_exists, prefetch_device_types
 from device_utils import resolve_device_type, validate_device
-from config import DEFAULT_SITE_SLUG, DEFAULT_ROLE_SLUG
+from ip_sync import management_ip, sync_ip_addresses
+from netbox_snapshot import NetBoxSnapshot
+from resolution_queue import RESOLUTIONS
+from state_store import StateStore
+from config import (
+    BULK_PORTS_MIN_DEVICES,
+    DEFAULT_ROLE_SLUG,
+    DEFAULT_SITE_SLUG,
+    DRY_RUN,
+    METRICS_JSON_PATH,
+    PREFETCH_DEVICE_TYPES,
+    PREFETCH_WORKERS,
+    STATE_DB_PATH,
+    SYNC_CABLES,
+    SYNC_IP_ADDRESSES,
+)
+
+log = logging.getLogger(__name__)
 
 
 def get_site_id(slug: str):
-    resp = nb_get("dcim/sites/", slug=slug)
-    if resp.get("count"):
-        return resp["results"][0]["id"]
+    site_id = RESOLVER.lookup("site", slug)
+    if site_id:
+        return site_id
     raise ValueError(f"No existe el sitio: {slug}")
 
 
 def get_role_id(slug: str):
-    resp = nb_get("dcim/device-roles/", slug=slug)
-    if resp.get("count"):
-        return resp["results"][0]["id"]
+    role_id = RESOLVER.lookup("role", slug)
+    if role_id:
+        return role_id
     raise ValueError(f"No existe el role: {slug}")
 
 
 def get_platform_id(slug: str | None):
     if not slug:
         return None
-    resp = nb_get("dcim/platforms/", slug=slug)
-    if resp.get("count"):
-        return resp["results"][0]["id"]
-    return None
+    return RESOLVER.lookup("platform", slug)
+
+
+def build_device_payload(d: dict, dtid, platform_id, site_id, role_id) -> dict:
+    pl = {
+        "name": d.get("hostname") or d.get("sysName"),
+        "device_type": dtid,
+        "role": role_id,
+        "site": site_id,
+        "status": "active",
+        "custom_fields": {"librenms_id": str(d.get("device_id"))},
+    }
+    if platform_id:
+        pl["platform"] = platform_id
+    return pl
+
+
+def build_interface_payload(nb_dev_id, p: dict) -> dict:
+    payload = {
+        "device": nb_dev_id,
+        "name": p.get("ifName") or p.get("ifDescr"),
+        "description": p.get("ifDescr") or "",
+        "speed": p.get("ifSpeed") or 0,
+        "enabled": ((p.get("ifOperStatus") or "").lower() == "up"),
+        "type": "other",
+        "custom_fields": {"librenms_port_id": str(p.get("port_id"))},
+    }
+    if p.get("ifPhysAddress"):
+        payload["mac_address"] = p.get("ifPhysAddress")
+    if p.get("ifMtu"):
+        payload["mtu"] = p.get("ifMtu")
+    return payload
+
+
+def missing_interfaces(ports, nm: str, nb_dev_id, snapshot):
+    """Devuelve (port_id, payload) de los puertos que aún no existen en NetBox."""
+    missing, existing = [], 0
+    debug = log.isEnabledFor(logging.DEBUG)
+    for p in ports:
+        name = p.get("ifName") or p.get("ifDescr")
+        if not name:
+            continue
+        if snapshot.has_interface(nb_dev_id, name):
+            existing += 1
+            if debug:
+                log.debug("= IF ya existe %s en %s", name, nm)
+            continue
+        missing.append((p.get("port_id"), build_interface_payload(nb_dev_id, p)))
+    METRICS.incr("interfaces_existing", existing)
+    return missing
+
+
+def desired_device(d: dict, site_id, role_id):
+    """
+    Resuelve device-type y plataforma de un dispositivo de LibreNMS.
+    Devuelve (librenms_id, nombre, payload) con el estado que debería tener
+    en NetBox, o None si hay que saltarlo.
+    """
+    if not validate_device(d):
+        log.warning("SKIP inválido: device_id=%s hostname=%s", d.get("device_id"), d.get("hostname"))
+        return None
+    lid = d.get("device_id")
+    nm = d.get("hostname") or d.get("sysName")
+    vendor, model = resolve_device_type(d)
+    with METRICS.phase("device_type_resolution"):
+        dtid = import_device_type_if_exists(vendor, model)
+    if dtid is None:
+        METRICS.incr("devices_without_type")
+        log.warning("SKIP %s: Sin device_type válido (vendor=%s model=%s)", nm, vendor, model)
+        return None
+
+    platform_id = get_platform_id((d.get("os") or "").strip().lower())
+    return lid, nm, build_device_payload(d, dtid, platform_id, site_id, role_id)
+
+
+def plan_device(d: dict, snapshot, site_id, role_id):
+    """Como desired_device, pero payload es None si el dispositivo ya existe en NetBox."""
+    desired = desired_device(d, site_id, role_id)
+    if not desired:
+        return None
+    lid, nm, _ = desired
+    if snapshot.device_id(lid):
+        log.debug("= Ya existe %s", nm)
+        return lid, nm, None
+    return desired
+
+
+def record_created_device(snapshot, lid, obj: dict):
+    snapshot.add_device(lid, obj.get("id"))
+    METRICS.incr("devices_created")
+    log.info("+ Creado %s (%s)", obj.get("name"), lid, extra={"librenms_id": lid, "netbox_id": obj.get("id")})
+
+
+def record_created_interface(snapshot, obj: dict):
+    device = obj.get("device") or {}
+    snapshot.add_interface(
+        device.get("id"), obj.get("name"), obj.get("id"), (obj.get("custom_fields") or {}).get("librenms_port_id")
+    )
+    METRICS.incr("interfaces_created")
+    log.debug("+ IF creada %s en %s", obj.get("name"), device.get("name"))
+
 
+def imap_bounded(pool, fn, iterable, window: int):
+    """
+    Como pool.map, pero sin consumir el iterable de golpe: como mucho `window`
+    tareas pendientes, para que la memoria no crezca con el inventario.
+    """
+    pending = deque()
+    for item in iterable:
+        pending.append(pool.submit(fn, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
 
-def sync_devices():
-    devices = get_librenms_devices()
-    print(f"LibreNMS → {len(devices)} devices")
+
+def write_metrics(shard=None):
+    """Con shards, cada uno deja su informe JSON y `merge-reports` genera el conjunto (y el .prom)."""
+    if shard is None:
+        METRICS.write()
+    else:
+        METRICS.info["shard"] = str(shard)
+        METRICS.write(shard.path(METRICS_JSON_PATH), None)
+
+
+def sync_devices(workers: int = 1, incremental: bool = False, shard=None):
+    """Con `shard` solo se sincronizan los dispositivos de LibreNMS que le tocan."""
+    RESOLVER.reset_stats()
+    METRICS.reset()
+    with METRICS.phase("snapshot"):
+        snapshot = NetBoxSnapshot.load()
     try:
         site_id = get_site_id(DEFAULT_SITE_SLUG)
         role_id = get_role_id(DEFAULT_ROLE_SLUG)
     except Exception as e:
-        print(f"Error: {e}")
+        log.error("%s", e)
         return
-    for d in devices:
-        if not validate_device(d):
-            print("SKIP inválido", d)
-            continue
-        lid = d.get("device_id")
-        nm = d.get("hostname") or d.get("sysName")
-        vendor, model = resolve_device_type(d)
-        dtid = import_device_type_if_exists(vendor, model)
-        if dtid is None:
-            print(f"SKIP {nm}: Sin device_type válido (vendor={vendor} model={model})")
-            continue
+    store = None
+    if incremental:
+        store = StateStore(shard.path(STATE_DB_PATH) if shard else STATE_DB_PATH)
 
-        platform_id = get_platform_id((d.get("os") or "").strip().lower())
+    # Los dispositivos se procesan a medida que llegan de LibreNMS
+    counts = {"total": 0, "skipped": 0}
+    mgmt_ips = {}
 
-        cf = {"cf_librenms_id": lid}
-        resp_dev = nb_get("dcim/devices/", **cf)
-        if resp_dev.get("count"):
-            nb_dev_id = resp_dev["results"][0]["id"]
-            print(f"= Ya existe {nm}")
-        else:
-            pl = {
-                "name": nm,
-                "device_type": dtid,
-                "role": role_id,
-                "site": site_id,
-                "status": "active",
-                "custom_fields": {"librenms_id": str(lid)},
-            }
-            if platform_id:
-                pl["platform"] = platform_id
-            created = nb_post("dcim/devices/", pl)
-            nb_dev_id = created.get("id")
-            print(f"+ Creado {nm} ({lid}) con device_type {dtid}")
-
-        ports = get_librenms_device_ports(lid)
-        for p in ports:
-            name = p.get("ifName") or p.get("ifDescr")
-            if not name:
+    def stream_devices():
+        for d in METRICS.timed_iter("inventory", iter_librenms_devices()):
+            if shard is not None and not shard.owns(d):
                 continue
-            exists = nb_get("dcim/interfaces/", device_id=nb_dev_id, name=name).get(
-                "count", 0
-            )
-            if exists:
-                print(f"= IF ya existe {name} en {nm}")
+            counts["total"] += 1
+            mgmt_ips[d.get("device_id")] = management_ip(d)
+            # Incremental: sin cambios de contenido ni nuevo sondeo, ni se mira
+            if store is not None and store.device_unchanged(d) and snapshot.device_id(d.get("device_id")):
+                counts["skipped"] += 1
                 continue
-            payload = {
-                "device": nb_dev_id,
-                "name": name,
-                "description": p.get("ifDescr") or "",
-                "speed": p.get("ifSpeed") or 0,
-                "enabled": (p.get("ifOperStatus", "").lower() == "up"),
-                "type": "other",
-                "custom_fields": {"librenms_port_id": str(p.get("port_id"))},
-            }
-            if p.get("ifPhysAddress"):
-                payload["mac_address"] = p.get("ifPhysAddress")
-            if p.get("ifMtu"):
-                payload["mtu"] = p.get("ifMtu")
-            nb_post("dcim/interfaces/", payload)
-            print(f"+ IF creada {name} en {nm}")
+            yield d
+
+    if PREFETCH_DEVICE_TYPES:
+        # Pasada previa en streaming: solo se guardan los (vendor, modelo)
+        # distintos, el bucle principal sigue sin retener el inventario
+        with METRICS.phase("device_type_prefetch"):
+            prefetch_device_types(
+                (d for d in iter_librenms_devices() if shard is None or shard.owns(d)), PREFETCH_WORKERS
+            )
+    devices = stream_devices()
+
+    dev_writer = BulkWriter(
+        "dcim/devices/", on_created=lambda lid, obj: record_created_device(snapshot, lid, obj)
+    )
+    if_writer = BulkWriter(
+        "dcim/interfaces/", on_created=lambda port_id, obj: record_created_interface(snapshot, obj)
+    )
+
+    def sync_device(d):
+        start = time.monotonic()
+        planned = plan_device(d, snapshot, site_id, role_id)
+        METRICS.observe_device(d.get("device_id"), time.monotonic() - start)
+        if not planned:
+            return None
+        lid, nm, payload = planned
+        if payload:
+            dev_writer.add(lid, payload)
+        return d, nm
+
+    def sync_ports(item):
+        d, nm = item
+        lid = d.get("device_id")
+        start = time.monotonic()
+        try:
+            _sync_ports(d, nm, lid)
+        finally:
+            METRICS.observe_device(lid, time.monotonic() - start)
+
+    def _sync_ports(d, nm, lid):
+        nb_dev_id = snapshot.device_id(lid)
+        if not nb_dev_id and not DRY_RUN:
+            log.warning("SKIP interfaces de %s: el dispositivo no se pudo crear", nm)
+            return
+        if ports_by_device is not None:
+            ports = ports_by_device.pop(lid, [])
+        else:
+            ports = get_librenms_device_ports(lid)
+        changed = ports
+        if store is not None:
+            changed = store.changed_ports(lid, ports)
+        missing = missing_interfaces(changed, nm, nb_dev_id, snapshot)
+        for port_id, payload in missing:
+            if_writer.add(port_id, payload)
+        log.info(
+            "%s: %d puertos, %d con cambios, %d interfaces nuevas", nm, len(ports), len(changed), len(missing),
+            extra={"librenms_id": lid, "ports": len(ports), "new_interfaces": len(missing)},
+        )
+        if store is not None and not DRY_RUN:
+            store.record_device(d, ports)
+
+    workers = max(1, workers)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # Fase 1: dispositivos (los nuevos se crean por bloques)
+        with METRICS.phase("device_upsert"):
+            synced = [
+                item for item in imap_bounded(pool, sync_device, devices, workers * 4) if item
+            ]
+            dev_writer.flush()
+        METRICS.incr("devices_total", counts["total"])
+        METRICS.incr("devices_skipped", counts["skipped"])
+        log.info("LibreNMS → %d devices%s", counts["total"], f" (shard {shard})" if shard else "")
+        if store is not None:
+            log.info("Incremental → %d de %d devices con cambios", counts["total"] - counts["skipped"], counts["total"])
+
+        # Fase 2: interfaces de cada dispositivo ya presente en NetBox. Con
+        # pocos dispositivos (p.ej. incremental) compensa pedirlos uno a uno
+        ports_by_device = None
+        with METRICS.phase("interface_sync"):
+            if len(synced) >= BULK_PORTS_MIN_DEVICES:
+                with METRICS.phase("ports_fetch"):
+                    ports_by_device = get_librenms_ports_by_device()
+            for _ in imap_bounded(pool, sync_ports, synced, workers * 4):
+                pass
+            if_writer.flush()
+
+    # Con shards, IPs y cables solo de los dispositivos propios
+    owned = {snapshot.device_id(lid) for lid in mgmt_ips} if shard else None
+    if SYNC_IP_ADDRESSES:
+        with METRICS.phase("ip_sync"):
+            sync_ip_addresses(snapshot, mgmt_ips, only_devices=owned)
+    if SYNC_CABLES:
+        with METRICS.phase("cable_sync"):
+            sync_cables(snapshot, only_devices=owned)
+
+    RESOLUTIONS.save()
+    log.info("%s", RESOLVER.summary())
+    if RESOLUTIONS.queue:
+        log.warning("%d modelos pendientes en %s (main.py resolve)", len(RESOLUTIONS.queue), RESOLUTIONS.queue_path)
+
+    if store is not None:
+        store.forget_ports(key for key, _, _ in if_writer.failed)
+        store.close()
+
+    if dev_writer.failed or if_writer.failed:
+        log.error(
+            "Bulk con errores: %d devices, %d interfaces rechazadas", len(dev_writer.failed), len(if_writer.failed)
+        )
+    METRICS.incr("devices_failed", len(dev_writer.failed))
+    METRICS.incr("interfaces_failed", len(if_writer.failed))
+    log.info("%s", METRICS.summary())
+    write_metrics(shard)
 
 
 if __name__ == "__main__":
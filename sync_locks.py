@@ -0,0 +1,75 @@
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin flock, el lock entre procesos no está disponible
+    fcntl = None
+
+
+class KeyedLock:
+    """Un RLock por clave (slug) para serializar el "buscar o crear" entre workers."""
+
+    def __init__(self):
+        self._guard = threading.Lock()
+        self._locks: dict[str, threading.RLock] = {}
+
+    def hold(self, key: str) -> threading.RLock:
+        with self._guard:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = threading.RLock()
+            return lock
+
+
+# Orden de adquisición: modelo -> creación de device-type -> fabricante
+MODEL_LOCKS = KeyedLock()
+DEVICE_TYPE_LOCKS = KeyedLock()
+MANUFACTURER_LOCKS = KeyedLock()
+
+# Evita que varias preguntas interactivas se mezclen en la terminal
+PROMPT_LOCK = threading.Lock()
+
+
+class SharedLock:
+    """
+    Lock entre procesos (flock sobre un fichero) para las ejecuciones por
+    shards: serializa la creación de objetos compartidos (fabricantes,
+    device-types) y la escritura de ficheros comunes. Sin ruta no hace nada.
+
+    `hold()` indica si el lock está activo: en ese caso otro proceso puede
+    haber creado el objeto desde que se cargó el snapshot y hay que volver a
+    consultarlo antes de crearlo.
+    """
+
+    def __init__(self, path: str | None = None):
+        self.path = path
+        self._local = threading.RLock()
+        self._depth = 0
+        self._fh = None
+
+    @contextmanager
+    def hold(self):
+        if not self.path or fcntl is None:
+            yield False
+            return
+        with self._local:
+            if self._depth == 0:
+                self._fh = open(self.path, "a+")
+                fcntl.flock(self._fh, fcntl.LOCK_EX)
+            self._depth += 1
+            try:
+                yield True
+            finally:
+                self._depth -= 1
+                if self._depth == 0:
+                    fcntl.flock(self._fh, fcntl.LOCK_UN)
+                    self._fh.close()
+                    self._fh = None
+
+
+SHARED_LOCK = SharedLock()
+
+
+def set_shared_lock(path: str | None):
+    SHARED_LOCK.path = path
@@ -0,0 +1,70 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+
+from config import LOG_FILE, LOG_FORMAT, LOG_LEVEL
+
+TEXT_FORMAT = "%(asctime)s %(levelname)-7s %(message)s"
+# Atributos propios de LogRecord; el resto llega por `extra` y va tal cual al JSON
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_listener: logging.handlers.QueueListener | None = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por evento: ts, level, logger, msg y los campos de `extra`."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update((k, v) for k, v in vars(record).items() if k not in _RESERVED)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler que deja la excepción para el listener. El de la librería
+    formatea la traza en el hilo que loguea y borra exc_info, así que el
+    JsonFormatter nunca la veía. El mensaje sí se resuelve aquí, porque los
+    argumentos pueden cambiar antes de que el listener lo escriba.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def setup_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT, path: str = LOG_FILE):
+    """
+    Logging del proceso: los hilos de la sync solo encolan cada evento
+    (QueueHandler) y un hilo aparte (QueueListener) lo formatea y lo escribe
+    en stdout o en `path`, de modo que el bucle nunca espera por la E/S del
+    log. Los mensajes por debajo de `level` no llegan a formatearse.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+    else:
+        atexit.register(lambda: _listener.stop())
+    handler = logging.FileHandler(path, encoding="utf-8") if path else logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+    events = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.handlers[:] = [DeferredQueueHandler(events)]
+    root.setLevel(level.upper())
+    # El DEBUG de urllib3 (una línea por conexión) no aporta nada aquí
+    logging.getLogger("urllib3").setLevel(logging.WARNING)
+    _listener = logging.handlers.QueueListener(events, handler)
+    _listener.start()
@@ -0,0 +1,255 @@
+import asyncio
+import collections
+import email.utils
+import logging
+import random
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+import requests
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+from metrics import METRICS, endpoint_label
+
+log = logging.getLogger(__name__)
+
+# Respuestas que se reintentan (lecturas); cualquier 5xx o un 429 además
+# reduce la concurrencia (overloaded)
+RETRY_STATUS = {429, 500, 502, 503, 504}
+# Un POST solo se repite si es seguro que el servidor no lo procesó
+POST_RETRY_STATUS = {429}
+
+
+def backoff_delay(attempt: int, retry_after: float | None = None, base: float = 0.5, cap: float = 30.0) -> float:
+    """Backoff exponencial con jitter completo; Retry-After manda si viene."""
+    if retry_after is not None:
+        return min(retry_after, cap * 4)
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+def _not_sent(exc: requests.ConnectionError) -> bool:
+    """True si la conexión falló antes de enviar la petición (DNS, TCP, TLS)."""
+    if isinstance(exc, requests.ConnectTimeout):
+        return True
+    reason = getattr(exc.args[0], "reason", None) if exc.args else None
+    return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
+
+class TokenBucket:
+    """Limita a `rate` peticiones/s con ráfagas de hasta `burst`. rate=0 desactiva."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Toma un token si lo hay (devuelve 0) o devuelve los segundos que faltan para el siguiente."""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        while (wait := self.reserve()) > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        while (wait := self.reserve()) > 0:
+            await asyncio.sleep(wait)
+
+
+class AIMDController:
+    """
+    Límite de peticiones en vuelo con control AIMD: sube de uno en uno
+    mientras la latencia se mantiene por debajo del objetivo y se reduce a la
+    mitad ante un 429/5xx o una latencia excesiva (como mucho una vez por
+    `cooldown` segundos, para no hundirlo por una sola ráfaga de errores).
+    El mismo límite vale para hilos (slot) y corrutinas (slot_async).
+    """
+
+    def __init__(self, minimum: int, maximum: int, latency_target: float, cooldown: float = 2.0):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = self.minimum
+        self.latency_target = latency_target
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._successes = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+        # Corrutinas esperando hueco: (bucle, future)
+        self._async_waiters: collections.deque = collections.deque()
+
+    def _notify(self):
+        """Despierta a un hilo y a una corrutina en espera (con el lock tomado)."""
+        self._cond.notify()
+        while self._async_waiters:
+            loop, fut = self._async_waiters.popleft()
+            if not fut.done():
+                loop.call_soon_threadsafe(_wake, fut)
+                break
+
+    def _release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._notify()
+
+    @contextmanager
+    def slot(self):
+        with self._cond:
+            while self.in_flight >= self.limit:
+                self._cond.wait()
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            self._release()
+
+    @asynccontextmanager
+    async def slot_async(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._cond:
+                if self.in_flight < self.limit:
+                    self.in_flight += 1
+                    break
+                fut = loop.create_future()
+                self._async_waiters.append((loop, fut))
+            await fut
+        try:
+            yield
+        finally:
+            self._release()
+
+    def record(self, latency: float, overloaded: bool, latency_target: float | None = None):
+        """`latency_target` sustituye al general para peticiones más lentas por naturaleza (bulk)."""
+        target = latency_target or self.latency_target
+        with self._cond:
+            now = time.monotonic()
+            if overloaded or latency > target * 2:
+                if now - self._last_decrease >= self.cooldown:
+                    self.limit = max(self.minimum, self.limit // 2)
+                    self._last_decrease = now
+                self._successes = 0
+                return
+            if latency <= target:
+                self._successes += 1
+                # +1 por cada "ventana" completa de éxitos
+                if self._successes >= self.limit and self.limit < self.maximum:
+                    self.limit += 1
+                    self._successes = 0
+                    self._notify()
+
+
+def _wake(fut: asyncio.Future):
+    if not fut.done():
+        fut.set_result(None)
+
+
+class TransportPolicy:
+    """
+    Política común de acceso HTTP a un backend: token bucket, límite AIMD de
+    concurrencia y reintentos con backoff que respetan Retry-After. Los GET
+    se reintentan ante errores de red y 429/5xx; los POST solo ante un 429 o
+    si la conexión ni siquiera llegó a establecerse, salvo que sean lecturas
+    (`idempotent=True`, p.ej. consultas GraphQL).
+
+    Las escrituras de lista (bulk) tardan proporcionalmente más que un GET:
+    se comparan con `bulk_latency_target` para que un servidor sano no lleve
+    la concurrencia al mínimo.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        rate: float = 0,
+        burst: int = 10,
+        max_retries: int = 5,
+        min_concurrency: int = 1,
+        max_concurrency: int = 32,
+        latency_target: float = 1.0,
+        bulk_latency_target: float | None = None,
+    ):
+        self.name = name
+        self.max_retries = max_retries
+        self.bucket = TokenBucket(rate, burst)
+        self.aimd = AIMDController(min_concurrency, max_concurrency, latency_target)
+        self.bulk_latency_target = bulk_latency_target
+
+    def record(self, method: str, label: str, status, elapsed: float, nbytes: int = 0, bulk: bool = False):
+        """
+        Anota una petición en el control AIMD y en las métricas. `status` es
+        el código HTTP o "error"/"timeout" si no hubo respuesta. Lo usa
+        también el motor asyncio, que hace sus propias peticiones con aiohttp.
+        """
+        overloaded = not isinstance(status, int) or status == 429 or status >= 500
+        self.aimd.record(elapsed, overloaded, self.bulk_latency_target if bulk else None)
+        METRICS.observe_request(self.name.lower(), method, label, status, elapsed, nbytes)
+
+    def _observe(self, method, label, status, start, resp=None, stream=False, bulk=False):
+        nbytes = 0
+        if resp is not None:
+            # En streaming solo se conoce el tamaño si el servidor manda Content-Length
+            nbytes = int(resp.headers.get("Content-Length") or 0) or (0 if stream else len(resp.content))
+        self.record(method, label, status, time.monotonic() - start, nbytes, bulk)
+
+    def request(
+        self, session: requests.Session, method: str, url: str, idempotent: bool | None = None, **kwargs
+    ) -> requests.Response:
+        if idempotent is None:
+            idempotent = method.upper() != "POST"
+        label = endpoint_label(url)
+        bulk = isinstance(kwargs.get("json"), list)
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            with self.aimd.slot():
+                start = time.monotonic()
+                try:
+                    resp = session.request(method, url, **kwargs)
+                except requests.ConnectionError as e:
+                    self._observe(method, label, "error", start, bulk=bulk)
+                    # Un POST cuya conexión falló al establecerse no llegó al servidor
+                    if not (idempotent or _not_sent(e)) or attempt >= self.max_retries:
+                        raise
+                    retry_after = None
+                except requests.Timeout:
+                    self._observe(method, label, "timeout", start, bulk=bulk)
+                    if not idempotent or attempt >= self.max_retries:
+                        raise
+                    retry_after = None
+                else:
+                    self._observe(method, label, resp.status_code, start, resp, kwargs.get("stream", False), bulk)
+                    allowed = RETRY_STATUS if idempotent else POST_RETRY_STATUS
+                    if resp.status_code not in allowed or attempt >= self.max_retries:
+                        return resp
+                    retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+                    resp.close()
+            delay = backoff_delay(attempt, retry_after)
+            log.debug("%s: reintento %d de %s %s en %.1fs", self.name, attempt + 1, method, url, delay)
+            time.sleep(delay)
+            attempt += 1
@@ -0,0 +1,172 @@
+import difflib
+import heapq
+import os
+import re
+from collections import Counter, defaultdict
+from itertools import chain
+from functools import lru_cache
+
+SUGGESTIONS = 4
+MIN_VENDOR_SCORE = 0.3
+# Candidatos (por trigramas compartidos) que se puntúan con difflib
+CANDIDATES = 64
+
+
+def basename(path: str) -> str:
+    return os.path.basename(path)[:-5]
+
+
+def normalize_slug(text: str) -> str:
+    """Normaliza un texto para crear un slug válido"""
+    if not text:
+        return ""
+    # Convertir a minúsculas y reemplazar espacios/guiones bajos con guiones
+    text = text.lower().strip()
+    text = re.sub(r'[\s_]+', '-', text)
+    # Reemplazar caracteres especiales
+    text = text.replace('+', '-plus')
+    # Eliminar caracteres que no sean alfanuméricos o guiones
+    text = re.sub(r'[^a-z0-9\-]', '', text)
+    # Eliminar guiones múltiples y guiones al inicio/final
+    text = re.sub(r'-+', '-', text).strip('-')
+    return text
+
+
+def path_vendor(path: str) -> str:
+    """Fabricante de una ruta device-types/<Fabricante>/<modelo>.yaml, normalizado como el buscado."""
+    parts = path.split("/")
+    return normalize_slug(parts[-2]) if len(parts) >= 2 else ""
+
+
+def exact_key(text: str) -> str:
+    """Clave de comparación exacta: solo minúsculas y dígitos ("+" cuenta, como en normalize_slug)."""
+    return re.sub(r"[^a-z0-9]", "", text.lower().replace("+", "plus"))
+
+
+def trigrams(text: str) -> set[str]:
+    padded = f"  {text} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def rank_difflib(paths: list[str], vendor: str, slug: str, k: int = SUGGESTIONS) -> list[str]:
+    """
+    Ranking de referencia: puntúa todas las rutas con difflib. Es el algoritmo
+    original de find_in_tree (con el filtro por fabricante sobre el segmento
+    <Fabricante> de la ruta) y sirve para validar TreeMatcher.
+    """
+    vendor = normalize_slug(vendor)
+    vendor_paths = [p for p in paths if path_vendor(p) == vendor]
+
+    def score(path: str) -> float:
+        return difflib.SequenceMatcher(None, slug, basename(path)).ratio()
+
+    scores = {p: score(p) for p in vendor_paths}
+    ranked_vendor = sorted(vendor_paths, key=scores.get, reverse=True)
+    suggestions = [p for p in ranked_vendor if scores[p] >= MIN_VENDOR_SCORE][:k]
+    if len(suggestions) < k:
+        chosen = set(suggestions)
+        ranked_global = sorted((p for p in paths if p not in chosen), key=score, reverse=True)
+        suggestions.extend(ranked_global[: k - len(suggestions)])
+    return suggestions
+
+
+class TreeMatcher:
+    """
+    Índice sobre el árbol de devicetype-library para sugerir device-types sin
+    recorrer todas las rutas con difflib:
+
+    - partición por fabricante (segmento <Fabricante> de la ruta, con la
+      misma normalización que el vendor buscado),
+    - índice invertido de trigramas del nombre base para preseleccionar
+      candidatos (coeficiente de Dice),
+    - nombres base precalculados una sola vez.
+
+    Solo los CANDIDATES mejores por Dice se puntúan con el ratio de difflib
+    del algoritmo original, así que el resultado es una aproximación: un
+    candidato con buen ratio pero pocos trigramas en común puede quedarse
+    fuera (benchmarks/bench_find_in_tree mide la coincidencia con difflib).
+    """
+
+    def __init__(self, paths):
+        self.paths = list(paths)
+        self.path_set = set(self.paths)
+        self.names = [basename(p) for p in self.paths]
+        self.gram_sizes = [len(trigrams(name)) for name in self.names]
+        self.by_vendor: dict[str, list[int]] = defaultdict(list)
+        self.index: dict[str, list[int]] = defaultdict(list)
+        # (fabricante, modelo) -> ruta, para rutas device-types/<Fabricante>/<modelo>.yaml;
+        # las claves que comparten varias rutas (DS920 y DS920+) no se aceptan solas
+        self.exact: dict[tuple[str, str], str] = {}
+        self.ambiguous: set[tuple[str, str]] = set()
+        for i, path in enumerate(self.paths):
+            parts = path.split("/")
+            self.by_vendor[path_vendor(path)].append(i)
+            if len(parts) == 3 and parts[0] == "device-types":
+                key = (exact_key(parts[1]), exact_key(self.names[i]))
+                if self.exact.setdefault(key, path) != path:
+                    self.ambiguous.add(key)
+            for gram in trigrams(self.names[i]):
+                self.index[gram].append(i)
+        self.suggest = lru_cache(maxsize=4096)(self._suggest)
+
+    def __contains__(self, path: str) -> bool:
+        return path in self.path_set
+
+    def lookup(self, vendor: str, slug: str) -> str | None:
+        """
+        Ruta cuyo fabricante y modelo coinciden ignorando mayúsculas y signos.
+        None si la clave corresponde a varias rutas: queda para las
+        sugerencias (pregunta o cola de resolución).
+        """
+        key = (exact_key(vendor), exact_key(slug))
+        if key in self.ambiguous:
+            return None
+        return self.exact.get(key)
+
+    def _candidates(self, slug: str, allowed: set[int] | None) -> list[int]:
+        """Ids con mayor similitud de trigramas (Dice) con `slug`, de más a menos."""
+        grams = trigrams(slug)
+        counts = Counter(chain.from_iterable(self.index.get(g, ()) for g in grams))
+        if allowed is not None:
+            counts = {i: n for i, n in counts.items() if i in allowed}
+        size = len(grams)
+        sizes = self.gram_sizes
+        return heapq.nsmallest(
+            CANDIDATES, counts, key=lambda i: (-2 * counts[i] / (size + sizes[i]), i)
+        )
+
+    def _top(self, slug: str, ids, k: int, exclude=(), min_score: float = 0.0) -> list[int]:
+        # difflib precalcula el índice de seq2: la búsqueda va en seq2 y los
+        # candidatos en seq1, así no se reconstruye en cada comparación
+        matcher = difflib.SequenceMatcher(None, "", slug)
+        best: list[tuple[float, int]] = []  # montículo de (score, -id)
+        for i in ids:
+            if i in exclude:
+                continue
+            matcher.set_seq1(self.names[i])
+            # Cotas baratas antes del ratio exacto
+            floor = best[0][0] if len(best) == k else min_score
+            if matcher.real_quick_ratio() < floor or matcher.quick_ratio() < floor:
+                continue
+            score = matcher.ratio()
+            if score < min_score:
+                continue
+            item = (score, -i)
+            if len(best) < k:
+                heapq.heappush(best, item)
+            elif item > best[0]:
+                heapq.heapreplace(best, item)
+        return [-neg for _, neg in sorted(best, reverse=True)]
+
+    def _suggest(self, vendor: str, slug: str, k: int = SUGGESTIONS) -> tuple[str, ...]:
+        vendor_ids = self.by_vendor.get(normalize_slug(vendor), [])
+        if len(vendor_ids) > CANDIDATES:
+            vendor_ids = self._candidates(slug, set(vendor_ids))
+        chosen = self._top(slug, vendor_ids, k, min_score=MIN_VENDOR_SCORE)
+        if len(chosen) < k:
+            candidates = self._candidates(slug, None)
+            if len(candidates) < k:
+                # Búsqueda sin trigramas en común: no queda más que recorrer todo
+                candidates = range(len(self.paths))
+            chosen += self._top(slug, candidates, k - len(chosen), exclude=set(chosen))
+        return tuple(self.paths[i] for i in chosen)